@@ -29,7 +29,7 @@ class Settings(BaseModel):
     DIA_MODEL_ID: str = os.getenv("DIA_MODEL_ID", "nari-labs/Dia-1.6B")
     DIA_MODEL_REV: str = os.getenv("DIA_MODEL_REV", "main")
     HF_TOKEN: Union[str, None] = os.getenv("HF_TOKEN")
-    MAX_CHARS: int = int(os.getenv("MAX_CHARS", "800"))
+    MAX_CHARS: int = int(os.getenv("MAX_CHARS", "2000"))  # long text is segmented, see DIA_SEGMENT_MAX_CHARS
     SUPABASE_URL: str = os.getenv("SUPABASE_URL", "")
     SUPABASE_SERVICE_ROLE_KEY: str = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
     ALLOWED_ORIGINS: list[str] = os.getenv("ALLOWED_ORIGINS", "http://localhost:3000").split(",")
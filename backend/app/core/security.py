@@ -1,37 +1,352 @@
+import base64
+import hashlib
+import hmac
 import os
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import redis
+from fastapi.concurrency import run_in_threadpool
 from supabase import create_client
 from dotenv import load_dotenv
 
+from .config import settings
+
 # Load environment variables from .env file
 load_dotenv()
 
 # Global variable to hold the Supabase client
 _supabase_client = None
 
+# API-key validation cache: valid and invalid answers are kept for different times, valid
+# ones are re-checked in the background before they expire, and revocations published on
+# AUTH_REVOCATION_CHANNEL (see revoke_api_key) drop a key on every replica within seconds
+_AUTH_TTL = float(os.getenv("AUTH_CACHE_TTL", "300"))
+_AUTH_NEGATIVE_TTL = float(os.getenv("AUTH_NEGATIVE_TTL", "30"))
+_AUTH_REFRESH_AHEAD = float(os.getenv("AUTH_REFRESH_AHEAD", "0.2"))    # refresh during the last 20% of a valid entry's TTL
+_AUTH_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+_AUTH_REVOCATION_CHANNEL = os.getenv("AUTH_REVOCATION_CHANNEL", "auth:revoked")
+
+# Signed API keys, "odk1.<key id>.<tier>.<expiry>.<mac>", are verified locally with HMAC-SHA256
+# and never reach Supabase; revoked key ids are synced from revoked_api_keys into memory
+_SIGNING_SECRET = os.getenv("API_KEY_SIGNING_SECRET", "")
+_SIGNING_SECRET_PREVIOUS = os.getenv("API_KEY_SIGNING_SECRET_PREVIOUS", "")  # still accepted while rotating
+_REVOCATION_SYNC_S = float(os.getenv("API_KEY_REVOCATION_SYNC_S", "60"))
+_LEGACY_FREE_KEYS = {k for k in os.getenv("API_KEY_LEGACY_FREE", "test-key").split(",") if k}  # unsigned keys on the free tier
+
+SIGNED_KEY_PREFIX = "odk1"
+_MAC_PATTERN = re.compile(r"[A-Za-z0-9_-]{43}")  # unpadded base64url of a SHA-256 HMAC
+TIERS = ("free", "pro", "biz")
+
 def get_supabase_client():
     global _supabase_client
     if _supabase_client is None:
         supabase_url = os.getenv("SUPABASE_URL", "")
         supabase_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
         print(f"Supabase URL: {supabase_url}")
-        print(f"Supabase Key: {supabase_key[:10]}...")  # Print first 10 characters of the key for debugging
         _supabase_client = create_client(supabase_url, supabase_key)
     return _supabase_client
 
-def validate_api_key(api_key: str) -> bool:
-    if not api_key: 
-        print("No API key provided")
-        return False
+def key_id(api_key: str) -> str:
+    """Stable identifier of an API key that is safe to keep in memory, log or publish."""
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+def _fetch_api_key(api_key: str) -> Optional[bool]:
+    """Whether api_key exists and is active in Supabase; None if the lookup failed."""
     supabase = get_supabase_client()
-    print(f"Validating API key: {api_key}")
     try:
-        data = supabase.table("api_keys").select("api_key,is_active").eq("api_key", api_key).execute()
-        print(f"Query result: {data}")
-        if not data.data: 
-            print("No data returned from query")
+        data = supabase.table("api_keys").select("is_active").eq("api_key", api_key).execute()
+        if not data.data:
             return False
-        print(f"API key found: {data.data[0]}")
         return bool(data.data[0].get("is_active", False))
     except Exception as e:
-        print(f"Error validating API key: {e}")
-        return False
\ No newline at end of file
+        print(f"Error validating API key {key_id(api_key)[:12]}: {e}")
+        return None
+
+class ApiKeyCache:
+    def __init__(self, ttl: float = _AUTH_TTL, negative_ttl: float = _AUTH_NEGATIVE_TTL,
+                 refresh_ahead: float = _AUTH_REFRESH_AHEAD, max_entries: int = _AUTH_MAX_ENTRIES,
+                 channel: str = _AUTH_REVOCATION_CHANNEL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.refresh_ahead = refresh_ahead
+        self.max_entries = max_entries
+        self.channel = channel
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key id -> (valid, expires_at, refresh_at)
+        self._revoked = {}         # key id -> revocation time, so an in-flight refresh can't resurrect it
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._refresher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="auth-refresh")
+        self._stop = threading.Event()
+        self._listener = None
+        self._subscribed = False
+        self.revocation_hooks = []  # called with every revoked id received on the channel
+        self._stats = {"hits": 0, "negative_hits": 0, "misses": 0, "lookup_errors": 0,
+                       "refreshes": 0, "revocations": 0}
+
+    def cached(self, api_key: str) -> Optional[bool]:
+        """The cached answer for api_key, or None if it must be looked up."""
+        kid = key_id(api_key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(kid)
+            if entry is None or entry[1] <= now:
+                return None
+            self._entries.move_to_end(kid)
+            valid, _, refresh_at = entry
+            refresh = valid and now >= refresh_at and kid not in self._refreshing
+            if refresh:
+                self._refreshing.add(kid)
+        self._stats["hits" if valid else "negative_hits"] += 1
+        if refresh:
+            self._refresher.submit(self._refresh, api_key, kid)
+        return valid
+
+    def validate(self, api_key: str) -> bool:
+        valid = self.cached(api_key)
+        if valid is not None:
+            return valid
+        self._stats["misses"] += 1
+        started = time.monotonic()
+        valid = _fetch_api_key(api_key)
+        if valid is None:
+            self._stats["lookup_errors"] += 1
+            return False  # not cached: a Supabase hiccup mustn't lock a key out
+        self._store(key_id(api_key), valid, started)
+        return valid
+
+    def _refresh(self, api_key: str, kid: str) -> None:
+        try:
+            started = time.monotonic()
+            valid = _fetch_api_key(api_key)
+            if valid is not None:
+                self._stats["refreshes"] += 1
+                self._store(kid, valid, started)
+        finally:
+            with self._lock:
+                self._refreshing.discard(kid)
+
+    def _store(self, kid: str, valid: bool, fetched_at: float) -> None:
+        now = time.monotonic()
+        ttl = self.ttl if valid else self.negative_ttl
+        with self._lock:
+            if valid and self._revoked.get(kid, -1.0) >= fetched_at:
+                return  # revoked while we were asking
+            self._entries[kid] = (valid, now + ttl, now + ttl * (1 - self.refresh_ahead))
+            self._entries.move_to_end(kid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, kid: str) -> None:
+        """Forget a key (by key_id) here; the next request looks it up again."""
+        now = time.monotonic()
+        with self._lock:
+            self._entries.pop(kid, None)
+            self._revoked[kid] = now
+            # Only in-flight lookups can race a revocation; older tombstones are not needed
+            for old in [k for k, t in self._revoked.items() if t < now - self.ttl]:
+                del self._revoked[old]
+        self._stats["revocations"] += 1
+
+    def start(self) -> None:
+        """Listen for revocations published by other processes (no-op if already listening)."""
+        if self._listener is None and self.channel:
+            self._stop.clear()
+            self._listener = threading.Thread(target=self._listen, name="auth-revocations", daemon=True)
+            self._listener.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._refresher.shutdown(wait=False)
+
+    def _listen(self) -> None:
+        delay = 1.0
+        while not self._stop.is_set():
+            pubsub = None
+            try:
+                client = redis.from_url(settings.REDIS_URL, socket_connect_timeout=2, health_check_interval=30)
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # Revocations sent while we weren't subscribed are lost: re-check every valid key
+                with self._lock:
+                    for kid in [k for k, entry in self._entries.items() if entry[0]]:
+                        del self._entries[kid]
+                self._subscribed = True
+                delay = 1.0
+                while not self._stop.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and message.get("type") == "message":
+                        data = message["data"]
+                        revoked = data.decode() if isinstance(data, bytes) else str(data)
+                        self.invalidate(revoked)
+                        for hook in self.revocation_hooks:
+                            hook(revoked)
+            except (redis.RedisError, OSError) as e:
+                if self._subscribed:
+                    print(f"Auth revocation listener disconnected ({e}); retrying")
+                self._subscribed = False
+                self._stop.wait(delay)
+                delay = min(delay * 2, 30.0)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except (redis.RedisError, OSError):
+                        pass
+
+    def stats(self) -> dict:
+        lookups = self._stats["hits"] + self._stats["negative_hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "hit_rate": (lookups - self._stats["misses"]) / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "ttl": self.ttl,
+            "negative_ttl": self.negative_ttl,
+            "revocation_listener": self._subscribed,
+        }
+
+api_key_cache = ApiKeyCache()
+
+class KeyClaims:
+    __slots__ = ("key_id", "tier", "expires")
+
+    def __init__(self, key_id: str, tier: str, expires: int):
+        self.key_id = key_id
+        self.tier = tier
+        self.expires = expires  # unix seconds, 0 = never
+
+def _mac(secret: str, payload: str) -> str:
+    digest = hmac.new(secret.encode(), payload.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+def _parse_signed(api_key: str):
+    """(claims, payload, mac) for a key in the signed format, else None; the signature is not checked."""
+    parts = api_key.split(".")
+    if len(parts) != 5 or parts[0] != SIGNED_KEY_PREFIX or parts[2] not in TIERS or not (parts[3].isascii() and parts[3].isdigit()):
+        return None
+    # compare_digest() rejects non-ASCII str, so anything but a well-formed MAC stops here
+    if not _MAC_PATTERN.fullmatch(parts[4]):
+        return None
+    return KeyClaims(parts[1], parts[2], int(parts[3])), api_key[:api_key.rindex(".")], parts[4]
+
+class SignedKeys:
+    def __init__(self, secret: str = _SIGNING_SECRET, previous_secret: str = _SIGNING_SECRET_PREVIOUS,
+                 sync_interval: float = _REVOCATION_SYNC_S):
+        self.secrets = [k for k in (secret, previous_secret) if k]
+        self.sync_interval = sync_interval
+        self._revoked = set()
+        self._synced_at = None
+        self._stop = threading.Event()
+        self._syncer = None
+        self._stats = {"verified": 0, "bad_signature": 0, "expired": 0, "revoked": 0, "sync_errors": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.secrets)
+
+    def issue(self, tier: str, expires: int = 0, key_id: Optional[str] = None) -> str:
+        """A new signed key for tier, valid until `expires` (unix seconds, 0 = no expiry)."""
+        if not self.enabled:
+            raise RuntimeError("API_KEY_SIGNING_SECRET is not set")
+        if tier not in TIERS:
+            raise ValueError(f"tier must be one of {', '.join(TIERS)}")
+        payload = f"{SIGNED_KEY_PREFIX}.{key_id or secrets.token_hex(8)}.{tier}.{int(expires)}"
+        return f"{payload}.{_mac(self.secrets[0], payload)}"
+
+    def verify(self, api_key: str) -> Optional[KeyClaims]:
+        """The key's claims if its signature is valid and it is neither expired nor revoked."""
+        parsed = _parse_signed(api_key)
+        if parsed is None or not self.enabled:
+            return None
+        claims, payload, mac = parsed
+        if not any(hmac.compare_digest(mac, _mac(secret, payload)) for secret in self.secrets):
+            self._stats["bad_signature"] += 1
+            return None
+        if claims.expires and claims.expires <= time.time():
+            self._stats["expired"] += 1
+            return None
+        if claims.key_id in self._revoked:
+            self._stats["revoked"] += 1
+            return None
+        self._stats["verified"] += 1
+        return claims
+
+    def revoke(self, key_id: str) -> None:
+        self._revoked.add(key_id)
+
+    def start(self) -> None:
+        """Keep the revocation list in sync (no-op without a signing secret)."""
+        if self.enabled and self._syncer is None:
+            self._syncer = threading.Thread(target=self._sync_loop, name="api-key-revocations", daemon=True)
+            self._syncer.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _sync_loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                rows = get_supabase_client().table("revoked_api_keys").select("key_id").execute().data or []
+                # Revocations are permanent, so the list only grows; pub/sub ones land here first
+                self._revoked.update(row["key_id"] for row in rows)
+                self._synced_at = time.time()
+            except Exception as e:
+                self._stats["sync_errors"] += 1
+                print(f"Could not sync revoked API keys: {e}")
+            self._stop.wait(self.sync_interval)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            **self._stats,
+            "revoked_keys": len(self._revoked),
+            "synced_ago_s": time.time() - self._synced_at if self._synced_at else None,
+        }
+
+signed_keys = SignedKeys()
+api_key_cache.revocation_hooks.append(signed_keys.revoke)
+
+def is_signed_key(api_key: str) -> bool:
+    return api_key.startswith(SIGNED_KEY_PREFIX + ".")
+
+def key_tier(api_key: str) -> str:
+    """The tier of a key: carried in signed keys; unsigned keys are pro unless listed in API_KEY_LEGACY_FREE."""
+    if is_signed_key(api_key):
+        claims = signed_keys.verify(api_key)
+        return claims.tier if claims is not None else "free"
+    return "free" if api_key in _LEGACY_FREE_KEYS else "pro"
+
+def validate_api_key(api_key: str) -> bool:
+    if not api_key:
+        return False
+    if is_signed_key(api_key) and signed_keys.enabled:
+        return signed_keys.verify(api_key) is not None
+    return api_key_cache.validate(api_key)
+
+async def validate_api_key_async(api_key: str) -> bool:
+    """validate_api_key() for async handlers: signed keys and cached answers without leaving the event loop."""
+    if not api_key:
+        return False
+    if is_signed_key(api_key) and signed_keys.enabled:
+        return signed_keys.verify(api_key) is not None
+    valid = api_key_cache.cached(api_key)
+    if valid is not None:
+        return valid
+    return await run_in_threadpool(api_key_cache.validate, api_key)
+
+def revocation_id(api_key: str) -> str:
+    """What revocations of api_key are published as: the key id of a signed key, else key_id()."""
+    parsed = _parse_signed(api_key) if is_signed_key(api_key) else None
+    return parsed[0].key_id if parsed is not None else key_id(api_key)
+
+def revoke_api_key(api_key: str) -> int:
+    """Drop api_key on every replica (validation cache or signed-key revocation list); returns listeners reached."""
+    rid = revocation_id(api_key)
+    api_key_cache.invalidate(rid)
+    signed_keys.revoke(rid)
+    return redis.from_url(settings.REDIS_URL, socket_connect_timeout=2).publish(_AUTH_REVOCATION_CHANNEL, rid)
@@ -20,6 +20,22 @@ app.include_router(voice_router.router)
 # Startup event to initialize services
 @app.on_event("startup")
 async def startup_event():
+    # Pin this process to its replica's cores when it synthesizes in-process
+    from .services.workers import workers_enabled
+    if not workers_enabled():
+        from .services.topology import apply_process_layout
+        apply_process_layout()
+
+    # Drop revoked API keys from the validation cache as soon as they are published,
+    # and keep the signed-key revocation list in sync (API_KEY_SIGNING_SECRET)
+    from .core.security import api_key_cache, signed_keys
+    api_key_cache.start()
+    signed_keys.start()
+
+    # Usage records are queued by the request handlers and written to Supabase in batches
+    from .services.usage import usage_logger
+    usage_logger.start()
+
     # Initialize speaker encoder for voice cloning
     try:
         from .services.voice_clone import load_encoder
@@ -28,5 +44,45 @@ async def startup_event():
     except Exception as e:
         print(f"Warning: Could not initialize speaker encoder: {e}")
 
+    # Pre-encode fallback tones so fallbacks never hit the encoder
+    from .services.assets import audio_assets
+    audio_assets.build()
+
+    # Start out-of-process inference workers (DIA_WORKERS > 0)
+    from .services.workers import start_worker_pool
+    start_worker_pool(settings.DIA_MODEL_ID, settings.HF_TOKEN if settings.HF_TOKEN else None, settings.DIA_MODEL_REV)
+
+    # Write the request log (REQUEST_LOG_PATH) off the event loop
+    from .services.request_log import request_log
+    request_log.start()
+
+    # Sample synthesis pressure for the load-shedding breaker
+    from .services.load import load_breaker
+    load_breaker.start()
+
+    # Serve the previous model revision's audio while the new one fills the cache (DIA_STALE_MODEL_REV)
+    from .services.stale import stale_revision
+    await stale_revision.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    from .services.workers import stop_worker_pool
+    from .services.budget import token_budget
+    from .services.cache import close_redis
+    from .services.request_log import request_log
+    from .services.stale import stale_revision
+    from .services.usage import usage_logger
+    from .services.load import load_breaker
+    from .core.security import api_key_cache, signed_keys
+    await stale_revision.stop()
+    load_breaker.stop()
+    api_key_cache.stop()
+    signed_keys.stop()
+    stop_worker_pool()
+    token_budget.save()
+    request_log.stop()
+    usage_logger.stop()
+    await close_redis()
+
 if __name__ == "__main__":
     uvicorn.run("app.main:app", host="0.0.0.0", port=settings.PORT, reload=False)
\ No newline at end of file
@@ -1,13 +1,35 @@
+import asyncio
+import threading
 import time
+import weakref
 from fastapi import APIRouter, Header, HTTPException, Request
 from pydantic import BaseModel
 from typing import Union
-from ..core.security import validate_api_key
-from ..services.dia import load_model, synthesize, synthesize_streaming
-from ..services.cache import get_audio, set_audio
+from ..core.security import api_key_cache, signed_keys, validate_api_key, validate_api_key_async
+from ..services.dia import load_model, synthesize_streaming, batch_stats, model_info
+from ..services.cache import as_blocks, peek, cache_stats
+from ..services.encoder import DEFAULT_MP3_BITRATE, MEDIA_TYPES
+from ..services.variants import (
+    canonical_key, get_variant, render_canonical, store_streamed, store_variant, stream_variant, transcode,
+    validate_variant, variant_quality, variant_stats,
+)
+from ..services.mp3 import aiter_frame_chunks
+from ..services.singleflight import synthesis_flight
+from ..services.stale import stale_revision
+from ..services.segment_cache import segment_cache_stats
+from ..services.textnorm import canonicalize_text
+from ..services.request_log import request_log
+from ..services.usage import log_usage, usage_logger
+from ..services.ratelimit import rate_limiter
+from ..services.load import load_breaker
 from ..services.voice import voice_service
+from ..services.workers import get_worker_pool
+from ..services.assets import audio_assets
+from ..services.budget import token_budget
+from ..services.topology import topology_stats
 from ..core.config import settings
-from ..middleware.security import rate_limit_tts, log_request, add_watermark_for_free_tier, gpu_circuit_breaker
+from ..middleware.security import rate_limit_tts, log_request, add_watermark_for_free_tier, admit_synthesis
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import Response, StreamingResponse
 
 router = APIRouter()
@@ -17,12 +39,17 @@ _metrics = {
     "total_requests": 0,
     "cache_hits": 0,
     "total_latency": 0.0,  # Changed to float
-    "error_count": 0
+    "error_count": 0,
+    "stream_requests": 0,
+    "stream_first_audio_latency": 0.0,  # time from request to first streamed chunk
+    "stream_total_latency": 0.0         # time from request to last streamed chunk
 }
 
 class TTSReq(BaseModel):
     text: str
     voice_id: Union[str, None] = None
+    format: str = "mp3"                  # mp3, opus, wav, flac or pcm
+    bitrate: Union[int, None] = None     # kbps, mp3 only (default AUDIO_MP3_BITRATE)
 
 @router.get("/health")
 def health():
@@ -37,13 +64,38 @@ def metrics():
     else:
         avg_latency = 0.0
         cache_hit_rate = 0.0
+    if _metrics["stream_requests"] > 0:
+        avg_first_audio = _metrics["stream_first_audio_latency"] / _metrics["stream_requests"]
+        avg_stream_total = _metrics["stream_total_latency"] / _metrics["stream_requests"]
+    else:
+        avg_first_audio = 0.0
+        avg_stream_total = 0.0
     
     return {
         "total_requests": _metrics["total_requests"],
         "cache_hit_rate": cache_hit_rate,
         "average_latency": avg_latency,
         "error_count": _metrics["error_count"],
-        "cache_hits": _metrics["cache_hits"]
+        "cache_hits": _metrics["cache_hits"],
+        "cache": cache_stats(),
+        "coalescing": synthesis_flight.stats(),
+        "auth": api_key_cache.stats(),
+        "usage": usage_logger.stats(),
+        "rate_limits": rate_limiter.stats(),
+        "load_breaker": load_breaker.stats(),
+        "signed_keys": signed_keys.stats(),
+        "stale_revision": stale_revision.stats(),
+        "segment_cache": segment_cache_stats(),
+        "variants": variant_stats(),
+        "stream_requests": _metrics["stream_requests"],
+        "stream_average_time_to_first_audio": avg_first_audio,
+        "stream_average_total_time": avg_stream_total,
+        "model": model_info(),
+        "batching": batch_stats(),
+        "generation_budget": token_budget.stats(),
+        "fallback": audio_assets.stats(),
+        "topology": topology_stats(),
+        "workers": get_worker_pool().stats() if get_worker_pool() is not None else {"workers": 0}
     }
 
 @router.get("/voices")
@@ -58,90 +110,300 @@ def list_voices(x_api_key: Union[str, None] = Header(None)):
         "custom": []
     }
 
+async def _prepare_synthesis(voice_id: Union[str, None], x_api_key: Union[str, None]):
+    """Load the model and the speaker embedding for voice_id (None for the base voice)."""
+    # Load speaker embedding if voice_id is provided
+    speaker_embed = None
+    if voice_id and voice_id != "base":
+        # Extract user ID from API key (simplified for now)
+        user_id = x_api_key or "default"
+        speaker_embed = await run_in_threadpool(voice_service.load_voice_profile, user_id, voice_id)
+
+    # Model loading and synthesis block; keep them off the event loop
+    await run_in_threadpool(load_model, settings.DIA_MODEL_ID, settings.HF_TOKEN if settings.HF_TOKEN else None, settings.DIA_MODEL_REV)
+    return speaker_embed
+
+def _renderer(text: str, voice_id: Union[str, None], x_api_key: Union[str, None]):
+    """The synthesis for a cache miss: render() caches the canonical audio and returns (canonical, cacheable)."""
+    async def render():
+        speaker_embed = await _prepare_synthesis(voice_id, x_api_key)
+        # Only segments missing from the segment cache are synthesized
+        return await render_canonical(text, voice_id, speaker_embed, settings.DIA_MODEL_REV)
+    return render
+
+def _canonical_lookup(key: str):
+    """Single-flight lookup: the canonical audio another synthesis cached under key."""
+    async def lookup():
+        canonical = await peek(key)
+        return (canonical, True) if canonical is not None else None
+    return lookup
+
 @router.post("/tts")
 @rate_limit_tts()
 @log_request()
 @add_watermark_for_free_tier()
-@gpu_circuit_breaker()
-def tts(req: TTSReq, request: Request, x_api_key: Union[str, None] = Header(None)):
+async def tts(req: TTSReq, request: Request, x_api_key: Union[str, None] = Header(None)):
     _metrics["total_requests"] += 1
     start_time = time.time()
     
-    if not validate_api_key(x_api_key or ""):
+    if not await validate_api_key_async(x_api_key or ""):
         _metrics["error_count"] += 1
         raise HTTPException(status_code=401, detail="Invalid API key")
-    text = (req.text or "").strip()
+    # Length is checked on the raw input first, so oversized bodies are never canonicalized
+    if len(req.text or "") > settings.MAX_CHARS:
+        _metrics["error_count"] += 1
+        raise HTTPException(status_code=400, detail=f"text is required and must be ≤ {settings.MAX_CHARS} chars")
+    # Canonical text is both the cache key input and what gets synthesized
+    text = canonicalize_text(req.text or "")
     if not text or len(text) > settings.MAX_CHARS:
         _metrics["error_count"] += 1
         raise HTTPException(status_code=400, detail=f"text is required and must be ≤ {settings.MAX_CHARS} chars")
+    request_log.record(text, req.voice_id)
+    fmt = (req.format or "mp3").lower()
+    bitrate = req.bitrate or DEFAULT_MP3_BITRATE
+    error = validate_variant(fmt, bitrate)
+    if error:
+        _metrics["error_count"] += 1
+        raise HTTPException(status_code=400, detail=error)
 
-    # Use enhanced cache key with model revision
-    cached = get_audio(text, req.voice_id, settings.DIA_MODEL_REV)
+    # Derived-format cache, else transcoded from the cached canonical audio
+    key = canonical_key(text, req.voice_id, settings.DIA_MODEL_REV)
+    render = _renderer(text, req.voice_id, x_api_key)
+    cached = await get_variant(text, req.voice_id, fmt, bitrate, settings.DIA_MODEL_REV)
+    stale_rev = stale_revision.fallback_rev() if not cached else None
+    if stale_rev:
+        # Right after a model rollout: serve the previous revision's audio, refresh in the background
+        cached = await get_variant(text, req.voice_id, fmt, bitrate, stale_rev)
+        if cached:
+            stale_revision.served(key, render, _canonical_lookup(key))
     if cached:
         _metrics["cache_hits"] += 1
         duration_ms = int((time.time()-start_time)*1000)
         _metrics["total_latency"] += (time.time() - start_time)
+        log_usage(x_api_key, len(text), duration_ms, True)
         # Add watermark for free tier users if requested
         if hasattr(request.state, 'add_watermark') and request.state.add_watermark:
             # In a real implementation, we would add a watermark to the audio
             print("Adding watermark to cached audio for free tier user")
-        return Response(content=cached, media_type="audio/mpeg")
+        return Response(content=cached, media_type=MEDIA_TYPES[fmt])
 
-    # Load speaker embedding if voice_id is provided
-    speaker_embed = None
-    if req.voice_id and req.voice_id != "base":
-        # Extract user ID from API key (simplified for now)
-        user_id = x_api_key or "default"
-        speaker_embed = voice_service.load_voice_profile(user_id, req.voice_id)
-    
-    load_model(settings.DIA_MODEL_ID, settings.HF_TOKEN if settings.HF_TOKEN else None, settings.DIA_MODEL_REV)
-    audio_mp3 = synthesize(text, speaker_embed=speaker_embed)
+    # Only misses cost a synthesis, so only misses are subject to load shedding
+    probe = admit_synthesis()
+    ok = False
+    try:
+        # Identical concurrent misses (here or on other replicas) share one synthesis
+        canonical, cacheable = await synthesis_flight.do(key, render, _canonical_lookup(key))
+        audio = await transcode(canonical, fmt, bitrate)
+        ok = True
+    finally:
+        load_breaker.release(ok, probe)
+    if cacheable:
+        await store_variant(text, req.voice_id, audio, fmt, bitrate, settings.DIA_MODEL_REV)
     
     # Add watermark for free tier users if requested
     if hasattr(request.state, 'add_watermark') and request.state.add_watermark:
         # In a real implementation, we would add a watermark to the audio
         print("Adding watermark to generated audio for free tier user")
     
-    # Use enhanced cache key with model revision
-    set_audio(text, req.voice_id, audio_mp3, settings.DIA_MODEL_REV)
     _metrics["total_latency"] += (time.time() - start_time)
     duration_ms = int((time.time()-start_time)*1000)
-    return Response(content=audio_mp3, media_type="audio/mpeg")
+    log_usage(x_api_key, len(text), duration_ms, False)
+    return Response(content=audio, media_type=MEDIA_TYPES[fmt])
 
 @router.post("/tts/stream")
 @rate_limit_tts()
 @log_request()
 @add_watermark_for_free_tier()
-@gpu_circuit_breaker()
-def tts_stream(req: TTSReq, request: Request, x_api_key: Union[str, None] = Header(None)):
+async def tts_stream(req: TTSReq, request: Request, x_api_key: Union[str, None] = Header(None)):
     _metrics["total_requests"] += 1
     start_time = time.time()
     
-    if not validate_api_key(x_api_key or ""):
+    if not await validate_api_key_async(x_api_key or ""):
         _metrics["error_count"] += 1
         raise HTTPException(status_code=401, detail="Invalid API key")
-    text = (req.text or "").strip()
+    # Length is checked on the raw input first, so oversized bodies are never canonicalized
+    if len(req.text or "") > settings.MAX_CHARS:
+        _metrics["error_count"] += 1
+        raise HTTPException(status_code=400, detail=f"text is required and must be ≤ {settings.MAX_CHARS} chars")
+    # Canonical text is both the cache key input and what gets synthesized
+    text = canonicalize_text(req.text or "")
     if not text or len(text) > settings.MAX_CHARS:
         _metrics["error_count"] += 1
         raise HTTPException(status_code=400, detail=f"text is required and must be ≤ {settings.MAX_CHARS} chars")
+    request_log.record(text, req.voice_id)
+    fmt = (req.format or "mp3").lower()
+    bitrate = req.bitrate or DEFAULT_MP3_BITRATE
+    error = validate_variant(fmt, bitrate)
+    if error:
+        _metrics["error_count"] += 1
+        raise HTTPException(status_code=400, detail=error)
+    add_watermark = hasattr(request.state, 'add_watermark') and request.state.add_watermark
+    key = canonical_key(text, req.voice_id, settings.DIA_MODEL_REV)
 
-    # Load speaker embedding if voice_id is provided
-    speaker_embed = None
-    if req.voice_id and req.voice_id != "base":
-        # Extract user ID from API key (simplified for now)
-        user_id = x_api_key or "default"
-        speaker_embed = voice_service.load_voice_profile(user_id, req.voice_id)
-    
-    load_model(settings.DIA_MODEL_ID, settings.HF_TOKEN if settings.HF_TOKEN else None, settings.DIA_MODEL_REV)
-    
-    def generate():
+    if variant_quality(fmt, bitrate) != "standard":
+        # Only the default MP3 is encoded incrementally; other variants are served whole, like /tts
+        render = _renderer(text, req.voice_id, x_api_key)
+        audio = await get_variant(text, req.voice_id, fmt, bitrate, settings.DIA_MODEL_REV)
+        stale_rev = stale_revision.fallback_rev() if not audio else None
+        if stale_rev:
+            audio = await get_variant(text, req.voice_id, fmt, bitrate, stale_rev)
+            if audio:
+                stale_revision.served(key, render, _canonical_lookup(key))
+        cache_hit = bool(audio)
+        if cache_hit:
+            _metrics["cache_hits"] += 1
+        else:
+            probe = admit_synthesis()
+            ok = False
+            try:
+                canonical, cacheable = await synthesis_flight.do(key, render, _canonical_lookup(key))
+                audio = await transcode(canonical, fmt, bitrate)
+                ok = True
+            finally:
+                load_breaker.release(ok, probe)
+            if cacheable:
+                await store_variant(text, req.voice_id, audio, fmt, bitrate, settings.DIA_MODEL_REV)
+
+        async def replay_variant():
+            if add_watermark:
+                print("Adding watermark to streamed audio for free tier user")
+            first_audio = None
+            blocks = as_blocks(audio)
+            try:
+                async for chunk in (aiter_frame_chunks(blocks) if fmt == "mp3" else blocks):
+                    if first_audio is None:
+                        first_audio = time.time() - start_time
+                    yield chunk
+            finally:
+                # Logged even if the client leaves mid-stream: the audio was produced either way
+                _record_stream(first_audio, time.time() - start_time)
+                log_usage(x_api_key, len(text), int((time.time() - start_time) * 1000), cache_hit)
+
+        return StreamingResponse(replay_variant(), media_type=MEDIA_TYPES[fmt])
+
+    # Cached audio streams straight from the cache, re-cut on frame boundaries
+    blocks = await stream_variant(text, req.voice_id, settings.DIA_MODEL_REV)
+    stale_rev = stale_revision.fallback_rev() if blocks is None else None
+    if stale_rev:
+        # Right after a model rollout: stream the previous revision's audio, refresh in the background
+        blocks = await stream_variant(text, req.voice_id, stale_rev)
+        if blocks is not None:
+            stale_revision.served(key, _renderer(text, req.voice_id, x_api_key), _canonical_lookup(key))
+    if blocks is not None:
+        _metrics["cache_hits"] += 1
+
+        async def replay():
+            if add_watermark:
+                print("Adding watermark to cached streamed audio for free tier user")
+            first_audio = None
+            try:
+                async for chunk in aiter_frame_chunks(blocks):
+                    if first_audio is None:
+                        first_audio = time.time() - start_time
+                    yield chunk
+            finally:
+                _record_stream(first_audio, time.time() - start_time)
+                log_usage(x_api_key, len(text), int((time.time() - start_time) * 1000), True)
+
+        return StreamingResponse(replay(), media_type="audio/mpeg")
+
+    # A miss goes through the single-flight lease like /tts. The request whose compute() leads the
+    # flight streams the MP3 as it is encoded; identical requests get the finished audio.
+    loop = asyncio.get_running_loop()
+    chunks: asyncio.Queue = asyncio.Queue()  # the leader's MP3 chunks, then None
+    abandoned = threading.Event()            # the leader's client left and nobody else was waiting
+
+    async def compute():
+        speaker_embed = await _prepare_synthesis(req.voice_id, x_api_key)
+        fallback = threading.Event()
+        pcm, mp3 = [], []
+
+        def produce():
+            stream = synthesize_streaming(text, speaker_embed, fallback=fallback, pcm_sink=pcm.append)
+            try:
+                for chunk in stream:
+                    if abandoned.is_set():
+                        return  # closing the stream stops generation
+                    mp3.append(chunk)
+                    loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+            finally:
+                stream.close()
+        try:
+            await run_in_threadpool(produce)
+        finally:
+            chunks.put_nowait(None)
+        if abandoned.is_set():
+            if not synthesis_flight.waiters(key):
+                raise asyncio.CancelledError()  # partial audio: nothing to serve or cache
+            # A request joined after the leader's client left; it needs the whole clip
+            return await _renderer(text, req.voice_id, x_api_key)()
+        # Fallback tones are served but never cached as speech
+        cacheable = not fallback.is_set()
+        canonical = await store_streamed(text, req.voice_id, b"".join(pcm), b"".join(mp3), cacheable, settings.DIA_MODEL_REV)
+        return canonical, cacheable
+
+    async def generate():
         # Add watermark for free tier users if requested
-        add_watermark = hasattr(request.state, 'add_watermark') and request.state.add_watermark
         if add_watermark:
             print("Adding watermark to streamed audio for free tier user")
-        
-        for chunk in synthesize_streaming(text, speaker_embed):
-            yield chunk
-    
-    _metrics["total_latency"] += (time.time() - start_time)
-    return StreamingResponse(generate(), media_type="audio/mpeg")
\ No newline at end of file
+
+        first_audio = None
+        streamed = False
+        ok = False
+        flight = asyncio.ensure_future(synthesis_flight.do(key, compute, _canonical_lookup(key)))
+        getter = None
+        try:
+            while True:
+                getter = asyncio.ensure_future(chunks.get())
+                done, _ = await asyncio.wait({getter, flight}, return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    chunk = getter.result()
+                else:
+                    # The flight is over: whatever compute() queued here is already in the queue
+                    getter.cancel()
+                    chunk = None if chunks.empty() else chunks.get_nowait()
+                if chunk is None:
+                    break
+                if first_audio is None:
+                    first_audio = time.time() - start_time
+                streamed = True
+                yield chunk
+            canonical, cacheable = await flight
+            if not streamed:
+                # Another request led the synthesis
+                audio = await transcode(canonical, "mp3")
+                if cacheable:
+                    await store_variant(text, req.voice_id, audio, "mp3", DEFAULT_MP3_BITRATE, settings.DIA_MODEL_REV)
+                async for chunk in aiter_frame_chunks(as_blocks(audio)):
+                    if first_audio is None:
+                        first_audio = time.time() - start_time
+                    yield chunk
+            ok = True
+        finally:
+            if getter is not None:
+                getter.cancel()
+            if not flight.done():
+                # The client left. Stop the synthesis unless another request here is waiting on it
+                # (a replica waiting on the lease takes it over once this flight lets go)
+                if synthesis_flight.waiters(key) <= 1:
+                    abandoned.set()
+                flight.cancel()
+            # The breaker slot is held until the body is done, not just until the response is returned
+            if unreleased.detach():
+                load_breaker.release(ok, probe)
+            # Logged with the partial duration if the client left mid-stream
+            _record_stream(first_audio, time.time() - start_time)
+            log_usage(x_api_key, len(text), int((time.time() - start_time) * 1000), False)
+
+    probe = admit_synthesis()
+    body = generate()
+    # A response cancelled before its body starts never runs generate(), so release on collection too
+    unreleased = weakref.finalize(body, load_breaker.release, True, probe)
+    return StreamingResponse(body, media_type="audio/mpeg")
+
+def _record_stream(first_audio, total):
+    _metrics["stream_requests"] += 1
+    _metrics["stream_first_audio_latency"] += first_audio if first_audio is not None else total
+    _metrics["stream_total_latency"] += total
+    _metrics["total_latency"] += total
+    print(f"Stream completed: first audio {first_audio if first_audio is not None else total:.2f}s, total {total:.2f}s")
@@ -4,7 +4,7 @@ import tempfile
 import uuid
 from fastapi import APIRouter, Header, HTTPException, UploadFile, File, Request
 from typing import Union, List
-from ..core.security import validate_api_key
+from ..core.security import validate_api_key, validate_api_key_async
 from ..core.config import settings
 from ..services.voice_clone import (
     extract_embedding, 
@@ -44,7 +44,7 @@ async def clone_voice(
     consent: str = Form(...),  # Require consent
     x_api_key: Union[str, None] = Header(None)
 ):
-    if not validate_api_key(x_api_key or ""):
+    if not await validate_api_key_async(x_api_key or ""):
         raise HTTPException(status_code=401, detail="Invalid API key")
     
     # Validate consent
@@ -0,0 +1,153 @@
+"""
+Frequency-aware admission and TTLs for the audio cache.
+
+With CACHE_POLICY=tinylfu, every cache lookup is counted in a TinyLFU-style
+count-min sketch (4-bit saturating counters, all halved every `sample`
+increments so old popularity fades). When an entry is written, its estimated
+frequency decides how long it stays:
+
+    probation  first seen           CACHE_PROBATION_TTL (0 = not admitted until seen again)
+    standard   seen again           the caller's TTL (ttl_for())
+    hot        >= CACHE_HOT_HITS     CACHE_HOT_TTL
+
+A hit on an entry with less than half of its class TTL left is extended to the
+full class TTL, so reused entries stay and one-hit wonders age out quickly
+instead of holding memory for a day. CACHE_POLICY=fixed keeps the caller's TTL
+for everything. The sketch is per process: each replica learns from its own
+traffic.
+"""
+import os
+import threading
+from typing import Optional
+
+CACHE_POLICY = os.getenv("CACHE_POLICY", "tinylfu")                   # tinylfu or fixed
+_SKETCH_WIDTH = int(os.getenv("CACHE_SKETCH_WIDTH", "65536"))          # counters per row, rounded up to a power of two
+_PROBATION_TTL = int(os.getenv("CACHE_PROBATION_TTL", "900"))
+_STANDARD_TTL = int(os.getenv("CACHE_STANDARD_TTL", "86400"))          # extension target for entries seen again
+_HOT_HITS = int(os.getenv("CACHE_HOT_HITS", "4"))
+_HOT_TTL = int(os.getenv("CACHE_HOT_TTL", str(7 * 86400)))
+
+_DEPTH = 4
+_MAX_COUNT = 15
+_HALVE = bytes(b >> 1 for b in range(256))  # translate() table: halves every counter in one C pass
+
+
+class FrequencySketch:
+    """Count-min sketch of recent access frequency with periodic aging."""
+
+    def __init__(self, width: int = _SKETCH_WIDTH):
+        self.width = 1 << max(4, (max(1, width) - 1).bit_length())
+        self._mask = self.width - 1
+        self._table = bytearray(_DEPTH * self.width)
+        self.sample = 10 * self.width  # increments between halvings
+        self._additions = 0
+        self.resets = 0
+
+    def _slots(self, key: str):
+        h = hash(key)
+        step = (h >> 32) | 1
+        return [row * self.width + ((h + row * step) & self._mask) for row in range(_DEPTH)]
+
+    def increment(self, key: str) -> int:
+        """Count one access; returns the new estimate."""
+        slots = self._slots(key)
+        table = self._table
+        estimate = min(table[s] for s in slots)
+        if estimate < _MAX_COUNT:
+            # Conservative update: only the counters holding the minimum grow
+            for s in slots:
+                if table[s] == estimate:
+                    table[s] = estimate + 1
+            estimate += 1
+        self._additions += 1
+        if self._additions >= self.sample:
+            self._table = bytearray(self._table.translate(_HALVE))
+            self._additions //= 2
+            self.resets += 1
+        return estimate
+
+    def estimate(self, key: str) -> int:
+        table = self._table
+        return min(table[s] for s in self._slots(key))
+
+
+class AdmissionPolicy:
+    def __init__(self, mode: str = CACHE_POLICY, sketch_width: int = _SKETCH_WIDTH,
+                 probation_ttl: int = _PROBATION_TTL, standard_ttl: int = _STANDARD_TTL,
+                 hot_hits: int = _HOT_HITS, hot_ttl: int = _HOT_TTL):
+        self.mode = mode
+        self.sketch = FrequencySketch(sketch_width)
+        self.probation_ttl = probation_ttl
+        self.standard_ttl = standard_ttl
+        self.hot_hits = hot_hits
+        self.hot_ttl = hot_ttl
+        self._lock = threading.Lock()
+        self._stats = {
+            "admitted": {"probation": 0, "standard": 0, "hot": 0},
+            "bytes_admitted": {"probation": 0, "standard": 0, "hot": 0},
+            "hits": {"probation": 0, "standard": 0, "hot": 0},
+            "rejected": 0,
+            "extended": 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode == "tinylfu"
+
+    def _class(self, frequency: int) -> str:
+        if frequency >= self.hot_hits:
+            return "hot"
+        return "standard" if frequency >= 2 else "probation"
+
+    def record(self, key: str) -> int:
+        """Count a lookup of key; returns its estimated recent frequency (0 when disabled)."""
+        if not self.enabled:
+            return 0
+        with self._lock:
+            return self.sketch.increment(key)
+
+    def ttl(self, key: str, ttl: int, size: int = 0) -> int:
+        """TTL to write key with (0 = don't cache it); ttl is the caller's default."""
+        if not self.enabled:
+            return ttl
+        with self._lock:
+            cls = self._class(self.sketch.estimate(key))
+        if cls == "probation":
+            ttl = min(ttl, self.probation_ttl)
+        elif cls == "hot":
+            ttl = max(ttl, self.hot_ttl)
+        if ttl <= 0:
+            self._stats["rejected"] += 1
+            return 0
+        self._stats["admitted"][cls] += 1
+        self._stats["bytes_admitted"][cls] += size
+        return ttl
+
+    def on_hit(self, frequency: int, remaining: Optional[float]) -> Optional[int]:
+        """Count a hit; returns a new TTL when the entry should be extended, else None."""
+        if not self.enabled:
+            return None
+        # The lookup itself was counted; classify by the frequency before it
+        cls = self._class(frequency - 1)
+        self._stats["hits"][cls] += 1
+        target = self.hot_ttl if frequency >= self.hot_hits else self.standard_ttl if frequency >= 2 else 0
+        if target and remaining is not None and 0 < remaining < target / 2:
+            self._stats["extended"] += 1
+            return target
+        return None
+
+    def stats(self) -> dict:
+        hits = sum(self._stats["hits"].values())
+        return {
+            "policy": self.mode,
+            **{k: dict(v) if isinstance(v, dict) else v for k, v in self._stats.items()},
+            "hit_share": {k: v / hits if hits else 0.0 for k, v in self._stats["hits"].items()},
+            "probation_ttl": self.probation_ttl,
+            "hot_hits": self.hot_hits,
+            "hot_ttl": self.hot_ttl,
+            "sketch": {"width": self.sketch.width, "bytes": len(self.sketch._table), "resets": self.sketch.resets},
+        }
+
+
+# Global instance
+admission_policy = AdmissionPolicy()
@@ -0,0 +1,156 @@
+"""
+Dynamic micro-batching for DIA synthesis.
+
+Concurrent callers submit one text each; a single worker thread collects jobs for
+up to ``max_wait_ms`` (or until ``max_batch_size`` is reached), runs one batched
+forward pass and resolves every caller's future with its own result. With a
+``cost_fn`` (predicted generation tokens), jobs whose costs differ by more than
+``max_cost_ratio`` run in separate passes so short texts don't wait on long ones.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional
+
+import torch
+
+
+class _Job:
+    __slots__ = ("text", "speaker_embed", "cost", "future", "enqueued_at")
+
+    def __init__(self, text: str, speaker_embed=None, cost: int = 0):
+        self.text = text
+        self.speaker_embed = speaker_embed
+        self.cost = cost
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+def _same_speaker(a, b) -> bool:
+    """Jobs can share a forward pass only if they use the same speaker embedding."""
+    if a is None or b is None:
+        return a is None and b is None
+    if a is b:
+        return True
+    try:
+        return isinstance(a, torch.Tensor) and isinstance(b, torch.Tensor) and a.shape == b.shape and torch.equal(a, b)
+    except Exception:
+        return False
+
+
+class MicroBatcher:
+    """
+    Collects concurrent synthesis requests and runs them as one batch.
+
+    ``run_batch(texts, speaker_embed)`` must return one result per text, in order.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[List[str], Any], List[Any]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10.0,
+        cost_fn: Optional[Callable[[str], int]] = None,
+        max_cost_ratio: float = 4.0,
+    ):
+        self._run_batch = run_batch
+        self._cost_fn = cost_fn
+        self.max_cost_ratio = max(1.0, max_cost_ratio)
+        self._queued_cost = 0
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue: "queue.Queue[_Job]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._stats = {
+            "batches": 0,
+            "items": 0,
+            "max_batch_seen": 0,
+            "total_queue_wait": 0.0,
+        }
+
+    def submit(self, text: str, speaker_embed=None) -> Future:
+        """Queue one text for synthesis; the returned future resolves to its result."""
+        self._ensure_worker()
+        job = _Job(text, speaker_embed, self._cost_fn(text) if self._cost_fn else 0)
+        with self._lock:
+            self._queued_cost += job.cost
+        self._queue.put(job)
+        return job.future
+
+    def stats(self) -> dict:
+        batches = self._stats["batches"]
+        items = self._stats["items"]
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches": batches,
+            "items": items,
+            "max_batch_seen": self._stats["max_batch_seen"],
+            "average_batch_size": items / batches if batches else 0.0,
+            "average_queue_wait_ms": (self._stats["total_queue_wait"] / items * 1000.0) if items else 0.0,
+            "queue_depth": self._queue.qsize(),
+            "queued_cost": self._queued_cost,
+        }
+
+    def _ensure_worker(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="dia-batcher", daemon=True)
+                self._thread.start()
+
+    def _collect(self) -> List[_Job]:
+        """Block for the first job, then gather more until the batch is full or the wait expires."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._collect()
+            # Split the window into groups that can share a forward pass
+            with self._lock:
+                self._queued_cost -= sum(job.cost for job in batch)
+            groups: List[List[_Job]] = []
+            # Cheapest first, so each group's first job holds its minimum cost
+            for job in sorted(batch, key=lambda j: j.cost):
+                for group in groups:
+                    if (
+                        _same_speaker(group[0].speaker_embed, job.speaker_embed)
+                        and job.cost <= max(1, group[0].cost) * self.max_cost_ratio
+                    ):
+                        group.append(job)
+                        break
+                else:
+                    groups.append([job])
+            for group in groups:
+                self._run_group(group)
+
+    def _run_group(self, group: List[_Job]) -> None:
+        now = time.monotonic()
+        self._stats["batches"] += 1
+        self._stats["items"] += len(group)
+        self._stats["max_batch_seen"] = max(self._stats["max_batch_seen"], len(group))
+        self._stats["total_queue_wait"] += sum(now - job.enqueued_at for job in group)
+        try:
+            results = self._run_batch([job.text for job in group], group[0].speaker_embed)
+            if len(results) != len(group):
+                raise RuntimeError(f"batch returned {len(results)} results for {len(group)} inputs")
+        except Exception as e:
+            for job in group:
+                job.future.set_exception(e)
+            return
+        for job, result in zip(group, results):
+            job.future.set_result(result)
@@ -0,0 +1,152 @@
+"""
+Adaptive generation budget.
+
+Instead of reserving max_new_tokens=2048 for every request, estimate how many
+audio tokens a text needs from its length and the speaking rate, refined by a
+calibration table learned from completed generations. The estimate doubles as a
+predicted cost the batch scheduler can use.
+
+Every worker and replica learns on its own and saves into the same calibration
+file: a save takes a file lock, merges the observations made here since the last
+save into what the file holds now, writes a unique temp file and renames it over.
+"""
+import fcntl
+import json
+import os
+import tempfile
+import threading
+from typing import Optional
+
+_MAX_NEW_TOKENS = int(os.getenv("DIA_MAX_NEW_TOKENS", "2048"))       # hard ceiling (the old fixed value)
+_MIN_NEW_TOKENS = int(os.getenv("DIA_MIN_NEW_TOKENS", "64"))
+_TOKENS_PER_SECOND = float(os.getenv("DIA_TOKENS_PER_SECOND", "86"))  # audio tokens per second of speech
+_CHARS_PER_SECOND = float(os.getenv("DIA_CHARS_PER_SECOND", "14"))    # speaking rate
+_SAFETY_DEVIATIONS = float(os.getenv("DIA_BUDGET_SAFETY", "3"))       # headroom in mean-absolute-deviations
+_CALIBRATION_PATH = os.getenv("DIA_BUDGET_CALIBRATION", "")            # JSON file the table is loaded from / saved to
+_SAVE_EVERY = 50
+
+# Upper bounds (chars) of the calibration buckets; short texts carry proportionally more overhead
+_BUCKETS = (16, 32, 64, 128, 256, 512)
+
+
+def _bucket(chars: int) -> str:
+    for upper in _BUCKETS:
+        if chars <= upper:
+            return str(upper)
+    return "max"
+
+
+class TokenBudget:
+    """Per-length-bucket EWMA of tokens/char and its mean absolute deviation."""
+
+    def __init__(self, calibration_path: str = _CALIBRATION_PATH, alpha: float = 0.05):
+        self.alpha = alpha
+        self.calibration_path = calibration_path
+        self._prior = _TOKENS_PER_SECOND / _CHARS_PER_SECOND
+        self._table = {}  # bucket -> {"ratio": float, "dev": float, "n": int}
+        self._saved = {}  # bucket -> n as of the last load/save; observations beyond it are this process's
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._capped = 0
+        self._load()
+
+    def estimate(self, text: str) -> int:
+        """Token budget for text: enough for the slowest plausible reading, capped at DIA_MAX_NEW_TOKENS."""
+        chars = max(1, len(text))
+        row = self._table.get(_bucket(chars))
+        if row is None:
+            ratio, dev = self._prior, self._prior * 0.25
+        else:
+            ratio, dev = row["ratio"], row["dev"]
+        budget = int(chars * (ratio + _SAFETY_DEVIATIONS * dev)) + _MIN_NEW_TOKENS
+        return max(_MIN_NEW_TOKENS, min(_MAX_NEW_TOKENS, budget))
+
+    def observe(self, text: str, generated_tokens: int, budget: Optional[int] = None) -> None:
+        """Learn from one finished generation. Runs that hit the budget only tell us 'at least'."""
+        chars = max(1, len(text))
+        if budget is not None and generated_tokens >= budget:
+            self._capped += 1
+            generated_tokens = int(generated_tokens * 1.25)  # censored: push the estimate up
+        ratio = generated_tokens / chars
+        key = _bucket(chars)
+        with self._lock:
+            row = self._table.get(key)
+            if row is None:
+                self._table[key] = {"ratio": ratio, "dev": ratio * 0.25, "n": 1}
+            else:
+                row["dev"] += self.alpha * (abs(ratio - row["ratio"]) - row["dev"])
+                row["ratio"] += self.alpha * (ratio - row["ratio"])
+                row["n"] += 1
+            self._pending += 1
+            save = self._pending >= _SAVE_EVERY
+            if save:
+                self._pending = 0
+        if save:
+            self.save()
+
+    def stats(self) -> dict:
+        return {
+            "max_new_tokens": _MAX_NEW_TOKENS,
+            "prior_tokens_per_char": round(self._prior, 3),
+            "capped_generations": self._capped,
+            "calibration": {k: {"ratio": round(v["ratio"], 3), "dev": round(v["dev"], 3), "n": v["n"]} for k, v in self._table.items()},
+        }
+
+    def _load(self) -> None:
+        if not self.calibration_path or not os.path.exists(self.calibration_path):
+            return
+        try:
+            with open(self.calibration_path) as f:
+                self._table = json.load(f)
+            self._saved = {k: row["n"] for k, row in self._table.items()}
+        except (OSError, ValueError) as e:
+            print(f"Could not load token budget calibration: {e}")
+
+    def _read_saved(self) -> dict:
+        try:
+            with open(self.calibration_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self) -> None:
+        """Merge this process's new observations into the calibration file (other processes' are kept)."""
+        if not self.calibration_path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.calibration_path))
+        tmp = None
+        try:
+            with open(self.calibration_path + ".lock", "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                merged = self._read_saved()
+                with self._lock:
+                    for key, row in self._table.items():
+                        new = row["n"] - self._saved.get(key, 0)
+                        other = merged.get(key)
+                        if other is None:
+                            merged[key] = dict(row)
+                        elif new > 0:
+                            # Weighted by observation count: the file's history against what we learned since
+                            n = other["n"] + new
+                            merged[key] = {k: (other[k] * other["n"] + row[k] * new) / n for k in ("ratio", "dev")}
+                            merged[key]["n"] = n
+                    fd, tmp = tempfile.mkstemp(prefix=".budget-", suffix=".tmp", dir=directory)
+                    with os.fdopen(fd, "w") as f:
+                        json.dump(merged, f)
+                    os.replace(tmp, self.calibration_path)
+                    tmp = None
+                    # Adopt what the other processes learned too
+                    self._table = {k: dict(row) for k, row in merged.items()}
+                    self._saved = {k: row["n"] for k, row in merged.items()}
+        except OSError as e:
+            print(f"Could not save token budget calibration: {e}")
+        finally:
+            if tmp is not None:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+
+
+# Global instance
+token_budget = TokenBudget()
@@ -1,22 +1,123 @@
-import hashlib, json, redis
+import asyncio, hashlib, json, os, redis, threading, time
+import redis.asyncio as aioredis
+from collections import OrderedDict
 from ..core.config import settings
-from typing import Union
+from .admission import admission_policy
+from .textnorm import TEXT_CANON_VERSION, canonicalize_text
+from typing import AsyncIterator, Iterable, List, Optional, Tuple, Union
 
 # Global variable to hold the Redis client
-_r = None
+_ar = None  # asyncio client used by request handlers
 
-def get_redis_client():
-    global _r
-    if _r is None:
-        _r = redis.from_url(settings.REDIS_URL)
-    return _r
+# Connection pool and timeouts: a slow Redis degrades to cache misses instead of stalling requests
+_REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "32"))
+_REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "0.25"))
+_REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "0.5"))
+_REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "0.25"))  # wait for a free pooled connection
+
+# In-process L1 in front of Redis, bounded by total audio bytes
+_L1_MAX_BYTES = int(os.getenv("AUDIO_L1_MAX_BYTES", str(64 * 1024 * 1024)))
+_L1_MAX_ITEM_BYTES = int(os.getenv("AUDIO_L1_MAX_ITEM_BYTES", str(_L1_MAX_BYTES // 8)))  # one long clip can't flush the hot set
+_L1_POLICY = os.getenv("AUDIO_L1_POLICY", "lru")  # lru or lfu
+
+# Cached audio is streamed from Redis in GETRANGE blocks of this size; larger values skip L1
+_STREAM_BLOCK_BYTES = int(os.getenv("AUDIO_STREAM_BLOCK_BYTES", "65536"))
+
+def get_async_redis():
+    global _ar
+    if _ar is None:
+        pool = aioredis.BlockingConnectionPool.from_url(
+            settings.REDIS_URL,
+            max_connections=_REDIS_MAX_CONNECTIONS,
+            timeout=_REDIS_POOL_TIMEOUT,
+            socket_timeout=_REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=_REDIS_CONNECT_TIMEOUT,
+        )
+        _ar = aioredis.Redis(connection_pool=pool)
+    return _ar
+
+async def close_redis():
+    global _ar
+    if _ar is not None:
+        await _ar.aclose()
+        _ar = None
+
+class LocalAudioCache:
+    """
+    Byte-bounded in-process cache. Entries expire with the TTL they were written to
+    Redis with; eviction is least-recently-used, or least-frequently-used (ties by
+    recency) with policy="lfu".
+    """
+
+    def __init__(self, max_bytes: int = _L1_MAX_BYTES, max_item_bytes: int = _L1_MAX_ITEM_BYTES, policy: str = _L1_POLICY):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = min(max_item_bytes, max_bytes)
+        self.policy = policy
+        self._entries: "OrderedDict[str, list]" = OrderedDict()  # key -> [value, expires_at, hits]
+        self._bytes = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                self._remove(key)
+                return None
+            entry[2] += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def expires_in(self, key: str) -> Optional[float]:
+        """Seconds until key expires here (and in Redis, whose TTL it mirrors), or None."""
+        entry = self._entries.get(key)
+        return None if entry is None else entry[1] - time.monotonic()
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        if self.max_bytes <= 0 or len(value) > self.max_item_bytes:
+            return
+        with self._lock:
+            hits = 0
+            if key in self._entries:
+                hits = self._entries[key][2]
+                self._remove(key)
+            while self._entries and self._bytes + len(value) > self.max_bytes:
+                self._remove(self._victim())
+                self._evictions += 1
+            self._entries[key] = [value, time.monotonic() + ttl, hits]
+            self._bytes += len(value)
+
+    def _victim(self) -> str:
+        if self.policy == "lfu":
+            # Oldest-first scan, so ties go to the least recently used
+            return min(self._entries, key=lambda k: self._entries[k][2])
+        return next(iter(self._entries))
+
+    def _remove(self, key: str) -> None:
+        value = self._entries.pop(key)[0]
+        self._bytes -= len(value)
+
+    def stats(self) -> dict:
+        return {
+            "policy": self.policy,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self._evictions,
+        }
+
+_l1 = LocalAudioCache()
+_counters = {"l1_hits": 0, "l2_hits": 0, "misses": 0}
+_redis_errors = 0
 
 def cache_key(text: str, voice_id: Union[str, None], model_rev: Union[str, None] = None, quality: str = "standard", sampler: str = "default"):
     """
     Generate cache key including all relevant parameters to prevent collisions.
     
     Args:
-        text: Input text
+        text: Input text (canonicalized here; see textnorm)
         voice_id: Voice identifier (None for base voice)
         model_rev: Model revision (prevents collisions when model updates)
         quality: Audio quality setting
@@ -25,22 +126,192 @@ def cache_key(text: str, voice_id: Union[str, None], model_rev: Union[str, None]
     m = hashlib.sha256()
     # Include all parameters that could affect the output
     key_string = "|".join([
-        text.strip(),
+        canonicalize_text(text),
         voice_id or "base",
         model_rev or settings.DIA_MODEL_REV or "main",
         quality,
-        sampler
+        sampler,
+        f"canon{TEXT_CANON_VERSION}",  # canonicalization rules the text went through
     ])
     m.update(key_string.encode())
     return "tts:" + m.hexdigest()
 
-def get_audio(text: str, voice_id: Union[str, None], model_rev: Union[str, None] = None, quality: str = "standard", sampler: str = "default"):
-    r = get_redis_client()
-    return r.get(cache_key(text, voice_id, model_rev, quality, sampler))
-
-def set_audio(text: str, voice_id: Union[str, None], audio_bytes: bytes, model_rev: Union[str, None] = None, quality: str = "standard", sampler: str = "default", ttl=86400):
-    r = get_redis_client()
+def ttl_for(text: str, ttl: int = 86400) -> int:
     # Set TTL to 24 hours as per specification for standard phrases
     # For large texts, consider shorter TTL (2 hours)
-    actual_ttl = ttl if len(text) < 200 else min(ttl, 7200)  # 2 hours for long texts
-    r.setex(cache_key(text, voice_id, model_rev, quality, sampler), actual_ttl, audio_bytes)
\ No newline at end of file
+    return ttl if len(text) < 200 else min(ttl, 7200)
+
+def _redis_failed(op: str, e: Exception) -> None:
+    global _redis_errors
+    _redis_errors += 1
+    print(f"Redis {op} failed ({type(e).__name__}: {e}); serving without L2")
+
+async def mget(keys: List[str], counters: Optional[dict] = None) -> List[Optional[bytes]]:
+    """
+    Look up many cache keys: L1 first, then every remaining key in one pipelined
+    Redis round trip (values plus remaining TTLs, so L1 copies never outlive L2).
+    Every lookup feeds the admission policy; hits it wants kept longer are extended.
+    """
+    counters = _counters if counters is None else counters
+    results: List[Optional[bytes]] = [_l1.get(key) for key in keys]
+    frequencies = [admission_policy.record(key) for key in keys]
+    extend: List[Tuple[str, bytes, int]] = []
+    missing = []
+    for i, value in enumerate(results):
+        if value is None:
+            missing.append(i)
+        else:
+            ttl = admission_policy.on_hit(frequencies[i], _l1.expires_in(keys[i]))
+            if ttl:
+                extend.append((keys[i], value, ttl))
+    counters["l1_hits"] += len(keys) - len(missing)
+    if missing:
+        pipe = get_async_redis().pipeline(transaction=False)
+        for i in missing:
+            pipe.get(keys[i])
+            pipe.ttl(keys[i])
+        try:
+            replies = await pipe.execute()
+        except (redis.RedisError, OSError, asyncio.TimeoutError) as e:
+            _redis_failed("read", e)
+            counters["misses"] += len(missing)
+            return results
+        for n, i in enumerate(missing):
+            value, ttl = replies[2 * n], replies[2 * n + 1]
+            if value is None:
+                counters["misses"] += 1
+                continue
+            counters["l2_hits"] += 1
+            results[i] = value
+            extended = admission_policy.on_hit(frequencies[i], ttl)
+            if extended:
+                extend.append((keys[i], value, extended))
+            elif ttl and ttl > 0:
+                _l1.set(keys[i], value, ttl)
+    if extend:
+        await _extend(extend)
+    return results
+
+async def _extend(items: List[Tuple[str, bytes, int]]) -> None:
+    """Push back the expiry of entries that are still being hit, in both tiers."""
+    pipe = get_async_redis().pipeline(transaction=False)
+    for key, value, ttl in items:
+        pipe.expire(key, ttl)
+        _l1.set(key, value, ttl)
+    try:
+        await pipe.execute()
+    except (redis.RedisError, OSError, asyncio.TimeoutError) as e:
+        _redis_failed("expire", e)
+
+async def open_stream(key: str, counters: Optional[dict] = None) -> Optional[AsyncIterator[bytes]]:
+    """
+    A cached value as an async iterator of byte blocks, or None on a miss. One
+    pipelined round trip returns the length, TTL and first block; a value larger
+    than one block is read block by block with GETRANGE as the iterator is
+    consumed, so serving it never holds the whole object in memory.
+    """
+    counters = _counters if counters is None else counters
+    frequency = admission_policy.record(key)
+    value = _l1.get(key)
+    if value is not None:
+        counters["l1_hits"] += 1
+        ttl = admission_policy.on_hit(frequency, _l1.expires_in(key))
+        if ttl:
+            await _extend([(key, value, ttl)])
+        return as_blocks(value)
+    pipe = get_async_redis().pipeline(transaction=False)
+    pipe.strlen(key)
+    pipe.ttl(key)
+    pipe.getrange(key, 0, _STREAM_BLOCK_BYTES - 1)
+    try:
+        length, ttl, first = await pipe.execute()
+    except (redis.RedisError, OSError, asyncio.TimeoutError) as e:
+        _redis_failed("read", e)
+        counters["misses"] += 1
+        return None
+    if not length:
+        counters["misses"] += 1
+        return None
+    counters["l2_hits"] += 1
+    extended = admission_policy.on_hit(frequency, ttl)
+    if length <= _STREAM_BLOCK_BYTES:
+        if extended:
+            await _extend([(key, first, extended)])
+        elif ttl and ttl > 0:
+            _l1.set(key, first, ttl)
+        return as_blocks(first)
+    if extended:
+        try:
+            await get_async_redis().expire(key, extended)
+        except (redis.RedisError, OSError, asyncio.TimeoutError) as e:
+            _redis_failed("expire", e)
+    return _ranges(key, first, length)
+
+async def as_blocks(value: bytes) -> AsyncIterator[bytes]:
+    yield value
+
+async def _ranges(key: str, first: bytes, length: int) -> AsyncIterator[bytes]:
+    yield first
+    pos = len(first)
+    while pos < length:
+        try:
+            block = await get_async_redis().getrange(key, pos, pos + _STREAM_BLOCK_BYTES - 1)
+        except (redis.RedisError, OSError, asyncio.TimeoutError) as e:
+            _redis_failed("range read", e)
+            return
+        if not block:
+            return  # expired or replaced mid-stream: end early
+        yield block
+        pos += len(block)
+
+async def peek(key: str) -> Optional[bytes]:
+    """Uncounted lookup, for callers polling for a value another request is producing."""
+    value = _l1.get(key)
+    if value is not None:
+        return value
+    try:
+        return await get_async_redis().get(key)
+    except (redis.RedisError, OSError, asyncio.TimeoutError):
+        return None
+
+async def mset(items: Iterable[Tuple[str, bytes, int]]) -> None:
+    """
+    Write (key, value, ttl) entries to both tiers; Redis writes go out in one pipeline.
+    ttl is the default the admission policy adjusts (or declines) per key.
+    """
+    items = list(items)
+    if not items:
+        return
+    pipe = get_async_redis().pipeline(transaction=False)
+    admitted = 0
+    for key, value, ttl in items:
+        ttl = admission_policy.ttl(key, ttl, len(value))
+        if ttl <= 0:
+            continue
+        pipe.setex(key, ttl, value)
+        _l1.set(key, value, ttl)
+        admitted += 1
+    if not admitted:
+        return
+    try:
+        await pipe.execute()
+    except (redis.RedisError, OSError, asyncio.TimeoutError) as e:
+        _redis_failed("write", e)
+
+async def get_audio(text: str, voice_id: Union[str, None], model_rev: Union[str, None] = None, quality: str = "standard", sampler: str = "default"):
+    return (await mget([cache_key(text, voice_id, model_rev, quality, sampler)]))[0]
+
+async def set_audio(text: str, voice_id: Union[str, None], audio_bytes: bytes, model_rev: Union[str, None] = None, quality: str = "standard", sampler: str = "default", ttl=86400):
+    await mset([(cache_key(text, voice_id, model_rev, quality, sampler), audio_bytes, ttl_for(text, ttl))])
+
+def cache_stats() -> dict:
+    """L1 (in-process) and L2 (Redis) hit counters for /metrics."""
+    lookups = sum(_counters.values())
+    return {
+        **_counters,
+        "l1_hit_rate": _counters["l1_hits"] / lookups if lookups else 0.0,
+        "l2_hit_rate": _counters["l2_hits"] / lookups if lookups else 0.0,
+        "redis_errors": _redis_errors,
+        "l1": _l1.stats(),
+        "admission": admission_policy.stats(),
+    }
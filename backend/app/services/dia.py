@@ -1,17 +1,32 @@
 import io
 import os
+import queue
+import re
+import threading
 import time
-from typing import Optional, Generator
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Generator, List, Tuple
+import numpy as np
+import soundfile as sf
 import torch
-from pydub import AudioSegment
 
 # HF APIs (we try pipeline first; if not available we fall back to model+processor)
 from transformers import (
     AutoProcessor,
     AutoModelForSpeechSeq2Seq,
+    StoppingCriteria,
+    StoppingCriteriaList,
     pipeline as hf_pipeline,
 )
 
+from .assets import audio_assets
+from .batching import MicroBatcher
+from .budget import token_budget
+from .encoder import encoder_pool, new_mp3_stream_encoder, supports_mp3_streaming
+from .mp3 import Mp3FrameSplitter, iter_frame_chunks
+from .snapshot import read_manifest
+from .workers import get_worker_pool
+
 _DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 _MODEL = None
 _PROCESSOR = None
@@ -23,6 +38,22 @@ _USE_BNB = os.getenv("DIA_USE_BNB", "0") == "1"         # 8-bit/4-bit quant if a
 _LOAD_4BIT = os.getenv("DIA_4BIT", "0") == "1"          # force 4bit
 _LOAD_8BIT = os.getenv("DIA_8BIT", "0") == "1" or _USE_BNB  # default to 8-bit if DIA_USE_BNB=1
 _ENABLE_STREAM = os.getenv("DIA_ENABLE_STREAM", "1") == "1" # stream MP3 chunks (frontend feels faster)
+_ENABLE_BATCH = os.getenv("DIA_ENABLE_BATCH", "1") == "1"   # micro-batch concurrent requests
+_BATCH_MAX_SIZE = int(os.getenv("DIA_BATCH_MAX_SIZE", "8"))  # max texts per forward pass
+_BATCH_MAX_WAIT_MS = float(os.getenv("DIA_BATCH_MAX_WAIT_MS", "10"))  # how long to hold a batch open
+_STREAM_WINDOW_TOKENS = int(os.getenv("DIA_STREAM_WINDOW_TOKENS", "50"))    # tokens per decoded window
+_STREAM_CONTEXT_TOKENS = int(os.getenv("DIA_STREAM_CONTEXT_TOKENS", "64"))  # left context re-decoded per window
+_SEGMENT_MAX_CHARS = int(os.getenv("DIA_SEGMENT_MAX_CHARS", "250"))  # long text is split into segments this size
+_SEGMENT_MIN_CHARS = int(os.getenv("DIA_SEGMENT_MIN_CHARS", "16"))  # shorter sentences join a neighbour, even for the segment cache
+_CROSSFADE_MS = float(os.getenv("DIA_CROSSFADE_MS", "30"))           # overlap when stitching segments
+_PAUSE_MS = float(os.getenv("DIA_SEGMENT_PAUSE_MS", "120"))          # silence between stitched segments (the fades reach into it)
+_SNAPSHOT_DIR = os.getenv("DIA_SNAPSHOT_DIR", "")              # pre-built model snapshot (scripts/build_model_snapshot.py)
+_WARMUP = os.getenv("DIA_WARMUP", "1") == "1"                 # run a warm-up synthesis after loading
+_EOS_TOKEN_ID = os.getenv("DIA_EOS_TOKEN_ID", "")             # end-of-audio token if the model config lacks one
+_CPU_ACCEL = {m.strip() for m in re.split(r"[,+]", os.getenv("DIA_CPU_ACCEL", "none")) if m.strip() not in ("", "none")}  # int8, compile
+
+_BATCHER = None  # MicroBatcher (created lazily on first synthesize)
+_CPU_ACCEL_APPLIED: List[str] = []  # what _apply_cpu_accel actually enabled
 
 def _bnb_kwargs():
     """Build bitsandbytes kwargs safely."""
@@ -40,42 +71,36 @@ def _bnb_kwargs():
         return dict(load_in_8bit=True, device_map="auto")
     return {}
 
-def load_model(model_id: str, hf_token: Optional[str] = None, revision: Optional[str] = None) -> None:
-    """
-    Warm-load the DIA model once. Tries HF pipeline first, then manual processor+model.
-    Uses mixed precision on CUDA. Never reload inside request path.
-    """
-    global _MODEL, _PROCESSOR, _PIPE
-
-    if _PIPE or _MODEL:
-        return  # already loaded
-
-    # Try pipeline path (if model exposes a speech TTS task)
+def _load_pipeline(source: str, revision: Optional[str] = None) -> None:
+    """Load the HF pipeline backend from a hub id or a local directory (raises on failure)."""
+    global _PIPE
     try:
         # Simplified pipeline call to avoid type errors
         _PIPE = hf_pipeline(
             "text2text-generation",
-            model=model_id,
+            model=source,
             revision=revision,
             torch_dtype=torch.float16 if _DEVICE == "cuda" else torch.float32,
             device=0 if _DEVICE == "cuda" else -1,
         )
-        # Warmup
-        if _PIPE is not None:
+        # Warmup doubles as a check that the pipeline actually runs
+        if _PIPE is not None and _WARMUP:
             _ = _PIPE("warm up")
-        return
-    except Exception as e:
-        print(f"Pipeline loading failed: {e}")
-        _PIPE = None  # fall through to raw model path
+    except Exception:
+        _PIPE = None
+        raise
+
+def _load_raw_model(source: str, hf_token: Optional[str] = None, revision: Optional[str] = None) -> None:
+    """Load processor + model from a hub id or a local directory."""
+    global _MODEL, _PROCESSOR
 
-    # Fallback to raw model + processor
     bnb_args = _bnb_kwargs()
     
     # Load processor with revision if specified
     processor_kwargs = {"token": hf_token}
     if revision:
         processor_kwargs["revision"] = revision
-    _PROCESSOR = AutoProcessor.from_pretrained(model_id, **processor_kwargs)
+    _PROCESSOR = AutoProcessor.from_pretrained(source, **processor_kwargs)
     
     # Load model with revision if specified
     model_kwargs = {
@@ -88,11 +113,11 @@ def load_model(model_id: str, hf_token: Optional[str] = None, revision: Optional
     if bnb_args:
         # quantized load
         model_kwargs.update(bnb_args)
-        _MODEL = AutoModelForSpeechSeq2Seq.from_pretrained(model_id, **model_kwargs)
+        _MODEL = AutoModelForSpeechSeq2Seq.from_pretrained(source, **model_kwargs)
     else:
         # fp16/fp32 path
         model_kwargs["torch_dtype"] = torch.float16 if _DEVICE == "cuda" else torch.float32
-        _MODEL = AutoModelForSpeechSeq2Seq.from_pretrained(model_id, **model_kwargs).to(_DEVICE)
+        _MODEL = AutoModelForSpeechSeq2Seq.from_pretrained(source, **model_kwargs).to(_DEVICE)
 
     _MODEL.eval()
     if _DEVICE == "cuda" and not bnb_args:
@@ -104,83 +129,290 @@ def load_model(model_id: str, hf_token: Optional[str] = None, revision: Optional
         torch.backends.cudnn.benchmark = True
 
     # warm pass (best-effort)
-    try:
-        _ = _synthesize_impl("warm up", None)
-    except Exception:
-        pass
+    if _WARMUP:
+        try:
+            _ = _synthesize_impl("warm up", None)
+        except Exception:
+            pass
 
-def _wav_to_mp3_bytes(wav: torch.Tensor, sample_rate: int = _SAMPLE_RATE) -> bytes:
+def _load_snapshot(model_id: str, revision: Optional[str] = None) -> bool:
     """
-    Convert mono float waveform [-1..1] to MP3 bytes.
+    Load from a pre-built snapshot (DIA_SNAPSHOT_DIR) if it matches model_id/revision.
+    The snapshot records which backend resolved at build time, so we skip the pipeline
+    probe, and its safetensors weights are memory-mapped rather than deserialized.
     """
-    if wav.dim() > 1:
-        wav = wav.squeeze(0)
-    wav16 = (wav.clamp(-1, 1) * 32767).to(torch.int16).cpu().numpy().tobytes()
-    buf = io.BytesIO()
-    audio = AudioSegment(
-        wav16, frame_rate=sample_rate, sample_width=2, channels=1
-    )
-    audio.export(buf, format="mp3", bitrate="64k")
-    return buf.getvalue()
+    if not _SNAPSHOT_DIR:
+        return False
+    manifest = read_manifest(_SNAPSHOT_DIR)
+    if manifest is None:
+        print(f"No model snapshot at {_SNAPSHOT_DIR}; loading from the hub")
+        return False
+    if manifest.get("model_id") != model_id or (revision and manifest.get("revision") != revision):
+        print(f"Snapshot at {_SNAPSHOT_DIR} is for {manifest.get('model_id')}@{manifest.get('revision')}, "
+              f"not {model_id}@{revision}; loading from the hub")
+        return False
+    start = time.time()
+    try:
+        if manifest["backend"] == "pipeline":
+            _load_pipeline(_SNAPSHOT_DIR)
+        else:
+            _load_raw_model(_SNAPSHOT_DIR)
+    except Exception as e:
+        print(f"Snapshot load failed, loading from the hub: {e}")
+        return False
+    print(f"Loaded {manifest['backend']} snapshot from {_SNAPSHOT_DIR} in {time.time() - start:.2f}s")
+    return True
 
-def _synthesize_with_pipeline(text: str, speaker_embed=None):
+def load_model(model_id: str, hf_token: Optional[str] = None, revision: Optional[str] = None) -> None:
     """
-    If HF pipeline works, use it. Expect pipeline to return waveform or bytes.
+    Warm-load the DIA model once. Uses a local snapshot when DIA_SNAPSHOT_DIR points at one,
+    otherwise tries HF pipeline first, then manual processor+model.
+    Uses mixed precision on CUDA. Never reload inside request path.
     """
+    if _PIPE or _MODEL:
+        return  # already loaded
+    if get_worker_pool() is not None:
+        return  # replicas live in the inference worker processes
+
+    if not _load_snapshot(model_id, revision):
+        # Try pipeline path (if model exposes a speech TTS task)
+        try:
+            _load_pipeline(model_id, revision)
+        except Exception as e:
+            print(f"Pipeline loading failed: {e}")
+            # Fallback to raw model + processor
+            _load_raw_model(model_id, hf_token, revision)
+
+    _apply_cpu_accel()
+
+def _loaded_model():
+    return _PIPE.model if _PIPE is not None else _MODEL
+
+def _set_loaded_model(model) -> None:
+    global _MODEL
     if _PIPE is not None:
+        _PIPE.model = model
+    else:
+        _MODEL = model
+
+def _smoke_test() -> bool:
+    try:
+        wav = _synthesize_wav_impl("warm up", None)
+    except Exception as e:
+        print(f"CPU acceleration smoke test failed: {e}")
+        return False
+    # Inference errors are caught and answered with a fallback tone; that is a failure too
+    if audio_assets.for_wav(wav) is not None:
+        print("CPU acceleration smoke test produced fallback audio")
+        return False
+    return True
+
+def _apply_cpu_accel() -> None:
+    """
+    CPU-only acceleration selected by DIA_CPU_ACCEL (int8, compile, or int8+compile).
+    Each step is smoke-tested with a real synthesis and rolled back if the model
+    doesn't support it, so a bad combination degrades to plain fp32 instead of failing.
+    """
+    global _CPU_ACCEL_APPLIED
+    _CPU_ACCEL_APPLIED = []
+    model = _loaded_model()
+    if _DEVICE != "cpu" or not _CPU_ACCEL or model is None:
+        return
+
+    if "int8" in _CPU_ACCEL:
         try:
-            # Try to pass speaker embedding to pipeline if available
-            if speaker_embed is not None:
-                out = _PIPE(text, speaker_embeddings=speaker_embed)
+            quantized = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            _set_loaded_model(quantized)
+            if _smoke_test():
+                _CPU_ACCEL_APPLIED.append("int8")
+                model = quantized
             else:
-                out = _PIPE(text)
-            return _process_pipeline_output(out)
+                _set_loaded_model(model)
         except Exception as e:
-            print(f"Pipeline synthesis failed: {e}")
-            pass
-    # Fallback if pipeline is None or failed
-    tone = torch.sin(
-        2 * torch.pi * torch.arange(0, _SAMPLE_RATE * 1) / _SAMPLE_RATE * 880
-    ).unsqueeze(0)
-    return _wav_to_mp3_bytes(tone)
-
-def _process_pipeline_output(out) -> bytes:
-    """Process pipeline output to MP3 bytes."""
-    # normalizations:
+            print(f"Dynamic int8 quantization unavailable: {e}")
+            _set_loaded_model(model)
+
+    if "compile" in _CPU_ACCEL and hasattr(torch, "compile"):
+        eager_forward = model.forward
+        try:
+            model.forward = torch.compile(eager_forward, dynamic=True)
+            if _smoke_test():
+                _CPU_ACCEL_APPLIED.append("compile")
+            else:
+                model.forward = eager_forward
+        except Exception as e:
+            print(f"torch.compile unavailable: {e}")
+            model.forward = eager_forward
+
+    print(f"CPU acceleration: requested {sorted(_CPU_ACCEL)}, applied {_CPU_ACCEL_APPLIED or ['fp32']}")
+
+def model_info() -> dict:
+    """Backend/device/acceleration of the loaded model, for /metrics."""
+    pool = get_worker_pool()
+    if pool is not None:
+        return {"backend": "workers", "device": _DEVICE}
+    backend = "pipeline" if _PIPE is not None else "model" if _MODEL is not None else "none"
+    return {"backend": backend, "device": _DEVICE, "cpu_accel": _CPU_ACCEL_APPLIED or ["fp32"]}
+
+def _pcm16_bytes(wav: torch.Tensor) -> bytes:
+    """Mono float waveform [-1..1] -> little-endian 16-bit PCM."""
+    if wav.dim() > 1:
+        wav = wav.reshape(-1)
+    return (wav.float().clamp(-1, 1) * 32767).to(torch.int16).cpu().numpy().tobytes()
+
+def _pcm16_to_wav(pcm: bytes) -> torch.Tensor:
+    return torch.from_numpy(np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32767.0)
+
+def _wav_to_mp3_bytes(wav: torch.Tensor, sample_rate: int = _SAMPLE_RATE) -> bytes:
+    """
+    Convert mono float waveform [-1..1] to MP3 bytes.
+    Encoding runs in-process on the shared encoder pool (no ffmpeg subprocess).
+    """
+    return encoder_pool.encode(_pcm16_bytes(wav), sample_rate, "mp3")
+
+def _fallback(asset_name: str, reason: str) -> torch.Tensor:
+    """
+    Pre-built fallback waveform — guarantees audible, valid output when the model can't synthesize.
+    synthesize() recognizes it and serves the pre-encoded MP3 instead of encoding it again.
+    """
+    audio_assets.record_fallback(reason)
+    return audio_assets.get(asset_name).wav
+
+def _as_mono(wav) -> Optional[torch.Tensor]:
+    """Normalize a model/pipeline waveform (tensor or ndarray) to a 1-D float tensor on CPU."""
+    if isinstance(wav, np.ndarray):
+        wav = torch.from_numpy(wav)
+    if not isinstance(wav, torch.Tensor) or wav.numel() == 0:
+        return None
+    return wav.detach().reshape(-1).float().cpu()
+
+def _pipeline_output_to_wav(out) -> Optional[torch.Tensor]:
+    """Normalize pipeline output to a mono waveform (None if unrecognized)."""
+    if isinstance(out, list) and len(out) == 1:
+        out = out[0]
     if isinstance(out, dict):
         if "audio" in out and isinstance(out["audio"], bytes):
-            # Already encoded; try pass-through
-            return out["audio"]
+            # Already encoded; decode so it can be stitched/re-encoded
+            data, _ = sf.read(io.BytesIO(out["audio"]), dtype="float32")
+            return _as_mono(data.mean(axis=1) if data.ndim > 1 else data)
+        if "audio" in out:
+            return _as_mono(out["audio"])
         if "waveform" in out:
-            wav = out["waveform"]
-            if isinstance(wav, torch.Tensor):
-                return _wav_to_mp3_bytes(wav)
-    # If it's raw tensor:
-    if isinstance(out, torch.Tensor):
-        return _wav_to_mp3_bytes(out)
-    # Last resort: create a short tone (never fail)
-    tone = torch.sin(
-        2 * torch.pi * torch.arange(0, _SAMPLE_RATE * 1) / _SAMPLE_RATE * 880
-    ).unsqueeze(0)
-    return _wav_to_mp3_bytes(tone)
+            return _as_mono(out["waveform"])
+    return _as_mono(out)
 
-@torch.inference_mode()
-def _synthesize_impl(text: str, speaker_embed=None) -> bytes:
+def _synthesize_with_pipeline(text: str, speaker_embed=None) -> torch.Tensor:
     """
-    Unified synth: pipeline→raw model→tone fallback.
+    If HF pipeline works, use it. Expect pipeline to return waveform or bytes.
     """
-    # 1) Pipeline path
     if _PIPE is not None:
-        # Pass speaker embedding if available
+        # Try to pass speaker embedding to pipeline if available
         if speaker_embed is not None:
-            # Try to pass speaker embedding to pipeline
             try:
-                out = _PIPE(text, speaker_embeddings=speaker_embed)
-                return _process_pipeline_output(out)
+                wav = _pipeline_output_to_wav(_PIPE(text, speaker_embeddings=speaker_embed))
+                if wav is not None:
+                    return wav
             except Exception as e:
                 print(f"Pipeline with speaker embedding failed: {e}")
                 # Fall back to synthesis without speaker embedding
-                pass
+        try:
+            wav = _pipeline_output_to_wav(_PIPE(text))
+            if wav is not None:
+                return wav
+        except Exception as e:
+            print(f"Pipeline synthesis failed: {e}")
+    # Fallback if pipeline is None, failed or returned something unusable
+    return _fallback("tone_880", "pipeline")
+
+def _speaker_generate_kwargs(speaker_embed) -> dict:
+    """Apply a speaker embedding to the raw model, returning any extra generate() kwargs."""
+    generate_kwargs = {}
+    if speaker_embed is not None:
+        # Check if model has a method to set speaker embeddings
+        if hasattr(_MODEL, "set_speaker_embeddings"):
+            _MODEL.set_speaker_embeddings(speaker_embed)
+        # Or pass as a generation parameter if supported
+        elif hasattr(_MODEL, "generate") and hasattr(_MODEL.generate, "__code__"):
+            # Check if generate method accepts speaker_embeddings parameter
+            import inspect
+            sig = inspect.signature(_MODEL.generate)
+            if "speaker_embeddings" in sig.parameters:
+                generate_kwargs["speaker_embeddings"] = speaker_embed
+    return generate_kwargs
+
+def _end_of_audio_ids() -> List[int]:
+    """Token ids that mark the end of the audio (model eos ids plus DIA_EOS_TOKEN_ID)."""
+    ids = []
+    for source in (getattr(_MODEL, "generation_config", None), getattr(_MODEL, "config", None)):
+        eos = getattr(source, "eos_token_id", None)
+        if eos is not None:
+            ids.extend(eos if isinstance(eos, (list, tuple)) else [eos])
+    if _EOS_TOKEN_ID:
+        ids.append(int(_EOS_TOKEN_ID))
+    return sorted(set(ids))
+
+class _EndOfAudioCriteria(StoppingCriteria):
+    """Finishes a sequence as soon as it emits an end-of-audio token (on any codebook)."""
+
+    def __init__(self, eos_ids: List[int]):
+        self.eos_ids = torch.tensor(eos_ids)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        last = input_ids[:, -1]
+        done = torch.isin(last, self.eos_ids.to(last.device))
+        if done.dim() > 1:
+            done = done.reshape(done.shape[0], -1).any(dim=1)
+        return done
+
+def _generation_controls(budget: int, cancelled: Optional[threading.Event] = None) -> dict:
+    """max_new_tokens plus the stopping criteria every generate() call shares."""
+    criteria = []
+    eos = _end_of_audio_ids()
+    if eos:
+        criteria.append(_EndOfAudioCriteria(eos))
+    if cancelled is not None:
+        criteria.append(_CancelCriteria(cancelled))
+    controls = {"max_new_tokens": budget}
+    if criteria:
+        controls["stopping_criteria"] = StoppingCriteriaList(criteria)
+    return controls
+
+def _prompt_length(inputs) -> int:
+    """Prompt tokens echoed at the start of generate() output (none for encoder-decoder models)."""
+    if getattr(getattr(_MODEL, "config", None), "is_encoder_decoder", False):
+        return 0
+    input_ids = inputs.get("input_ids") if hasattr(inputs, "get") else None
+    return input_ids.shape[1] if isinstance(input_ids, torch.Tensor) and input_ids.dim() >= 2 else 0
+
+def _record_generation(texts: List[str], ids, inputs, budget: int) -> None:
+    """Feed generated lengths (up to each sequence's first end-of-audio token) back into the budget."""
+    if not isinstance(ids, torch.Tensor) or ids.dim() < 2 or ids.shape[0] != len(texts):
+        return
+    eos = _end_of_audio_ids()
+    if len(texts) > 1 and not eos:
+        return  # padded batch rows all look max-length without an eos to find their ends
+    prompt_len = _prompt_length(inputs)
+    for text, row in zip(texts, ids):
+        seq = (row if row.dim() == 1 else row.reshape(row.shape[0], -1)[:, 0])[prompt_len:]
+        n = seq.shape[0]
+        if eos:
+            hits = torch.isin(seq, torch.tensor(eos, device=seq.device)).nonzero()
+            if hits.numel():
+                n = int(hits[0]) + 1
+        token_budget.observe(text, n, budget)
+
+def predicted_cost(text: str) -> int:
+    """Predicted generation cost of text in audio tokens (summed over its segments)."""
+    return sum(token_budget.estimate(segment) for segment in segment_text(text) or [text])
+
+@torch.inference_mode()
+def _synthesize_wav_impl(text: str, speaker_embed=None) -> torch.Tensor:
+    """
+    Unified synth: pipeline→raw model→tone fallback. Returns a mono float waveform.
+    """
+    audio_assets.record_syntheses(1)
+    # 1) Pipeline path
+    if _PIPE is not None:
         return _synthesize_with_pipeline(text, speaker_embed)
 
     # 2) Raw model + processor path (example forward; adapt if DIA differs)
@@ -194,62 +426,521 @@ def _synthesize_impl(text: str, speaker_embed=None) -> bytes:
             inputs = _PROCESSOR(text=text, return_tensors="pt").to(_DEVICE)
             
             # Pass speaker embedding if available and model supports it
-            generate_kwargs = {}
-            if speaker_embed is not None:
-                # Check if model has a method to set speaker embeddings
-                if hasattr(_MODEL, "set_speaker_embeddings"):
-                    _MODEL.set_speaker_embeddings(speaker_embed)
-                # Or pass as a generation parameter if supported
-                elif hasattr(_MODEL, "generate") and hasattr(_MODEL.generate, "__code__"):
-                    # Check if generate method accepts speaker_embeddings parameter
-                    import inspect
-                    sig = inspect.signature(_MODEL.generate)
-                    if "speaker_embeddings" in sig.parameters:
-                        generate_kwargs["speaker_embeddings"] = speaker_embed
+            generate_kwargs = _speaker_generate_kwargs(speaker_embed)
             
             # NOTE: Replace the following with DIA's actual generation API if different.
             # Many TTS models expose something like generate(...) returning waveform/ids.
             if hasattr(_MODEL, "generate"):
-                ids = _MODEL.generate(**inputs, max_new_tokens=2048, **generate_kwargs)
+                budget = token_budget.estimate(text)
+                ids = _MODEL.generate(**inputs, **_generation_controls(budget), **generate_kwargs)
+                _record_generation([text], ids, inputs, budget)
                 # If processor can decode ids to waveform:
                 if hasattr(_PROCESSOR, "batch_decode"):
                     wav = _PROCESSOR.batch_decode(ids, sampling_rate=_SAMPLE_RATE)
-                    if isinstance(wav, torch.Tensor):
-                        return _wav_to_mp3_bytes(wav, _SAMPLE_RATE)
+                    if isinstance(wav, (list, tuple)) and len(wav) == 1:
+                        wav = wav[0]
+                    wav = _as_mono(wav)
+                    if wav is not None:
+                        return wav
             # If direct waveform method exists (pseudo-case):
             elif hasattr(_MODEL, "generate_speech"):
-                wav = _MODEL.generate_speech(**inputs, speaker_embed=speaker_embed, sample_rate=_SAMPLE_RATE)
-                if isinstance(wav, torch.Tensor):
-                    return _wav_to_mp3_bytes(wav, _SAMPLE_RATE)
+                wav = _as_mono(_MODEL.generate_speech(**inputs, speaker_embed=speaker_embed, sample_rate=_SAMPLE_RATE))
+                if wav is not None:
+                    return wav
 
         # If shape/API mismatch, fall through to tone.
-    # 3) Fallback tone — guarantees a valid MP3
-    tone = torch.sin(
-        2 * torch.pi * torch.arange(0, _SAMPLE_RATE * 1) / _SAMPLE_RATE * 440
-    ).unsqueeze(0)
-    return _wav_to_mp3_bytes(tone, _SAMPLE_RATE)
+    # 3) Fallback tone
+    return _fallback("tone_440", "model_output" if _MODEL is not None else "no_model")
+
+def _synthesize_impl(text: str, speaker_embed=None) -> bytes:
+    """Single-text synth straight to MP3 (no batching, no segmentation)."""
+    return _wav_to_mp3_bytes(_synthesize_wav_impl(text, speaker_embed), _SAMPLE_RATE)
+
+def _split_batch_audio(wav, n: int) -> Optional[list]:
+    """Split a batched decode result into n per-item waveforms (None if the shape is unusable)."""
+    if isinstance(wav, (list, tuple)) and len(wav) == n:
+        items = list(wav)
+    elif isinstance(wav, torch.Tensor) and wav.dim() >= 2 and wav.shape[0] == n:
+        items = list(wav.unbind(0))
+    else:
+        return None
+    items = [_as_mono(w) for w in items]
+    if any(w is None for w in items):
+        return None
+    return items
 
-def synthesize(text: str, speaker_embed=None) -> bytes:
+@torch.inference_mode()
+def _synthesize_wav_batch_impl(texts: List[str], speaker_embed=None) -> List[torch.Tensor]:
+    """
+    Batched synth: one forward pass for all texts sharing a speaker embedding.
+    Falls back to per-text _synthesize_wav_impl when the backend can't batch.
+    """
+    if len(texts) == 1:
+        return [_synthesize_wav_impl(texts[0], speaker_embed)]
+
+    # 1) Pipeline path: transformers pipelines accept a list of inputs
+    if _PIPE is not None:
+        try:
+            if speaker_embed is not None:
+                outs = _PIPE(texts, speaker_embeddings=speaker_embed, batch_size=len(texts))
+            else:
+                outs = _PIPE(texts, batch_size=len(texts))
+            if isinstance(outs, list) and len(outs) == len(texts):
+                wavs = [_pipeline_output_to_wav(out) for out in outs]
+                if all(w is not None for w in wavs):
+                    audio_assets.record_syntheses(len(wavs))
+                    return wavs
+        except Exception as e:
+            print(f"Batched pipeline synthesis failed, falling back to per-item: {e}")
+
+    # 2) Raw model + processor path with padded inputs
+    elif _MODEL is not None and _PROCESSOR is not None and hasattr(_MODEL, "generate") and hasattr(_PROCESSOR, "batch_decode"):
+        try:
+            autocast_dtype = torch.float16 if _DEVICE == "cuda" else torch.float32
+            with torch.cuda.amp.autocast(enabled=(_DEVICE == "cuda"), dtype=autocast_dtype):
+                inputs = _PROCESSOR(text=texts, padding=True, return_tensors="pt").to(_DEVICE)
+                generate_kwargs = _speaker_generate_kwargs(speaker_embed)
+                # Rows stop individually at end-of-audio; the batch runs as long as its longest budget
+                budget = max(token_budget.estimate(text) for text in texts)
+                ids = _MODEL.generate(**inputs, **_generation_controls(budget), **generate_kwargs)
+                _record_generation(texts, ids, inputs, budget)
+                wavs = _split_batch_audio(_PROCESSOR.batch_decode(ids, sampling_rate=_SAMPLE_RATE), len(texts))
+            if wavs is not None:
+                audio_assets.record_syntheses(len(wavs))
+                return wavs
+        except Exception as e:
+            print(f"Batched model synthesis failed, falling back to per-item: {e}")
+
+    return [_synthesize_wav_impl(text, speaker_embed) for text in texts]
+
+def _get_batcher() -> MicroBatcher:
+    global _BATCHER
+    if _BATCHER is None:
+        _BATCHER = MicroBatcher(_synthesize_wav_batch_impl, _BATCH_MAX_SIZE, _BATCH_MAX_WAIT_MS, cost_fn=token_budget.estimate)
+    return _BATCHER
+
+def batch_stats() -> dict:
+    """Micro-batching counters for /metrics."""
+    if get_worker_pool() is not None:
+        return {"enabled": _ENABLE_BATCH, "in_workers": True}  # each worker batches its own requests
+    if not _ENABLE_BATCH:
+        return {"enabled": False}
+    return {"enabled": True, **_get_batcher().stats()}
+
+def queue_depth() -> int:
+    """Syntheses waiting for the model: in the micro-batch queue, or for a worker slot."""
+    pool = get_worker_pool()
+    if pool is not None:
+        return pool.queued()
+    if _BATCHER is not None:
+        return _BATCHER.stats()["queue_depth"]
+    return 0
+
+# Sentence ends (keep the terminator with its sentence) and clause breaks inside a long sentence.
+# A terminator must be followed by whitespace, so decimals ("3.5") and dotted names never split.
+_SENTENCE_RE = re.compile(r"(?<=[.!?\u2026\u3002])\s+|(?<=[.!?\u2026\u3002][\"'\u201d\u2019)\]])\s+")
+_CLAUSE_RE = re.compile(r"(?<=[,;:\u2014\u2013])\s+")
+# A full stop after these doesn't end the sentence
+_ABBREVIATIONS = frozenset((
+    "mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "mt", "ft", "rev", "gen", "col", "capt", "lt", "sgt", "gov",
+    "sen", "rep", "vs", "etc", "e.g", "i.e", "cf", "approx", "no", "vol", "fig", "inc", "ltd", "co", "corp", "dept",
+    "est", "jan", "feb", "mar", "apr", "jun", "jul", "aug", "sep", "sept", "oct", "nov", "dec",
+))
+_INITIALS_RE = re.compile(r"(?:[A-Za-z]\.)+")  # "J." or "U.S."
+
+def _ends_with_abbreviation(sentence: str) -> bool:
+    if not sentence.endswith("."):
+        return False
+    word = sentence.rsplit(None, 1)[-1].lstrip("\"'(\u201c\u2018[")
+    return word[:-1].lower() in _ABBREVIATIONS or (word != "I." and bool(_INITIALS_RE.fullmatch(word)))
+
+def _sentences(text: str) -> List[str]:
+    """Sentences of text, not split after abbreviations, initials or decimals."""
+    sentences = []
+    for sentence in _SENTENCE_RE.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if sentences and _ends_with_abbreviation(sentences[-1]):
+            sentences[-1] = f"{sentences[-1]} {sentence}"
+        else:
+            sentences.append(sentence)
+    return sentences
+
+def _split_long(piece: str, max_chars: int) -> List[str]:
+    """
+    Split an over-long sentence on clause breaks, then on whitespace, and cut runs without
+    whitespace (CJK text, URLs, long numbers) every max_chars as a last resort.
+    """
+    if len(piece) <= max_chars:
+        return [piece]
+    out = []
+    for clause in _CLAUSE_RE.split(piece):
+        if len(clause) <= max_chars:
+            out.append(clause)
+            continue
+        line = ""
+        for word in clause.split():
+            if len(word) > max_chars:
+                if line:
+                    out.append(line)
+                out.extend(word[i:i + max_chars] for i in range(0, len(word) - max_chars, max_chars))
+                word = word[(len(word) - 1) // max_chars * max_chars:]
+                line = ""
+            if line and len(line) + 1 + len(word) > max_chars:
+                out.append(line)
+                line = word
+            else:
+                line = f"{line} {word}" if line else word
+        if line:
+            out.append(line)
+    return out
+
+def segment_text(text: str, max_chars: int = _SEGMENT_MAX_CHARS, pack: bool = True,
+                 min_chars: int = _SEGMENT_MIN_CHARS) -> List[str]:
+    """
+    Split text into sentence/clause-aligned segments of at most max_chars,
+    greedily packing short neighbours together so we don't synthesize fragments.
+    With pack=False sentences stay separate (the unit the segment cache reuses), except that
+    one shorter than min_chars joins its neighbour, so "Hi!" is never voiced on its own.
+    """
+    text = text.strip()
+    if pack and len(text) <= max_chars:
+        return [text] if text else []
+    pieces = []
+    for sentence in _sentences(text):
+        pieces.extend(_split_long(sentence, max_chars))
+    segments = []
+    for piece in pieces:
+        if segments and len(segments[-1]) + 1 + len(piece) <= max_chars and (
+                pack or len(segments[-1]) < min_chars):
+            segments[-1] = f"{segments[-1]} {piece}"
+        else:
+            segments.append(piece)
+    if not pack and len(segments) > 1 and len(segments[-1]) < min_chars \
+            and len(segments[-2]) + 1 + len(segments[-1]) <= max_chars:
+        segments[-2:] = [f"{segments[-2]} {segments[-1]}"]
+    return segments
+
+def _crossfade_join(wavs: List[torch.Tensor], sample_rate: int = _SAMPLE_RATE, fade_ms: float = _CROSSFADE_MS,
+                    pause_ms: float = _PAUSE_MS) -> torch.Tensor:
+    """
+    Concatenate segment waveforms with a short pause between them, faded out into
+    and in from the silence (a plain linear cross-fade at each seam without a pause).
+    """
+    wavs = [w for w in (_as_mono(w) for w in wavs) if w is not None]
+    if not wavs:
+        return torch.zeros(0)
+    if len(wavs) == 1:
+        return wavs[0]
+    pause = int(sample_rate * pause_ms / 1000)
+    if pause > 0:
+        silence = torch.zeros(pause)
+        wavs = [part for w in wavs for part in (w, silence)][:-1]
+    fade = min([int(sample_rate * fade_ms / 1000)] + [w.shape[0] // 2 for w in wavs])
+    if fade <= 0:
+        return torch.cat(wavs)
+    # Linear ramps sum to 1, so a seam never gets louder than its neighbours
+    fade_in = torch.linspace(0.0, 1.0, fade)
+    fade_out = 1.0 - fade_in
+    out = torch.zeros(sum(w.shape[0] for w in wavs) - fade * (len(wavs) - 1))
+    pos = 0
+    for i, w in enumerate(wavs):
+        w = w.clone()
+        if i > 0:
+            w[:fade] *= fade_in
+        if i < len(wavs) - 1:
+            w[-fade:] *= fade_out
+        out[pos:pos + w.shape[0]] += w
+        pos += w.shape[0] - fade
+    return out
+
+def synthesize_segment_wavs(segments: List[str], speaker_embed=None) -> Tuple[List[torch.Tensor], List[bool]]:
+    """
+    Synthesize already-segmented text, one waveform per segment (batched or on the worker pool),
+    and for each segment whether it is a fallback clip rather than speech.
+    """
+    pool = get_worker_pool()
+    if pool is not None:
+        def remote(segment):
+            fallback = threading.Event()
+            pcm = pool.synthesize(segment, speaker_embed, "pcm", fallback=fallback)
+            return _pcm16_to_wav(pcm), fallback.is_set()
+        if len(segments) == 1:
+            results = [remote(segments[0])]
+        else:
+            # Segments go out together so idle workers pick them up in parallel
+            with ThreadPoolExecutor(max_workers=len(segments)) as ex:
+                results = list(ex.map(remote, segments))
+        return [wav for wav, _ in results], [fell_back for _, fell_back in results]
+    if _ENABLE_BATCH:
+        batcher = _get_batcher()
+        futures = [batcher.submit(segment, speaker_embed) for segment in segments]
+        wavs = [f.result() for f in futures]
+    elif len(segments) > 1:
+        wavs = _synthesize_wav_batch_impl(segments, speaker_embed)
+    else:
+        wavs = [_synthesize_wav_impl(segments[0], speaker_embed)]
+    # In this process fallbacks are the assets' own waveform objects
+    return wavs, [audio_assets.for_wav(wav) is not None for wav in wavs]
+
+def _synthesize_segments(text: str, speaker_embed=None) -> Tuple[List[torch.Tensor], List[bool]]:
+    """Segment text and synthesize every segment (batched when DIA_ENABLE_BATCH)."""
+    return synthesize_segment_wavs(segment_text(text) or [text], speaker_embed)
+
+def fallback_asset(wavs: List[torch.Tensor]):
+    """The pre-encoded asset when a synthesis result is a single fallback clip, else None."""
+    return audio_assets.for_wav(wavs[0]) if len(wavs) == 1 else None
+
+def wavs_to_pcm16(wavs: List[torch.Tensor]) -> bytes:
+    """Cross-fade segment waveforms into one clip of 16-bit PCM at _SAMPLE_RATE."""
+    return _pcm16_bytes(_crossfade_join(wavs))
+
+def wavs_to_mp3(wavs: List[torch.Tensor]) -> bytes:
+    """Cross-fade segment waveforms into one clip and encode it to MP3."""
+    asset = fallback_asset(wavs)
+    if asset is not None:
+        return asset.mp3  # fallback: serve the pre-encoded bytes as-is
+    return _wav_to_mp3_bytes(_crossfade_join(wavs), _SAMPLE_RATE)
+
+def synthesize_wav(text: str, speaker_embed=None, fallback: Optional[threading.Event] = None) -> torch.Tensor:
+    """
+    Synthesize to a mono float waveform at _SAMPLE_RATE.
+    Long text is split into segments that are batched/synthesized concurrently and
+    cross-faded back together; concurrent calls share forward passes (DIA_ENABLE_BATCH).
+    `fallback` is set when any segment is a fallback clip rather than speech.
+    """
+    pool = get_worker_pool()
+    if pool is not None:
+        return _pcm16_to_wav(pool.synthesize(text, speaker_embed, "pcm", fallback=fallback))
+    wavs, fallbacks = _synthesize_segments(text, speaker_embed)
+    if fallback is not None and any(fallbacks):
+        fallback.set()
+    return _crossfade_join(wavs)
+
+def synthesize(text: str, speaker_embed=None, fallback: Optional[threading.Event] = None) -> bytes:
     """
     Non-streaming synth: returns full MP3 bytes.
     Optionally accepts speaker embedding for voice cloning.
+    `fallback` is set when any segment is a fallback clip rather than speech.
     """
     start = time.time()
-    mp3 = _synthesize_impl(text, speaker_embed)
+    pool = get_worker_pool()
+    if pool is not None:
+        # The worker encodes, so only the MP3 crosses the process boundary
+        mp3 = pool.synthesize(text, speaker_embed, "mp3", fallback=fallback)
+    else:
+        wavs, fallbacks = _synthesize_segments(text, speaker_embed)
+        if fallback is not None and any(fallbacks):
+            fallback.set()
+        mp3 = wavs_to_mp3(wavs)
     duration = time.time() - start
     print(f"Synthesis completed in {duration:.2f}s")
     return mp3
 
-def synthesize_streaming(text: str, speaker_embed=None, chunk_ms: int = 240) -> Generator[bytes, None, None]:
+class _TokenStreamer:
+    """Minimal transformers streamer: generate() calls put() once per step and end() when done."""
+
+    def __init__(self):
+        self.queue: "queue.Queue[Optional[torch.Tensor]]" = queue.Queue()
+
+    def put(self, value: torch.Tensor) -> None:
+        self.queue.put(value.detach().to("cpu"))
+
+    def end(self) -> None:
+        self.queue.put(None)
+
+class _CancelCriteria(StoppingCriteria):
+    """Stops generation once the streaming client has gone away."""
+
+    def __init__(self, cancelled: threading.Event):
+        self.cancelled = cancelled
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.cancelled.is_set(), dtype=torch.bool, device=input_ids.device)
+
+def _token_streaming_available() -> bool:
+    return (
+        _PIPE is None
+        and _MODEL is not None
+        and _PROCESSOR is not None
+        and hasattr(_MODEL, "generate")
+        and hasattr(_PROCESSOR, "batch_decode")
+    )
+
+@torch.inference_mode()
+def _decode_window(ids: torch.Tensor, emitted: int, end: int) -> bytes:
+    """
+    Decode tokens [emitted, end) to 16-bit PCM.
+    A little left context is re-decoded so the codec sees continuous input; its samples are dropped.
+    """
+    start = max(0, emitted - _STREAM_CONTEXT_TOKENS)
+    wav = _PROCESSOR.batch_decode(ids[:, start:end], sampling_rate=_SAMPLE_RATE)
+    if isinstance(wav, (list, tuple)) and wav:
+        wav = wav[0]
+    if not isinstance(wav, torch.Tensor):
+        raise TypeError(f"batch_decode returned {type(wav).__name__}, expected a waveform tensor")
+    wav = wav.reshape(-1)
+    samples_per_token = wav.shape[0] / max(1, end - start)
+    skip = int(round((emitted - start) * samples_per_token))
+    return _pcm16_bytes(wav[skip:])
+
+def _stream_pcm_from_tokens(text: str, speaker_embed=None) -> Generator[bytes, None, None]:
+    """
+    Run generate() on a background thread and decode every DIA_STREAM_WINDOW_TOKENS
+    tokens to 16-bit PCM as they arrive.
+    """
+    inputs = _PROCESSOR(text=text, return_tensors="pt").to(_DEVICE)
+    generate_kwargs = _speaker_generate_kwargs(speaker_embed)
+    streamer = _TokenStreamer()
+    cancelled = threading.Event()
+    errors = []
+    budget = token_budget.estimate(text)
+
+    def run():
+        try:
+            with torch.inference_mode(), torch.cuda.amp.autocast(enabled=(_DEVICE == "cuda"), dtype=torch.float16):
+                _MODEL.generate(
+                    **inputs,
+                    streamer=streamer,
+                    **_generation_controls(budget, cancelled),
+                    **generate_kwargs,
+                )
+        except Exception as e:
+            errors.append(e)
+        finally:
+            streamer.end()
+
+    threading.Thread(target=run, name="dia-stream", daemon=True).start()
+
+    steps = []
+    n_tokens = 0
+    emitted = 0
+    try:
+        while True:
+            value = streamer.queue.get()
+            if value is None:
+                break
+            # Token ids arrive as [batch] per step (or [batch, n] for the prompt); sequence is dim 1
+            steps.append(value if value.dim() >= 2 else value.unsqueeze(-1))
+            n_tokens += steps[-1].shape[1]
+            if n_tokens - emitted >= _STREAM_WINDOW_TOKENS:
+                pcm = _decode_window(torch.cat(steps, dim=1), emitted, n_tokens)
+                emitted = n_tokens
+                yield pcm
+        if errors:
+            raise errors[0]
+        if steps:
+            ids = torch.cat(steps, dim=1)
+            _record_generation([text], ids, inputs, budget)
+            if n_tokens > emitted:
+                yield _decode_window(ids, emitted, n_tokens)
+    finally:
+        # Client disconnects close this generator; stop the model instead of finishing the clip
+        cancelled.set()
+
+def _crossfade_pcm16(tail: bytes, head: bytes) -> bytes:
+    """Linear cross-fade of two equal-length 16-bit PCM spans (one seam of _crossfade_join)."""
+    fade_in = torch.linspace(0.0, 1.0, len(tail) // 2)
+    return _pcm16_bytes(_pcm16_to_wav(tail) * (1.0 - fade_in) + _pcm16_to_wav(head) * fade_in)
+
+def _local_pcm_stream(text: str, speaker_embed=None) -> Generator[bytes, None, None]:
+    """
+    Token-stream each text segment in turn in this process. The last DIA_CROSSFADE_MS of
+    audio is held back and faded into the next segment (through DIA_SEGMENT_PAUSE_MS of
+    silence), so seams match _crossfade_join.
+    """
+    fade_bytes = 2 * int(_SAMPLE_RATE * _CROSSFADE_MS / 1000)
+    pause_bytes = 2 * int(_SAMPLE_RATE * _PAUSE_MS / 1000)
+    held = b""  # end of the audio so far, not sent yet
+    for segment in segment_text(text) or [text]:
+        pcm_stream = _stream_pcm_from_tokens(segment, speaker_embed)
+        seam = bool(held)
+        try:
+            for pcm in pcm_stream:
+                if seam and pause_bytes:
+                    # Fade out into the pause and in from it; each fade covers at most half the pause
+                    n = min(len(held), pause_bytes // 2) & ~1
+                    m = min(fade_bytes, len(pcm) // 2, pause_bytes // 2) & ~1
+                    pcm = (held[:len(held) - n] + _crossfade_pcm16(held[len(held) - n:], bytes(n))
+                           + bytes(pause_bytes - n - m) + _crossfade_pcm16(bytes(m), pcm[:m]) + pcm[m:])
+                    seam = False
+                elif seam:
+                    # Like _crossfade_join, the fade never covers more than half of the new audio
+                    n = min(len(held), len(pcm) // 2) & ~1
+                    pcm = held[:len(held) - n] + _crossfade_pcm16(held[len(held) - n:], pcm[:n]) + pcm[n:]
+                    seam = False
+                else:
+                    pcm = held + pcm
+                held = pcm[len(pcm) - min(fade_bytes, len(pcm)):]
+                if len(pcm) > len(held):
+                    yield pcm[:len(pcm) - len(held)]
+        finally:
+            pcm_stream.close()
+    if held:
+        yield held
+
+def synthesize_pcm_stream(text: str, speaker_embed=None,
+                          fallback: Optional[threading.Event] = None) -> Generator[bytes, None, None]:
+    """
+    Yield 16-bit PCM for text as soon as it is available.
+    Served by an inference worker when the pool is running; otherwise token-streamed
+    here (raw model backend) or produced in one piece by synthesize_wav().
+    `fallback` is set when the audio includes a fallback clip rather than speech.
     """
-    Streaming generator that yields MP3 chunks.
-    Strategy: produce full mp3 then slice into ~chunk_ms frames; good enough for UX.
-    (Real-time vocoder chunking needs model-specific support; this keeps API stable.)
+    pool = get_worker_pool()
+    if pool is not None:
+        yield from pool.stream(text, speaker_embed, "pcm", fallback=fallback)
+        return
+    if _token_streaming_available():
+        stream = _local_pcm_stream(text, speaker_embed)
+        started = False
+        try:
+            for pcm in stream:
+                started = True
+                yield pcm
+            return
+        except Exception as e:
+            if started:
+                raise
+            print(f"Incremental streaming failed, falling back to full synthesis: {e}")
+        finally:
+            stream.close()
+    yield _pcm16_bytes(synthesize_wav(text, speaker_embed, fallback=fallback))
+
+def synthesize_streaming(text: str, speaker_embed=None, chunk_ms: int = 240,
+                         fallback: Optional[threading.Event] = None,
+                         pcm_sink: Optional[Callable[[bytes], None]] = None) -> Generator[bytes, None, None]:
     """
-    mp3 = synthesize(text, speaker_embed)
-    # naive slicing by bytes — MP3 frames are variable; this is a UX trick, not bit-perfect.
-    total = len(mp3)
-    parts = max(1, total // (16000 // (1000 // chunk_ms)))  # heuristic
-    step = max(1024, total // parts)
-    for i in range(0, total, step):
-        yield mp3[i : i + step]
\ No newline at end of file
+    Streaming generator that yields ~chunk_ms MP3 chunks, each ending on an MP3 frame boundary.
+    PCM from synthesize_pcm_stream() goes through one persistent MP3 encoder, so with the
+    raw model backend the first chunk arrives long before synthesis finishes.
+    Without lameenc the full clip is synthesized and then sliced.
+    `fallback` is set when the audio turned out to be a fallback clip rather than speech;
+    `pcm_sink`, if given, receives the 16-bit PCM that was encoded (e.g. to cache it losslessly).
+    """
+    if not (_ENABLE_STREAM and supports_mp3_streaming()):
+        if pcm_sink is None:
+            mp3 = synthesize(text, speaker_embed, fallback=fallback)
+        else:
+            pcm = b"".join(synthesize_pcm_stream(text, speaker_embed, fallback=fallback))
+            pcm_sink(pcm)
+            mp3 = encoder_pool.encode(pcm, _SAMPLE_RATE, "mp3")
+        yield from iter_frame_chunks(mp3, chunk_ms)
+        return
+
+    encoder = new_mp3_stream_encoder(_SAMPLE_RATE)
+    splitter = Mp3FrameSplitter()
+    pcm_stream = synthesize_pcm_stream(text, speaker_embed, fallback=fallback)
+    try:
+        for pcm in pcm_stream:
+            if pcm_sink is not None:
+                pcm_sink(pcm)
+            frames = splitter.feed(bytes(encoder.encode(pcm)))
+            if frames:
+                yield from iter_frame_chunks(frames, chunk_ms)
+    finally:
+        pcm_stream.close()
+    tail = splitter.feed(bytes(encoder.flush())) + splitter.flush()
+    if tail:
+        yield from iter_frame_chunks(tail, chunk_ms)
@@ -0,0 +1,171 @@
+"""
+In-process audio encoding.
+
+Replaces pydub/ffmpeg (one subprocess + temp files per export) with encoders that
+run inside the interpreter on a small, long-lived thread pool:
+
+- mp3:  LAME via lameenc, falling back to libsndfile's MPEG writer
+- wav:  RIFF header + 16-bit PCM
+- pcm:  raw little-endian 16-bit PCM
+- opus: Ogg/Opus via libsndfile (soundfile)
+- flac: lossless, via libsndfile; also the canonical format audio is cached in
+"""
+import io
+import os
+import struct
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Tuple, Union
+
+import numpy as np
+
+try:
+    import lameenc  # in-process LAME
+except ImportError:
+    lameenc = None
+
+try:
+    import soundfile as sf  # libsndfile: Ogg/Opus and (libsndfile >= 1.1) MP3
+except (ImportError, OSError):
+    sf = None
+
+_ENCODER_THREADS = int(os.getenv("AUDIO_ENCODER_THREADS", "2"))
+_DEFAULT_BITRATE = int(os.getenv("AUDIO_MP3_BITRATE", "64"))  # kbps
+DEFAULT_MP3_BITRATE = _DEFAULT_BITRATE
+MP3_BITRATES = (8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)  # what LAME accepts
+
+MEDIA_TYPES = {
+    "mp3": "audio/mpeg",
+    "wav": "audio/wav",
+    "pcm": "audio/L16",
+    "opus": "audio/ogg",
+    "flac": "audio/flac",
+}
+
+# Lossless representation the cache keeps; every other format is transcoded from it
+CANONICAL_FORMAT = "flac" if sf is not None and "FLAC" in sf.available_formats() else "wav"
+
+PcmLike = Union[bytes, bytearray, memoryview, np.ndarray]
+
+
+def _as_int16(pcm: PcmLike) -> np.ndarray:
+    """Accept 16-bit PCM bytes or a numpy array (int16, or float in [-1, 1])."""
+    if isinstance(pcm, np.ndarray):
+        if pcm.dtype == np.int16:
+            return pcm.reshape(-1)
+        return (np.clip(pcm.reshape(-1), -1.0, 1.0) * 32767).astype(np.int16)
+    return np.frombuffer(pcm, dtype=np.int16)
+
+
+def supports_mp3_streaming() -> bool:
+    return lameenc is not None
+
+
+def new_mp3_stream_encoder(sample_rate: int, bitrate: int = _DEFAULT_BITRATE):
+    """A fresh LAME encoder for incremental encoding (encode()/flush()). None without lameenc."""
+    if lameenc is None:
+        return None
+    enc = lameenc.Encoder()
+    enc.set_bit_rate(bitrate)
+    enc.set_in_sample_rate(sample_rate)
+    enc.set_channels(1)
+    enc.set_quality(2)
+    return enc
+
+
+def _encode_mp3(samples: np.ndarray, sample_rate: int, bitrate: int) -> bytes:
+    enc = new_mp3_stream_encoder(sample_rate, bitrate)
+    if enc is not None:
+        return bytes(enc.encode(samples.tobytes())) + bytes(enc.flush())
+    if sf is not None and "MP3" in sf.available_formats():
+        buf = io.BytesIO()
+        sf.write(buf, samples, sample_rate, format="MP3", subtype="MPEG_LAYER_III")
+        return buf.getvalue()
+    # Last resort: the legacy ffmpeg path
+    from pydub import AudioSegment
+    buf = io.BytesIO()
+    AudioSegment(samples.tobytes(), frame_rate=sample_rate, sample_width=2, channels=1).export(
+        buf, format="mp3", bitrate=f"{bitrate}k"
+    )
+    return buf.getvalue()
+
+
+def _encode_wav(samples: np.ndarray, sample_rate: int) -> bytes:
+    data = samples.tobytes()
+    header = struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + len(data), b"WAVE",
+        b"fmt ", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+        b"data", len(data),
+    )
+    return header + data
+
+
+def _encode_opus(samples: np.ndarray, sample_rate: int) -> bytes:
+    if sf is None:
+        raise RuntimeError("Ogg/Opus encoding requires the soundfile package")
+    buf = io.BytesIO()
+    sf.write(buf, samples, sample_rate, format="OGG", subtype="OPUS")
+    return buf.getvalue()
+
+
+def _encode_flac(samples: np.ndarray, sample_rate: int) -> bytes:
+    if sf is None:
+        raise RuntimeError("FLAC encoding requires the soundfile package")
+    buf = io.BytesIO()
+    sf.write(buf, samples, sample_rate, format="FLAC", subtype="PCM_16")
+    return buf.getvalue()
+
+
+def decode_audio(data: bytes) -> Tuple[np.ndarray, int]:
+    """Decode a canonical (FLAC or WAV) blob back to mono int16 samples and its sample rate."""
+    if data[:4] == b"RIFF" and data[12:16] == b"fmt " and data[36:40] == b"data":
+        # Our own 44-byte header (see _encode_wav); no libsndfile needed
+        sample_rate = struct.unpack_from("<I", data, 24)[0]
+        return np.frombuffer(data, dtype=np.int16, offset=44), sample_rate
+    if sf is None:
+        raise RuntimeError("decoding this audio requires the soundfile package")
+    samples, sample_rate = sf.read(io.BytesIO(data), dtype="int16")
+    return samples.reshape(-1), sample_rate
+
+
+def encode_audio(pcm: PcmLike, sample_rate: int, fmt: str = "mp3", bitrate: int = _DEFAULT_BITRATE) -> bytes:
+    """Encode mono 16-bit PCM on the calling thread."""
+    samples = _as_int16(pcm)
+    if fmt == "mp3":
+        return _encode_mp3(samples, sample_rate, bitrate)
+    if fmt == "wav":
+        return _encode_wav(samples, sample_rate)
+    if fmt == "pcm":
+        return samples.tobytes()
+    if fmt == "opus":
+        return _encode_opus(samples, sample_rate)
+    if fmt == "flac":
+        return _encode_flac(samples, sample_rate)
+    raise ValueError(f"Unsupported audio format: {fmt}")
+
+
+def transcode_audio(data: bytes, fmt: str = "mp3", bitrate: int = _DEFAULT_BITRATE) -> bytes:
+    """Decode a canonical blob and re-encode it in fmt."""
+    samples, sample_rate = decode_audio(data)
+    return encode_audio(samples, sample_rate, fmt, bitrate)
+
+
+class EncoderPool:
+    """Long-lived worker threads that run encode_audio(); no process spawn per request."""
+
+    def __init__(self, threads: int = _ENCODER_THREADS):
+        self.threads = max(1, threads)
+        self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="audio-enc")
+
+    def submit(self, pcm: PcmLike, sample_rate: int, fmt: str = "mp3", bitrate: int = _DEFAULT_BITRATE) -> Future:
+        return self._executor.submit(encode_audio, pcm, sample_rate, fmt, bitrate)
+
+    def encode(self, pcm: PcmLike, sample_rate: int, fmt: str = "mp3", bitrate: int = _DEFAULT_BITRATE) -> bytes:
+        return self.submit(pcm, sample_rate, fmt, bitrate).result()
+
+    def submit_transcode(self, data: bytes, fmt: str = "mp3", bitrate: int = _DEFAULT_BITRATE) -> Future:
+        return self._executor.submit(transcode_audio, data, fmt, bitrate)
+
+
+# Global instance
+encoder_pool = EncoderPool()
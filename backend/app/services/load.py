@@ -0,0 +1,207 @@
+"""
+Load-shedding circuit breaker driven by real synthesis pressure.
+
+A sampler thread reads, every LOAD_SAMPLE_INTERVAL_S: syntheses waiting for the
+model (micro-batch queue or worker slots), syntheses in flight, the p95 of
+syntheses finished in the last LOAD_WINDOW_S, and host CPU utilisation. The
+breaker opens when any of them reaches its LOAD_MAX_* threshold and stays open
+at least LOAD_OPEN_S; it then goes half-open and lets LOAD_PROBES requests
+through. It closes only once every signal is back under LOAD_RECOVER_RATIO of
+its threshold (hysteresis), and re-opens if a probe fails or pressure is still
+high. Only probes settle the half-open state: admit() hands each one a token that
+release() must pass back, and requests admitted before the breaker opened (or
+probes of an earlier half-open period) are ignored when they finish. CPU only counts while more than one synthesis is queued or running: a
+single synthesis may use every core. Requests only read the current state, so
+the check is O(1).
+"""
+import os
+import threading
+import time
+from collections import deque
+from typing import Optional, Tuple
+
+_SAMPLE_INTERVAL_S = float(os.getenv("LOAD_SAMPLE_INTERVAL_S", "1"))
+_WINDOW_S = float(os.getenv("LOAD_WINDOW_S", "60"))                 # synthesis latencies considered for the p95
+_MIN_SAMPLES = int(os.getenv("LOAD_MIN_SAMPLES", "10"))             # fewer latencies than this: p95 is not used
+_MAX_QUEUE = int(os.getenv("LOAD_MAX_QUEUE", "32"))
+_MAX_IN_FLIGHT = int(os.getenv("LOAD_MAX_IN_FLIGHT", "16"))
+_MAX_P95_S = float(os.getenv("LOAD_MAX_P95_S", "20"))
+_MAX_CPU = float(os.getenv("LOAD_MAX_CPU", "0.95"))                 # fraction of all cores; 0 disables
+_RECOVER_RATIO = float(os.getenv("LOAD_RECOVER_RATIO", "0.7"))      # close below this fraction of every threshold
+_OPEN_S = float(os.getenv("LOAD_OPEN_S", "10"))
+_PROBES = int(os.getenv("LOAD_PROBES", "2"))
+
+
+class _CpuSampler:
+    """Host CPU utilisation since the previous call, from /proc/stat (load average elsewhere)."""
+
+    def __init__(self):
+        self._last = self._read()
+
+    @staticmethod
+    def _read():
+        try:
+            with open("/proc/stat") as f:
+                fields = [int(v) for v in f.readline().split()[1:]]
+            return sum(fields), fields[3] + (fields[4] if len(fields) > 4 else 0)  # total, idle + iowait
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def sample(self) -> Optional[float]:
+        current, last = self._read(), self._last
+        self._last = current
+        if current is None or last is None:
+            try:
+                return min(1.0, os.getloadavg()[0] / (os.cpu_count() or 1))
+            except OSError:
+                return None
+        total, idle = current[0] - last[0], current[1] - last[1]
+        return 1.0 - idle / total if total > 0 else None
+
+
+def _queue_depth() -> int:
+    from .dia import queue_depth
+    return queue_depth()
+
+
+class LoadBreaker:
+    def __init__(self, max_queue: int = _MAX_QUEUE, max_in_flight: int = _MAX_IN_FLIGHT, max_p95_s: float = _MAX_P95_S,
+                 max_cpu: float = _MAX_CPU, recover_ratio: float = _RECOVER_RATIO, open_s: float = _OPEN_S,
+                 probes: int = _PROBES, window_s: float = _WINDOW_S, sample_interval: float = _SAMPLE_INTERVAL_S):
+        self.thresholds = {"queue_depth": max_queue, "in_flight": max_in_flight, "p95_s": max_p95_s, "cpu": max_cpu}
+        self.recover_ratio = recover_ratio
+        self.open_s = open_s
+        self.probes = max(1, probes)
+        self.window_s = window_s
+        self.sample_interval = sample_interval
+        self.state = "closed"
+        self.reason = None
+        self._opened_at = 0.0
+        self._probing = 0
+        self._half_opened = 0                  # half-open periods so far; a probe's token is the one it belongs to
+        self._in_flight = 0
+        self._latencies = deque(maxlen=4096)   # (finished at, seconds)
+        self.signals = {"queue_depth": 0, "in_flight": 0, "p95_s": None, "cpu": None}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+        self._stats = {"opened": 0, "rejected": 0, "probes": 0}
+
+    # Synthesis accounting (single-flight computes and streamed syntheses)
+
+    def begin(self) -> float:
+        with self._lock:
+            self._in_flight += 1
+        return time.monotonic()
+
+    def end(self, started: float) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._in_flight -= 1
+            self._latencies.append((now, now - started))
+
+    # Admission
+
+    def admit(self) -> Tuple[Optional[float], Optional[int]]:
+        """
+        (None, probe) if the request may proceed, else (seconds the caller should wait before retrying, None).
+        probe is a token when the request is a half-open probe, else None; pass it back to release().
+        """
+        if self.state == "closed":
+            return None, None
+        with self._lock:
+            if self.state == "half_open" and self._probing < self.probes:
+                self._probing += 1
+                self._stats["probes"] += 1
+                return None, self._half_opened
+            self._stats["rejected"] += 1
+            return max(1.0, self._opened_at + self.open_s - time.monotonic()), None
+
+    def release(self, ok: bool, probe: Optional[int] = None) -> None:
+        """A request admitted by admit() finished; if it was a probe of the current half-open period, this settles it."""
+        if probe is None or self.state != "half_open":
+            return
+        with self._lock:
+            if self.state != "half_open" or probe != self._half_opened:
+                return  # the breaker re-opened since this probe was admitted
+            self._probing -= 1
+            if not ok:
+                self._open("probe_failed")
+            elif self._recovered():
+                self.state, self.reason = "closed", None
+
+    # Sampling and state transitions
+
+    def start(self) -> None:
+        if self._sampler is None:
+            self._stop.clear()
+            self._sampler = threading.Thread(target=self._run, name="load-sampler", daemon=True)
+            self._sampler.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        cpu = _CpuSampler()
+        while not self._stop.wait(self.sample_interval):
+            try:
+                self.sample(cpu.sample())
+            except Exception as e:
+                print(f"Load sampling failed: {type(e).__name__}: {e}")
+
+    def sample(self, cpu: Optional[float]) -> None:
+        queue_depth = _queue_depth()
+        now = time.monotonic()
+        with self._lock:
+            while self._latencies and self._latencies[0][0] < now - self.window_s:
+                self._latencies.popleft()
+            recent = sorted(latency for _, latency in self._latencies)
+            p95 = recent[int(0.95 * (len(recent) - 1))] if len(recent) >= _MIN_SAMPLES else None
+            self.signals = {"queue_depth": queue_depth, "in_flight": self._in_flight, "p95_s": p95, "cpu": cpu}
+            overloaded = self._over(1.0)
+            if self.state == "closed" and overloaded:
+                self._open(overloaded)
+            elif self.state == "open" and now >= self._opened_at + self.open_s:
+                self.state, self._probing = "half_open", 0
+                self._half_opened += 1
+            elif self.state == "half_open" and overloaded:
+                self._open(overloaded)
+            elif self.state == "half_open" and self._probing == 0 and self._recovered():
+                self.state, self.reason = "closed", None  # pressure drained without needing a probe
+
+    def _over(self, ratio: float) -> Optional[str]:
+        """The first signal at or above ratio * its threshold (thresholds of 0 are disabled)."""
+        busy = self.signals["queue_depth"] > 0 or self.signals["in_flight"] > 1
+        for name, limit in self.thresholds.items():
+            value = self.signals[name]
+            if name == "cpu" and not busy:
+                continue  # one synthesis may use every core; that alone isn't saturation
+            if limit and value is not None and value >= limit * ratio:
+                return name
+        return None
+
+    def _recovered(self) -> bool:
+        return self._over(self.recover_ratio) is None
+
+    def _open(self, reason: str) -> None:
+        if self.state != "open":
+            self._stats["opened"] += 1
+            print(f"Load breaker opened: {reason} {self.signals}")
+        self.state, self.reason = "open", reason
+        self._opened_at = time.monotonic()
+        self._probing = 0
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "reason": self.reason,
+            "signals": self.signals,
+            "thresholds": self.thresholds,
+            "recover_ratio": self.recover_ratio,
+            "open_s": self.open_s,
+            **self._stats,
+        }
+
+
+# Global instance
+load_breaker = LoadBreaker()
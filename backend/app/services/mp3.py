@@ -0,0 +1,150 @@
+"""
+MPEG audio frame helpers.
+
+Used to cut MP3 byte streams on frame boundaries so every chunk handed to a
+client (or written to a cache) is independently decodable.
+"""
+from typing import AsyncIterator, Generator, Optional, Tuple
+
+# Layer III bitrate tables (kbps), indexed by the 4-bit bitrate field
+_BITRATES_V1 = (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+_BITRATES_V2 = (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)
+# Sample rates indexed by the 2-bit version field (0=MPEG2.5, 2=MPEG2, 3=MPEG1)
+_SAMPLE_RATES = {
+    0: (11025, 12000, 8000),
+    2: (22050, 24000, 16000),
+    3: (44100, 48000, 32000),
+}
+
+
+def parse_frame_header(buf, pos: int = 0) -> Optional[Tuple[int, int, int]]:
+    """
+    Parse a Layer III frame header at ``pos``.
+
+    Returns (frame_length_bytes, sample_rate, samples_per_frame) or None if the
+    bytes at ``pos`` are not a valid header.
+    """
+    if pos + 4 > len(buf):
+        return None
+    b1, b2, b3 = buf[pos + 1], buf[pos + 2], buf[pos + 3]
+    if buf[pos] != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+    version = (b1 >> 3) & 0x03
+    layer = (b1 >> 1) & 0x03
+    if version == 1 or layer != 1:  # reserved version / not Layer III
+        return None
+    bitrate_idx = (b2 >> 4) & 0x0F
+    rate_idx = (b2 >> 2) & 0x03
+    if bitrate_idx in (0, 15) or rate_idx == 3:
+        return None
+    padding = (b2 >> 1) & 0x01
+    sample_rate = _SAMPLE_RATES[version][rate_idx]
+    if version == 3:
+        bitrate = _BITRATES_V1[bitrate_idx] * 1000
+        return 144 * bitrate // sample_rate + padding, sample_rate, 1152
+    bitrate = _BITRATES_V2[bitrate_idx] * 1000
+    return 72 * bitrate // sample_rate + padding, sample_rate, 576
+
+
+def _id3_length(buf, pos: int) -> Optional[int]:
+    """Total length of an ID3v2 tag at ``pos`` (None if there is none or it is incomplete)."""
+    if pos + 10 > len(buf) or bytes(buf[pos:pos + 3]) != b"ID3":
+        return None
+    size = 0
+    for b in buf[pos + 6:pos + 10]:
+        size = (size << 7) | (b & 0x7F)
+    return 10 + size
+
+
+class Mp3FrameSplitter:
+    """
+    Incremental frame aligner for an MP3 byte stream.
+
+    ``feed()`` returns every complete frame received so far and keeps the partial
+    tail; ``flush()`` returns whatever is left. Bytes are never dropped, so the
+    concatenated output is identical to the input.
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    def feed(self, data: bytes) -> bytes:
+        if data:
+            self._buf += data
+        cut = self._complete_prefix()
+        if not cut:
+            return b""
+        out = bytes(self._buf[:cut])
+        del self._buf[:cut]
+        return out
+
+    def flush(self) -> bytes:
+        out = bytes(self._buf)
+        self._buf.clear()
+        return out
+
+    def _complete_prefix(self) -> int:
+        buf = self._buf
+        pos = 0
+        n = len(buf)
+        while pos < n:
+            if buf[pos] == 0x49:  # 'I' of an ID3 tag
+                tag = _id3_length(buf, pos)
+                if tag is not None:
+                    if pos + tag > n:
+                        break
+                    pos += tag
+                    continue
+                if n - pos < 10 and b"ID3".startswith(bytes(buf[pos:pos + 3])):
+                    break  # tag header still arriving
+            header = parse_frame_header(buf, pos)
+            if header is not None:
+                if pos + header[0] > n:
+                    break
+                pos += header[0]
+            elif buf[pos] == 0xFF and pos + 4 > n:
+                break  # possible header still arriving
+            else:
+                pos += 1  # junk between frames: pass it through with the next frame
+        return pos
+
+
+def iter_frame_chunks(mp3: bytes, chunk_ms: int = 240) -> Generator[bytes, None, None]:
+    """Slice a complete MP3 into chunks of roughly ``chunk_ms`` that end on frame boundaries."""
+    view = memoryview(mp3)
+    total = len(mp3)
+    start = pos = 0
+    chunk_s = chunk_ms / 1000.0
+    elapsed = 0.0
+    while pos < total:
+        tag = _id3_length(view, pos)
+        if tag is not None:
+            pos = min(total, pos + tag)
+            continue
+        header = parse_frame_header(view, pos)
+        if header is None:
+            pos += 1
+            continue
+        length, sample_rate, samples = header
+        pos = min(total, pos + length)
+        elapsed += samples / sample_rate
+        if elapsed >= chunk_s:
+            yield bytes(view[start:pos])
+            start = pos
+            elapsed = 0.0
+    if start < total:
+        yield bytes(view[start:total])
+
+
+async def aiter_frame_chunks(blocks: AsyncIterator[bytes], chunk_ms: int = 240) -> AsyncIterator[bytes]:
+    """Re-chunk an MP3 arriving in arbitrary blocks (e.g. cache ranges) like iter_frame_chunks()."""
+    splitter = Mp3FrameSplitter()
+    async for block in blocks:
+        frames = splitter.feed(block)
+        if frames:
+            for chunk in iter_frame_chunks(frames, chunk_ms):
+                yield chunk
+    tail = splitter.flush()
+    if tail:
+        for chunk in iter_frame_chunks(tail, chunk_ms):
+            yield chunk
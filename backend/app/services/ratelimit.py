@@ -0,0 +1,156 @@
+"""
+GCRA rate limiting per API key and action.
+
+Each (action, key) bucket is a single number, its theoretical arrival time
+(TAT): a request is allowed if TAT - now stays within the burst tolerance, and
+pushes TAT one emission interval (period / limit) further. That is a token
+bucket of `limit` tokens refilled over `period`, checked in O(1). Buckets live
+in Redis, updated by one Lua script so replicas share them atomically, and
+expire as soon as they are full again. If Redis is unavailable, the same check
+runs against a bounded in-process table until RATE_LIMIT_REDIS_RETRY_S has
+passed.
+
+Limits are (requests, seconds) per action and key tier, with defaults for the
+process's LANE that RATE_LIMITS overrides, e.g. "tts.pro=240/60,clone.free=2/86400".
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+import redis
+
+from ..core.security import key_id
+from .cache import get_async_redis
+
+_LANE = os.getenv("LANE", "priority")
+_OVERRIDES = os.getenv("RATE_LIMITS", "")
+_LOCAL_MAX_BUCKETS = int(os.getenv("RATE_LIMIT_LOCAL_MAX_BUCKETS", "100000"))
+_REDIS_RETRY_S = float(os.getenv("RATE_LIMIT_REDIS_RETRY_S", "5"))   # stay on the local fallback this long after an error
+
+# (requests, period seconds) by lane, action and tier
+_DEFAULT_LIMITS = {
+    "priority": {
+        "tts": {"free": (30, 60), "pro": (120, 60), "biz": (120, 60)},
+        "clone": {"free": (1, 86400), "pro": (5, 86400), "biz": (5, 86400)},
+    },
+    "free": {
+        "tts": {"free": (30, 60), "pro": (30, 60), "biz": (30, 60)},
+        "clone": {"free": (1, 86400), "pro": (1, 86400), "biz": (1, 86400)},
+    },
+}
+
+# KEYS[1] bucket; ARGV emission interval and burst tolerance (ms). Returns {allowed, retry after ms, remaining}
+_GCRA_LUA = """
+local t = redis.call('TIME')
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+local interval = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then tat = now end
+if tat - now > tolerance then
+  return {0, tat - tolerance - now, 0}
+end
+tat = tat + interval
+redis.call('SET', KEYS[1], tat, 'PX', tat - now)
+return {1, 0, math.floor((tolerance + interval - (tat - now)) / interval)}
+"""
+
+_REDIS_ERRORS = (redis.RedisError, OSError, asyncio.TimeoutError)
+
+
+def parse_limits(lane: str, overrides: str) -> Dict[str, Dict[str, Tuple[int, float]]]:
+    limits = {action: dict(tiers) for action, tiers in _DEFAULT_LIMITS.get(lane, _DEFAULT_LIMITS["priority"]).items()}
+    for item in filter(None, (part.strip() for part in overrides.split(","))):
+        try:
+            name, value = item.split("=")
+            action, tier = name.split(".")
+            requests, period = value.split("/")
+            limits.setdefault(action, {})[tier] = (int(requests), float(period))
+        except ValueError:
+            raise ValueError(f"RATE_LIMITS entry {item!r} is not action.tier=requests/seconds")
+    return limits
+
+
+class RateLimitResult:
+    __slots__ = ("allowed", "retry_after", "remaining", "limit", "period")
+
+    def __init__(self, allowed: bool, retry_after: float, remaining: int, limit: int, period: float):
+        self.allowed = allowed
+        self.retry_after = retry_after  # seconds until the next request would be allowed
+        self.remaining = remaining
+        self.limit = limit
+        self.period = period
+
+
+class RateLimiter:
+    def __init__(self, lane: str = _LANE, overrides: str = _OVERRIDES,
+                 local_max_buckets: int = _LOCAL_MAX_BUCKETS, redis_retry_s: float = _REDIS_RETRY_S):
+        self.lane = lane
+        self.limits = parse_limits(lane, overrides)
+        self.local_max_buckets = local_max_buckets
+        self.redis_retry_s = redis_retry_s
+        self._local: "OrderedDict[str, float]" = OrderedDict()   # bucket -> TAT (monotonic seconds)
+        self._script = None
+        self._redis_down_until = 0.0
+        self._stats = {"allowed": 0, "limited": 0, "local_checks": 0, "redis_errors": 0}
+
+    def limit_for(self, action: str, tier: str) -> Tuple[int, float]:
+        tiers = self.limits[action]
+        return tiers.get(tier) or tiers["free"]
+
+    async def check(self, action: str, api_key: str, tier: str) -> RateLimitResult:
+        """Take one request from api_key's bucket for action."""
+        limit, period = self.limit_for(action, tier)
+        interval = period / limit
+        tolerance = interval * (limit - 1)  # a full bucket allows `limit` requests at once
+        bucket = f"rl:{self.lane}:{action}:{key_id(api_key)[:32]}"
+
+        result = None
+        if time.monotonic() >= self._redis_down_until:
+            try:
+                if self._script is None:
+                    self._script = get_async_redis().register_script(_GCRA_LUA)
+                allowed, retry_ms, remaining = await self._script(
+                    keys=[bucket], args=[max(1, int(interval * 1000)), int(tolerance * 1000)], client=get_async_redis(),
+                )
+                result = RateLimitResult(bool(allowed), retry_ms / 1000.0, int(remaining), limit, period)
+            except _REDIS_ERRORS as e:
+                self._stats["redis_errors"] += 1
+                self._redis_down_until = time.monotonic() + self.redis_retry_s
+                print(f"Rate limiting falls back to in-process buckets for {self.redis_retry_s:.0f}s: {e}")
+        if result is None:
+            result = self._check_local(bucket, interval, tolerance, limit, period)
+        self._stats["allowed" if result.allowed else "limited"] += 1
+        return result
+
+    def _check_local(self, bucket: str, interval: float, tolerance: float, limit: int, period: float) -> RateLimitResult:
+        self._stats["local_checks"] += 1
+        now = time.monotonic()
+        tat = max(self._local.pop(bucket, now), now)
+        if tat - now > tolerance:
+            self._local[bucket] = tat
+            return RateLimitResult(False, tat - tolerance - now, 0, limit, period)
+        tat += interval
+        self._local[bucket] = tat
+        # Buckets that have refilled hold no state; beyond that, forget the least recently used
+        while self._local:
+            oldest, oldest_tat = next(iter(self._local.items()))
+            if oldest_tat > now and len(self._local) <= self.local_max_buckets:
+                break
+            del self._local[oldest]
+        return RateLimitResult(True, 0.0, int((tolerance + interval - (tat - now)) / interval), limit, period)
+
+    def stats(self) -> dict:
+        return {
+            "lane": self.lane,
+            "limits": {action: {tier: f"{n}/{p:g}s" for tier, (n, p) in tiers.items()} for action, tiers in self.limits.items()},
+            "backend": "local" if time.monotonic() < self._redis_down_until else "redis",
+            "local_buckets": len(self._local),
+            **self._stats,
+        }
+
+
+# Global instance
+rate_limiter = RateLimiter()
@@ -0,0 +1,96 @@
+"""
+Local request log for cache warming.
+
+usage_logs records who used how many characters, not what was said, so the
+texts worth pre-synthesizing come from here instead: when REQUEST_LOG_PATH is
+set, /tts and /tts/stream append one JSON line per request with the canonical
+text, voice and time (optionally sampled with REQUEST_LOG_SAMPLE). Lines are
+buffered and written in batches by a background thread (every
+REQUEST_LOG_FLUSH_EVERY lines or REQUEST_LOG_FLUSH_INTERVAL_S), so logging
+costs a list append per request and never touches the disk on the event loop.
+Only base-voice requests are logged; custom voices need their owner's key to
+synthesize and can't be warmed offline. scripts/warm_cache.py ranks this file.
+"""
+import json
+import os
+import random
+import threading
+import time
+from typing import List, Optional
+
+_PATH = os.getenv("REQUEST_LOG_PATH", "")                        # empty disables the log
+_SAMPLE = float(os.getenv("REQUEST_LOG_SAMPLE", "1.0"))          # fraction of requests logged
+_FLUSH_EVERY = int(os.getenv("REQUEST_LOG_FLUSH_EVERY", "64"))   # lines buffered before a write
+_FLUSH_INTERVAL_S = float(os.getenv("REQUEST_LOG_FLUSH_INTERVAL_S", "5"))
+
+
+class RequestLog:
+    def __init__(self, path: str = _PATH, sample: float = _SAMPLE, flush_every: int = _FLUSH_EVERY,
+                 flush_interval: float = _FLUSH_INTERVAL_S):
+        self.path = path
+        self.sample = sample
+        self.flush_every = max(1, flush_every)
+        self.flush_interval = flush_interval
+        self._buffer: List[str] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._flusher = None
+        self._written = 0
+        self._errors = 0
+
+    def record(self, text: str, voice_id: Optional[str]) -> None:
+        if not self.path or (voice_id or "base") != "base":
+            return
+        if self.sample < 1.0 and random.random() >= self.sample:
+            return
+        line = json.dumps({"t": int(time.time()), "text": text, "voice_id": voice_id}, ensure_ascii=False)
+        with self._lock:
+            self._buffer.append(line)
+            full = len(self._buffer) >= self.flush_every
+        if full:
+            self._wake.set()
+
+    def start(self) -> None:
+        if self.path and self._flusher is None:
+            self._stop.clear()
+            self._flusher = threading.Thread(target=self._run, name="request-log-flusher", daemon=True)
+            self._flusher.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stop the flusher after it has written everything buffered."""
+        self._stop.set()
+        self._wake.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout)
+            self._flusher = None
+        else:
+            self.flush()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+        self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+        if not lines:
+            return
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            self._written += len(lines)
+        except OSError as e:
+            self._errors += 1
+            print(f"Request log write to {self.path} failed ({e}); dropped {len(lines)} lines")
+
+    def stats(self) -> dict:
+        return {"enabled": bool(self.path), "sample": self.sample, "written": self._written,
+                "buffered": len(self._buffer), "errors": self._errors}
+
+
+# Global instance
+request_log = RequestLog()
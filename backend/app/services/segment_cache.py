@@ -0,0 +1,68 @@
+"""
+Segment-level audio cache.
+
+Text is split into sentences with dia.segment_text(pack=False) and each
+sentence's audio is cached on its own (voice + model revision, 16-bit PCM so it
+can be cross-faded losslessly). Sentences shorter than DIA_SEGMENT_MIN_CHARS
+join a neighbour, so fragments are never voiced alone. A request synthesizes only the sentences that
+aren't cached and stitches the rest, so template traffic ("Welcome to ODIA. Your code is 4417." / "Welcome to ODIA.
+Your code is 9021.") shares its common sentences.
+"""
+import os
+from typing import List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from . import dia
+from .cache import cache_key, mget, mset
+
+_ENABLED = os.getenv("AUDIO_SEGMENT_CACHE", "1") == "1"
+_SEGMENT_TTL = int(os.getenv("AUDIO_SEGMENT_TTL", "86400"))
+
+_counters = {"l1_hits": 0, "l2_hits": 0, "misses": 0, "requests": 0, "fully_assembled": 0}
+
+
+def segment_cache_key(segment: str, voice_id: Optional[str], model_rev: Optional[str] = None) -> str:
+    """Same hashing as cache_key(), in its own namespace and tagged with the PCM format."""
+    return "tts:seg:" + cache_key(segment, voice_id, model_rev, f"pcm16@{dia._SAMPLE_RATE}")[len("tts:"):]
+
+
+async def synthesize_with_segments(text: str, voice_id: Optional[str], speaker_embed=None,
+                                   model_rev: Optional[str] = None) -> Tuple[List, List[bool]]:
+    """
+    Segment waveforms for text (join with dia.wavs_to_pcm16), synthesizing only segments missing
+    from the cache, and per segment whether it is a fallback clip rather than speech.
+    """
+    if not _ENABLED:
+        return await run_in_threadpool(dia.synthesize_segment_wavs, dia.segment_text(text) or [text], speaker_embed)
+
+    segments = dia.segment_text(text, pack=False) or [text]
+    keys = [segment_cache_key(segment, voice_id, model_rev) for segment in segments]
+    cached = await mget(keys, _counters)
+    _counters["requests"] += 1
+
+    wavs: List = [None if pcm is None else dia._pcm16_to_wav(pcm) for pcm in cached]
+    fallbacks = [False] * len(wavs)
+    missing = [i for i, wav in enumerate(wavs) if wav is None]
+    if missing:
+        new_wavs, new_fallbacks = await run_in_threadpool(dia.synthesize_segment_wavs, [segments[i] for i in missing], speaker_embed)
+        for i, wav, fell_back in zip(missing, new_wavs, new_fallbacks):
+            wavs[i], fallbacks[i] = wav, fell_back
+        # Fallback tones are never cached as if they were speech
+        await mset(
+            (keys[i], dia._pcm16_bytes(wav), _SEGMENT_TTL)
+            for i, wav, fell_back in zip(missing, new_wavs, new_fallbacks)
+            if not fell_back
+        )
+    else:
+        _counters["fully_assembled"] += 1
+    return wavs, fallbacks
+
+
+def segment_cache_stats() -> dict:
+    lookups = _counters["l1_hits"] + _counters["l2_hits"] + _counters["misses"]
+    return {
+        "enabled": _ENABLED,
+        **_counters,
+        "segment_hit_rate": (_counters["l1_hits"] + _counters["l2_hits"]) / lookups if lookups else 0.0,
+    }
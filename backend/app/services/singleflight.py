@@ -0,0 +1,142 @@
+"""
+Single-flight synthesis of identical cache misses.
+
+Within a process, concurrent callers for the same cache key share one task.
+Across processes, the task first takes a short Redis lease on the key; a process
+that finds the lease held waits for the holder's result to land in the cache
+instead of synthesizing it again. Leases are renewed while synthesis runs and
+released with a compare-and-delete, so a lease that expired and was taken over
+is never deleted by its previous holder. If Redis is unavailable, coalescing
+falls back to in-process only.
+"""
+import asyncio
+import os
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import redis
+
+from .cache import get_async_redis
+from .load import load_breaker
+
+_LEASE_MS = int(os.getenv("CACHE_LEASE_MS", "30000"))            # lease lifetime, renewed while synthesizing
+_LEASE_WAIT_S = float(os.getenv("CACHE_LEASE_WAIT_S", "60"))      # give up waiting on another process after this
+
+_RELEASE_LUA = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+_RENEW_LUA = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) else return 0 end"
+
+_REDIS_ERRORS = (redis.RedisError, OSError, asyncio.TimeoutError)
+
+
+class SingleFlight:
+    def __init__(self, lease_ms: int = _LEASE_MS, wait_timeout: float = _LEASE_WAIT_S):
+        self.lease_ms = lease_ms
+        self.wait_timeout = wait_timeout
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._waiters: Dict[str, int] = {}
+        self._stats = {
+            "leaders": 0,             # syntheses actually run
+            "coalesced_local": 0,     # callers that joined a synthesis in this process
+            "coalesced_remote": 0,    # flights served by another process's synthesis
+            "lease_timeouts": 0,      # gave up waiting on another process and synthesized anyway
+        }
+
+    async def do(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        lookup: Callable[[], Awaitable[Optional[Any]]],
+    ) -> Any:
+        """
+        Return compute()'s result for key, running it at most once at a time per key.
+        compute must write its result to the cache; lookup reads it back from there.
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            self._stats["coalesced_local"] += 1
+        else:
+            # A separate task, so one caller going away doesn't cancel everyone else's result
+            task = asyncio.ensure_future(self._run(key, compute, lookup))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            waiters = self._waiters.pop(key) - 1
+            if waiters:
+                self._waiters[key] = waiters
+
+    def waiters(self, key: str) -> int:
+        """Callers in this process currently awaiting key's flight."""
+        return self._waiters.get(key, 0)
+
+    def _done(self, key: str, task: asyncio.Future) -> None:
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # retrieved here in case every caller has gone away
+
+    async def _run(self, key, compute, lookup) -> Any:
+        lease = "lease:" + key
+        token: Optional[str] = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait_timeout
+        delay = 0.05
+        waited = False
+        while True:
+            try:
+                acquired = await get_async_redis().set(lease, token, nx=True, px=self.lease_ms)
+            except _REDIS_ERRORS:
+                acquired, token = True, None
+            if acquired:
+                break
+            # Another process holds the lease; its result will appear in the cache
+            if not waited:
+                waited = True
+                self._stats["coalesced_remote"] += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+            cached = await lookup()
+            if cached is not None:
+                return cached
+            if time.monotonic() >= deadline:
+                self._stats["lease_timeouts"] += 1
+                token = None
+                break
+
+        renew = asyncio.ensure_future(self._renew(lease, token)) if token else None
+        try:
+            # The previous holder may have finished between our cache miss and taking the lease
+            cached = await lookup()
+            if cached is not None:
+                return cached
+            if waited:
+                self._stats["coalesced_remote"] -= 1  # nobody served us after all
+            self._stats["leaders"] += 1
+            started = load_breaker.begin()
+            try:
+                return await compute()
+            finally:
+                load_breaker.end(started)
+        finally:
+            if renew is not None:
+                renew.cancel()
+                try:
+                    await get_async_redis().eval(_RELEASE_LUA, 1, lease, token)
+                except _REDIS_ERRORS:
+                    pass  # expires on its own
+
+    async def _renew(self, lease: str, token: str) -> None:
+        while True:
+            await asyncio.sleep(self.lease_ms / 3000.0)
+            try:
+                await get_async_redis().eval(_RENEW_LUA, 1, lease, token, self.lease_ms)
+            except _REDIS_ERRORS:
+                pass
+
+    def stats(self) -> dict:
+        return {**self._stats, "in_flight": len(self._inflight), "lease_ms": self.lease_ms}
+
+
+# Global instance
+synthesis_flight = SingleFlight()
@@ -0,0 +1,71 @@
+"""
+Pre-converted model snapshots for fast cold starts.
+
+A snapshot directory holds the resolved backend choice (pipeline vs raw model),
+the processor/tokenizer files and the weights as safetensors, plus a small
+``snapshot.json`` manifest. dia.load_model() loads it directly when
+DIA_SNAPSHOT_DIR points at it; safetensors are memory-mapped, so replicas skip
+the hub lookup, the failed pipeline probe and full weight deserialization.
+"""
+import json
+import os
+import time
+from typing import Optional
+
+MANIFEST_NAME = "snapshot.json"
+SNAPSHOT_FORMAT = 1
+
+
+def read_manifest(snapshot_dir: str) -> Optional[dict]:
+    """Return the snapshot manifest, or None if the directory is not a usable snapshot."""
+    path = os.path.join(snapshot_dir, MANIFEST_NAME)
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("format") != SNAPSHOT_FORMAT or manifest.get("backend") not in ("pipeline", "model"):
+        return None
+    return manifest
+
+
+def build_snapshot(model_id: str, out_dir: str, hf_token: Optional[str] = None, revision: Optional[str] = None) -> dict:
+    """
+    Resolve the model exactly as the service would (pipeline first, then raw
+    processor + model) and save whatever loaded into out_dir.
+    """
+    import torch
+    import transformers
+    from . import dia
+
+    start = time.time()
+    dia.load_model(model_id, hf_token, revision)
+    os.makedirs(out_dir, exist_ok=True)
+
+    if dia._PIPE is not None:
+        backend = "pipeline"
+        dia._PIPE.save_pretrained(out_dir, safe_serialization=True)
+        dtype = str(dia._PIPE.model.dtype)
+    elif dia._MODEL is not None and dia._PROCESSOR is not None:
+        backend = "model"
+        dia._PROCESSOR.save_pretrained(out_dir)
+        dia._MODEL.save_pretrained(out_dir, safe_serialization=True)
+        dtype = str(dia._MODEL.dtype)
+    else:
+        raise RuntimeError(f"{model_id} did not load with either backend; nothing to snapshot")
+
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "backend": backend,
+        "model_id": model_id,
+        "revision": revision,
+        "dtype": dtype,
+        "torch_version": torch.__version__,
+        "transformers_version": transformers.__version__,
+        "created_at": int(time.time()),
+        "build_seconds": round(time.time() - start, 2),
+    }
+    # Written last so a half-built directory is never picked up
+    with open(os.path.join(out_dir, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
@@ -0,0 +1,127 @@
+"""
+Stale-while-revalidate across model revisions.
+
+DIA_MODEL_REV is part of every cache key, so a model rollout would otherwise
+miss the whole cache at once. With DIA_STALE_MODEL_REV set to the previous
+revision, a lookup that misses under the current revision may, for
+DIA_STALE_GRACE_S after the rollout, be served the previous revision's entry.
+The current revision's audio is then synthesized in the background at low
+priority: a small bounded queue, CACHE_REVALIDATE_CONCURRENCY workers that only
+start while fewer than CACHE_REVALIDATE_MAX_LIVE syntheses are in flight, and
+the same single-flight lease as live traffic. The rollout time is
+DIA_STALE_ROLLOUT_AT if set, else recorded once in Redis by the first replica
+(without a TTL: a restart long after the rollout must not open a new window),
+so every replica and every restart shares one grace window.
+"""
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+import redis
+
+from ..core.config import settings
+from .cache import get_async_redis
+from .singleflight import synthesis_flight
+
+_STALE_REV = os.getenv("DIA_STALE_MODEL_REV", "")                        # empty disables stale serving
+_GRACE_S = float(os.getenv("DIA_STALE_GRACE_S", "86400"))
+_ROLLOUT_AT = os.getenv("DIA_STALE_ROLLOUT_AT", "")                      # unix time of the rollout; else recorded in Redis
+_CONCURRENCY = int(os.getenv("CACHE_REVALIDATE_CONCURRENCY", "1"))
+_QUEUE_SIZE = int(os.getenv("CACHE_REVALIDATE_QUEUE", "256"))            # further revalidations are dropped
+_MAX_LIVE = int(os.getenv("CACHE_REVALIDATE_MAX_LIVE", "1"))             # live syntheses that hold revalidation back
+
+_REDIS_ERRORS = (redis.RedisError, OSError, asyncio.TimeoutError)
+
+
+class StaleRevision:
+    def __init__(self, stale_rev: str = _STALE_REV, current_rev: Optional[str] = None, grace_s: float = _GRACE_S,
+                 concurrency: int = _CONCURRENCY, queue_size: int = _QUEUE_SIZE, max_live: int = _MAX_LIVE,
+                 rollout_at: str = _ROLLOUT_AT):
+        self.current_rev = current_rev or settings.DIA_MODEL_REV or "main"
+        self.stale_rev = stale_rev if stale_rev and stale_rev != self.current_rev else None
+        self.grace_s = grace_s
+        self.concurrency = max(1, concurrency)
+        self.max_live = max(1, max_live)
+        self._rollout_at = float(rollout_at) if rollout_at else None
+        self._rollout = self._rollout_at or time.time()
+        self._queue: Optional[asyncio.Queue] = None
+        self._queue_size = queue_size
+        self._pending = set()
+        self._workers = []
+        self._stats = {"stale_hits": 0, "revalidated": 0, "revalidate_failed": 0, "dropped": 0}
+
+    async def start(self) -> None:
+        """Learn when this revision was rolled out (first replica to start records it) and start the workers."""
+        if self.stale_rev is None:
+            return
+        if self._rollout_at is None:
+            key = f"tts:rollout:{self.current_rev}"
+            try:
+                r = get_async_redis()
+                # No TTL: the marker must outlive the grace window, or a later restart would start a new one
+                await r.set(key, str(self._rollout), nx=True)
+                self._rollout = float(await r.get(key) or self._rollout)
+            except _REDIS_ERRORS as e:
+                print(f"Could not read rollout time of {self.current_rev} ({e}); grace period starts now "
+                      f"(set DIA_STALE_ROLLOUT_AT to pin it)")
+        self._queue = asyncio.Queue(self._queue_size)
+        self._workers = [asyncio.ensure_future(self._worker()) for _ in range(self.concurrency)]
+        print(f"Serving {self.stale_rev} audio while {self.current_rev} fills the cache "
+              f"(grace ends in {self.grace_remaining():.0f}s)")
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+
+    def grace_remaining(self) -> float:
+        return max(0.0, self._rollout + self.grace_s - time.time())
+
+    def fallback_rev(self) -> Optional[str]:
+        """The revision to look up after a miss, or None once stale serving is over."""
+        if self.stale_rev is None or self.grace_remaining() <= 0:
+            return None
+        return self.stale_rev
+
+    def served(self, key: str, compute: Callable[[], Awaitable[Any]], lookup: Callable[[], Awaitable[Optional[Any]]]) -> None:
+        """Count a stale hit and queue compute() to fill key for the current revision."""
+        self._stats["stale_hits"] += 1
+        if self._queue is None or key in self._pending:
+            return
+        try:
+            self._queue.put_nowait((key, compute, lookup))
+            self._pending.add(key)
+        except asyncio.QueueFull:
+            self._stats["dropped"] += 1
+
+    async def _worker(self) -> None:
+        while True:
+            key, compute, lookup = await self._queue.get()
+            try:
+                # Live requests first: wait until synthesis is (nearly) idle
+                while synthesis_flight.stats()["in_flight"] >= self.max_live:
+                    await asyncio.sleep(0.5)
+                await synthesis_flight.do(key, compute, lookup)
+                self._stats["revalidated"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats["revalidate_failed"] += 1
+                print(f"Revalidation of {key} failed: {type(e).__name__}: {e}")
+            finally:
+                self._pending.discard(key)
+
+    def stats(self) -> dict:
+        return {
+            "current_rev": self.current_rev,
+            "stale_rev": self.stale_rev,
+            "active": self.fallback_rev() is not None,
+            "grace_remaining_s": self.grace_remaining() if self.stale_rev else 0.0,
+            "pending": len(self._pending),
+            **self._stats,
+        }
+
+
+# Global instance
+stale_revision = StaleRevision()
@@ -0,0 +1,46 @@
+"""
+Text canonicalization for cache keys and synthesis.
+
+Texts that sound the same should share one cache entry. canonicalize_text()
+removes differences the model doesn't voice: Unicode normalization form, typographic
+quotes/dashes/spaces, invisible characters, whitespace runs, repeated !/? and a
+missing final full stop after a final letter or digit. The router canonicalizes once and synthesizes the result,
+so cached audio always matches its key. Bump TEXT_CANON_VERSION whenever the
+rules change; it is part of every cache key, so old entries simply stop matching.
+"""
+import re
+import unicodedata
+
+TEXT_CANON_VERSION = 2
+
+# One str.translate() pass: typographic variants to ASCII, invisible characters dropped
+_TRANSLATION = str.maketrans({
+    # single quotes, primes and apostrophes
+    "\u2018": "'", "\u2019": "'", "\u201a": "'", "\u201b": "'", "\u2032": "'",
+    # double quotes and guillemets
+    "\u201c": '"', "\u201d": '"', "\u201e": '"', "\u201f": '"', "\u2033": '"', "\u00ab": '"', "\u00bb": '"',
+    # hyphens and minus (en/em dashes are kept: they are read as pauses)
+    "\u2010": "-", "\u2011": "-", "\u2012": "-", "\u2212": "-",
+    "\u2026": "...",
+    # no-break, typographic and ideographic spaces, tabs and newlines
+    **{chr(c): " " for c in (0x00a0, *range(0x2000, 0x200b), 0x202f, 0x205f, 0x3000, 0x09, 0x0a, 0x0d)},
+    # zero-width characters, BOM and soft hyphen
+    **{chr(c): None for c in (0x200b, 0x200c, 0x200d, 0x2060, 0xfeff, 0x00ad)},
+})
+
+_REPEATED_MARKS = re.compile(r"([!?])\1+")
+
+
+def canonicalize_text(text: str) -> str:
+    """The canonical form of text (idempotent)."""
+    if not unicodedata.is_normalized("NFC", text):
+        text = unicodedata.normalize("NFC", text)
+    # split()/join collapses every whitespace run and trims both ends in C
+    text = " ".join(text.translate(_TRANSLATION).split())
+    if "!!" in text or "??" in text:
+        text = _REPEATED_MARKS.sub(r"\1", text)
+    # "Hello" and "Hello." are read identically. Only a final letter or digit gets a stop: any
+    # mark already there (",", ":", "\u2014", "\u0964", "\u061f", a closing quote...) is voiced as written
+    if text and text[-1].isalnum():
+        text += "\u3002" if "\u3040" <= text[-1] <= "\u9fff" else "."
+    return text
@@ -0,0 +1,197 @@
+"""
+CPU topology: how many cores each model replica gets and how torch uses them.
+
+A replica is either an inference worker process (DIA_WORKERS > 0) or an API
+process synthesizing in-process (one per uvicorn worker / lane). Each replica is
+pinned to its own core set and sizes its intra-op pool to that set, so replicas
+sharing a host don't oversubscribe cores.
+
+DIA_TOPOLOGY is "auto" (split the cores this process may use evenly and
+contiguously) or a JSON document / path to a JSON file:
+
+    {"replicas": [{"cores": "0-7", "intra_op": 8, "inter_op": 1},
+                  {"cores": "8-15"}]}
+
+API processes claim a replica slot with a lock file, so lanes started
+independently (scripts/start_free.sh, start_priority.sh) never share cores.
+"""
+import fcntl
+import json
+import os
+import tempfile
+from typing import List, Optional
+
+_TOPOLOGY = os.getenv("DIA_TOPOLOGY", "auto")
+_REPLICAS = int(os.getenv("DIA_REPLICAS", os.getenv("WEB_CONCURRENCY", "1")))  # in-process replicas on this host
+_INTRA_OP = int(os.getenv("DIA_WORKER_TORCH_THREADS", "0"))                     # 0 = one per pinned core
+_INTEROP = int(os.getenv("DIA_WORKER_INTEROP_THREADS", "1"))
+_LOCK_DIR = os.getenv("DIA_TOPOLOGY_LOCK_DIR", tempfile.gettempdir())
+
+_PROCESS_LAYOUT = None  # ReplicaLayout applied to this process
+_SLOT_LOCK = None       # open lock file holding this process's replica slot
+
+
+class ReplicaLayout:
+    __slots__ = ("index", "cores", "intra_op", "inter_op", "pinned")
+
+    def __init__(self, index: int, cores: List[int], intra_op: int = 0, inter_op: int = 1):
+        self.index = index
+        self.cores = cores
+        self.intra_op = intra_op or max(1, len(cores))
+        self.inter_op = max(1, inter_op)
+        self.pinned = False
+
+    def as_dict(self) -> dict:
+        return {
+            "replica": self.index,
+            "cores": format_cores(self.cores),
+            "intra_op_threads": self.intra_op,
+            "inter_op_threads": self.inter_op,
+            "pinned": self.pinned,
+        }
+
+
+def parse_cores(spec) -> List[int]:
+    """'0-3,8' or [0, 1, 2, 3, 8] -> [0, 1, 2, 3, 8]"""
+    if isinstance(spec, (list, tuple)):
+        return sorted({int(c) for c in spec})
+    cores = set()
+    for part in str(spec).split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            lo, hi = part.split("-", 1)
+            cores.update(range(int(lo), int(hi) + 1))
+        else:
+            cores.add(int(part))
+    return sorted(cores)
+
+
+def format_cores(cores: List[int]) -> str:
+    """[0, 1, 2, 3, 8] -> '0-3,8'"""
+    ranges = []
+    for core in sorted(cores):
+        if ranges and core == ranges[-1][1] + 1:
+            ranges[-1][1] = core
+        else:
+            ranges.append([core, core])
+    return ",".join(str(lo) if lo == hi else f"{lo}-{hi}" for lo, hi in ranges)
+
+
+def available_cores() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def auto_layouts(replicas: int, intra_op: int = _INTRA_OP, inter_op: int = _INTEROP, cores: Optional[List[int]] = None) -> List[ReplicaLayout]:
+    """Split cores into `replicas` contiguous, equally sized sets (cores are shared only if replicas > cores)."""
+    cores = cores or available_cores()
+    replicas = max(1, replicas)
+    if replicas > len(cores):
+        return [ReplicaLayout(i, [cores[i % len(cores)]], intra_op or 1, inter_op) for i in range(replicas)]
+    per, extra = divmod(len(cores), replicas)
+    layouts, start = [], 0
+    for i in range(replicas):
+        size = per + (1 if i < extra else 0)
+        layouts.append(ReplicaLayout(i, cores[start:start + size], intra_op, inter_op))
+        start += size
+    return layouts
+
+
+def _read_config(spec: str) -> dict:
+    if spec.lstrip().startswith("{"):
+        return json.loads(spec)
+    with open(spec) as f:
+        return json.load(f)
+
+
+def load_layouts(replicas: int) -> List[ReplicaLayout]:
+    """The layout for each of `replicas` replicas, from DIA_TOPOLOGY."""
+    if _TOPOLOGY.strip().lower() in ("", "auto"):
+        return auto_layouts(replicas)
+    try:
+        entries = _read_config(_TOPOLOGY).get("replicas") or []
+    except (OSError, ValueError) as e:
+        print(f"Could not read DIA_TOPOLOGY ({e}); using the automatic layout")
+        return auto_layouts(replicas)
+    if not entries:
+        return auto_layouts(replicas)
+    if len(entries) != replicas:
+        print(f"DIA_TOPOLOGY lists {len(entries)} replicas for {replicas}; core sets are reused round-robin")
+    layouts = []
+    for i in range(replicas):
+        entry = entries[i % len(entries)]
+        layouts.append(ReplicaLayout(
+            i,
+            parse_cores(entry.get("cores", format_cores(available_cores()))),
+            int(entry.get("intra_op", _INTRA_OP)),
+            int(entry.get("inter_op", _INTEROP)),
+        ))
+    return layouts
+
+
+def apply_layout(layout: ReplicaLayout) -> ReplicaLayout:
+    """
+    Pin the current process to layout.cores and size torch's thread pools.
+    Call it before the model is loaded; inter-op threads can only be set once per process.
+    """
+    global _PROCESS_LAYOUT
+    # OpenMP/MKL read these when their pools start; set them for anything not yet initialised
+    os.environ["OMP_NUM_THREADS"] = str(layout.intra_op)
+    os.environ["MKL_NUM_THREADS"] = str(layout.intra_op)
+    if hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, layout.cores)
+            layout.pinned = True
+        except OSError as e:
+            print(f"Could not pin replica {layout.index} to cores {format_cores(layout.cores)}: {e}")
+
+    import torch
+    torch.set_num_threads(layout.intra_op)
+    try:
+        torch.set_num_interop_threads(layout.inter_op)
+    except RuntimeError:
+        layout.inter_op = torch.get_num_interop_threads()  # already initialised; report what is in effect
+    _PROCESS_LAYOUT = layout
+    return layout
+
+
+def _claim_slot(replicas: int) -> int:
+    """Take the first free replica slot on this host (held until the process exits)."""
+    global _SLOT_LOCK
+    for index in range(replicas):
+        f = open(os.path.join(_LOCK_DIR, f"dia-replica-{index}.lock"), "w")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            continue
+        _SLOT_LOCK = f
+        return index
+    print(f"All {replicas} replica slots are taken; sharing slot 0's cores")
+    return 0
+
+
+def apply_process_layout() -> ReplicaLayout:
+    """Layout for an API process that synthesizes in-process (DIA_WORKERS=0)."""
+    if _PROCESS_LAYOUT is not None:
+        return _PROCESS_LAYOUT
+    index = _claim_slot(max(1, _REPLICAS)) if _REPLICAS > 1 else 0
+    layout = apply_layout(load_layouts(max(1, _REPLICAS))[index])
+    print(f"Replica {index}: cores {format_cores(layout.cores)}, {layout.intra_op} intra-op / {layout.inter_op} inter-op threads")
+    return layout
+
+
+def topology_stats() -> dict:
+    """Chosen layout for /metrics."""
+    from .workers import get_worker_pool
+
+    pool = get_worker_pool()
+    return {
+        "config": _TOPOLOGY,
+        "host_cores": os.cpu_count(),
+        "process": _PROCESS_LAYOUT.as_dict() if _PROCESS_LAYOUT is not None else None,
+        "workers": pool.layout() if pool is not None else [],
+    }
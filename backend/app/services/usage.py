@@ -1,10 +1,201 @@
+"""
+Buffered usage logging for billing.
+
+log_usage() only appends a record to a bounded in-memory queue; a background
+thread writes them to usage_logs in batches of up to USAGE_BATCH_SIZE, as soon
+as a batch is full or USAGE_FLUSH_INTERVAL_S after the oldest record, with
+USAGE_RETRIES retries and backoff. Whatever can't be written - a batch that
+keeps failing, or records arriving while the queue is full - is appended to
+USAGE_SPILL_PATH and replayed after the next successful insert; a replay file
+only loses rows once their insert succeeded. The spill file may be shared by
+several API processes: appends and the hand-over to the replay file take a
+file lock, and only one process at a time replays. The queue is drained on
+shutdown.
+Every record carries an event_id, so replays and retries of an insert that did
+land are ignored by the database instead of billed twice.
+"""
+import collections
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import List
+
+from postgrest.types import ReturnMethod
+
 from ..core.security import get_supabase_client
 
+_QUEUE_SIZE = int(os.getenv("USAGE_QUEUE_SIZE", "10000"))           # further records spill to disk
+_BATCH_SIZE = int(os.getenv("USAGE_BATCH_SIZE", "500"))
+_FLUSH_INTERVAL_S = float(os.getenv("USAGE_FLUSH_INTERVAL_S", "2"))
+_RETRIES = int(os.getenv("USAGE_RETRIES", "3"))
+_SPILL_PATH = os.getenv("USAGE_SPILL_PATH", "usage_spill.jsonl")
+
+
+def _row(api_key: str, chars: int, duration_ms: int, cache_hit: bool, created_at: float) -> dict:
+    return {
+        "event_id": str(uuid.uuid4()),
+        "api_key": api_key,
+        "chars_used": chars,
+        "duration_ms": duration_ms,
+        "cache_hit": cache_hit,
+        "created_at": datetime.fromtimestamp(created_at, timezone.utc).isoformat(),
+    }
+
+
+class UsageLogger:
+    def __init__(self, queue_size: int = _QUEUE_SIZE, batch_size: int = _BATCH_SIZE,
+                 flush_interval: float = _FLUSH_INTERVAL_S, retries: int = _RETRIES, spill_path: str = _SPILL_PATH):
+        self.queue_size = queue_size
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.spill_path = spill_path
+        self._queue = collections.deque()   # (api_key, chars, duration_ms, cache_hit, time)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._spill_lock = threading.Lock()
+        self._flusher = None
+        self._stats = {"queued": 0, "inserted": 0, "batches": 0, "retries": 0, "spilled": 0,
+                       "replayed": 0, "spill_errors": 0}
+
+    def record(self, api_key: str, chars: int, duration_ms: int, cache_hit: bool) -> None:
+        if not api_key:
+            return
+        item = (api_key, chars, duration_ms, cache_hit, time.time())
+        if len(self._queue) >= self.queue_size:
+            self._spill([_row(*item)])
+            return
+        self._queue.append(item)
+        self._stats["queued"] += 1
+        if len(self._queue) >= self.batch_size:
+            self._wake.set()
+
+    def start(self) -> None:
+        if self._flusher is None:
+            self._stop.clear()
+            self._flusher = threading.Thread(target=self._run, name="usage-flusher", daemon=True)
+            self._flusher.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Stop the flusher after it has written (or spilled) everything queued."""
+        self._stop.set()
+        self._wake.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout)
+            self._flusher = None
+        else:
+            self.flush()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._flush_safely()
+        self._flush_safely()
+
+    def _flush_safely(self) -> None:
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Usage flush failed: {type(e).__name__}: {e}")
+
+    def flush(self) -> None:
+        """Write everything queued now, batch by batch."""
+        while self._queue:
+            batch = []
+            while self._queue and len(batch) < self.batch_size:
+                batch.append(_row(*self._queue.popleft()))
+            if not self._insert(batch, retries=self.retries):
+                self._spill(batch)
+                return  # the database is unhappy: leave the rest for the next tick
+        self._replay()
+
+    def _insert(self, rows: List[dict], retries: int) -> bool:
+        delay = 0.5
+        for attempt in range(retries + 1):
+            try:
+                get_supabase_client().table("usage_logs").upsert(
+                    rows, on_conflict="event_id", ignore_duplicates=True, returning=ReturnMethod.minimal,
+                ).execute()
+                self._stats["inserted"] += len(rows)
+                self._stats["batches"] += 1
+                return True
+            except Exception as e:
+                if attempt == retries:
+                    print(f"Usage insert of {len(rows)} records failed: {e}")
+                    return False
+                self._stats["retries"] += 1
+                self._stop.wait(delay)  # no backoff once shutting down; whatever still fails is spilled
+                delay = min(delay * 2, 10.0)
+        return False
+
+    def _spill(self, rows: List[dict]) -> None:
+        try:
+            with self._spill_lock, open(self.spill_path + ".lock", "a") as lock:
+                # Other processes may be appending too, or moving the file aside for replay
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                with open(self.spill_path, "a", encoding="utf-8") as f:
+                    f.write("".join(json.dumps(row) + "\n" for row in rows))
+            self._stats["spilled"] += len(rows)
+        except OSError as e:
+            self._stats["spill_errors"] += 1
+            print(f"Usage spill to {self.spill_path} failed ({e}); lost {len(rows)} records")
+
+    def _replay(self) -> None:
+        """Insert records spilled earlier; runs after a successful flush, so the database is reachable."""
+        replaying = self.spill_path + ".replay"
+        with open(replaying + ".lock", "a") as replay_lock:
+            try:
+                fcntl.flock(replay_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return  # another process is replaying; whatever is spilled meanwhile waits for the next replay
+            with self._spill_lock, open(self.spill_path + ".lock", "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                if not os.path.exists(replaying):
+                    if not os.path.exists(self.spill_path):
+                        return
+                    os.replace(self.spill_path, replaying)  # new spills start a fresh file
+            self._replay_file(replaying)
+
+    def _replay_file(self, replaying: str) -> None:
+        rows = []
+        with open(replaying, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    pass  # a line cut short by a crash mid-write
+        for i in range(0, len(rows), self.batch_size):
+            if not self._insert(rows[i:i + self.batch_size], retries=0):
+                # Keep what the database hasn't confirmed for the next replay
+                self._truncate(replaying, rows[i:])
+                return
+            self._stats["replayed"] += len(rows[i:i + self.batch_size])
+        os.remove(replaying)
+
+    def _truncate(self, path: str, rows: List[dict]) -> None:
+        """Atomically replace path with rows; if that fails the file is replayed whole (event_id dedupes it)."""
+        tmp = path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write("".join(json.dumps(row) + "\n" for row in rows))
+            os.replace(tmp, path)
+        except OSError as e:
+            self._stats["spill_errors"] += 1
+            print(f"Usage replay file {path} not truncated ({e}); it will be replayed in full")
+
+    def stats(self) -> dict:
+        return {"pending": len(self._queue), "spill_pending": os.path.exists(self.spill_path), **self._stats}
+
+
+# Global instance
+usage_logger = UsageLogger()
+
+
 def log_usage(api_key: str, chars: int, duration_ms: int, cache_hit: bool):
-    # Don't log if api_key is empty
-    if not api_key:
-        return
-    supabase = get_supabase_client()
-    supabase.table("usage_logs").insert({
-        "api_key": api_key, "chars_used": chars, "duration_ms": duration_ms, "cache_hit": cache_hit
-    }).execute()
\ No newline at end of file
+    """Queue one usage record; it reaches usage_logs within USAGE_FLUSH_INTERVAL_S."""
+    usage_logger.record(api_key, chars, duration_ms, cache_hit)
@@ -0,0 +1,148 @@
+"""
+Canonical audio plus derived format variants.
+
+Each synthesis is cached once in a lossless canonical form (encoder.CANONICAL_FORMAT,
+quality="canonical" in cache_key). A response in a given format/bitrate is a
+variant: looked up under its own quality, otherwise transcoded from the canonical
+copy on the encoder pool and kept in the derived cache with a shorter TTL. Only a
+missing canonical copy ever costs a synthesis. The default MP3 variant keeps the
+"standard" quality that set_audio() has always used.
+"""
+import asyncio
+import os
+from typing import AsyncIterator, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from . import dia
+from .assets import audio_assets
+from .cache import as_blocks, cache_key, get_audio, mget, mset, open_stream, set_audio, ttl_for
+from .encoder import CANONICAL_FORMAT, DEFAULT_MP3_BITRATE, MEDIA_TYPES, MP3_BITRATES, encoder_pool
+from .segment_cache import synthesize_with_segments
+
+_VARIANT_TTL = int(os.getenv("AUDIO_VARIANT_TTL", "3600"))  # derived copies are cheap to rebuild
+
+_canonical_counters = {"l1_hits": 0, "l2_hits": 0, "misses": 0}
+_counters = {"variant_hits": 0, "transcodes": 0, "canonical_writes": 0, "fallback_assets": 0}
+
+
+def variant_quality(fmt: str, bitrate: int = DEFAULT_MP3_BITRATE) -> str:
+    """The cache_key quality of a format/bitrate variant."""
+    if fmt == "mp3":
+        return "standard" if bitrate == DEFAULT_MP3_BITRATE else f"mp3@{bitrate}k"
+    return fmt
+
+
+def validate_variant(fmt: str, bitrate: int) -> Optional[str]:
+    """An error message if fmt/bitrate can't be served, else None."""
+    if fmt not in MEDIA_TYPES:
+        return f"format must be one of {', '.join(sorted(MEDIA_TYPES))}"
+    if fmt == "mp3" and bitrate not in MP3_BITRATES:
+        return f"bitrate must be one of {', '.join(map(str, MP3_BITRATES))} kbps"
+    return None
+
+
+def canonical_key(text: str, voice_id: Optional[str], model_rev: Optional[str] = None) -> str:
+    return cache_key(text, voice_id, model_rev, "canonical")
+
+
+async def encode_canonical(wavs: List) -> bytes:
+    """Cross-fade segment waveforms and encode them in the canonical format."""
+    pcm16 = await run_in_threadpool(dia.wavs_to_pcm16, wavs)
+    return await asyncio.wrap_future(encoder_pool.submit(pcm16, dia._SAMPLE_RATE, CANONICAL_FORMAT))
+
+
+async def transcode(canonical: bytes, fmt: str, bitrate: int = DEFAULT_MP3_BITRATE) -> bytes:
+    asset = audio_assets.for_encoded(canonical)
+    if asset is not None:
+        # A fallback tone: every format is encoded once per asset, not once per request
+        _counters["fallback_assets"] += 1
+        return await run_in_threadpool(asset.encoded, fmt, bitrate)
+    _counters["transcodes"] += 1
+    return await asyncio.wrap_future(encoder_pool.submit_transcode(canonical, fmt, bitrate))
+
+
+async def _fallback_canonical(wav) -> Optional[bytes]:
+    """The pre-encoded canonical audio of the fallback asset wav is, if it is one."""
+    asset = audio_assets.match(wav)
+    return await run_in_threadpool(asset.encoded, CANONICAL_FORMAT) if asset is not None else None
+
+
+async def get_canonical(text: str, voice_id: Optional[str], model_rev: Optional[str] = None) -> Optional[bytes]:
+    return (await mget([canonical_key(text, voice_id, model_rev)], _canonical_counters))[0]
+
+
+async def store_canonical(text: str, voice_id: Optional[str], canonical: bytes, model_rev: Optional[str] = None) -> None:
+    _counters["canonical_writes"] += 1
+    await mset([(canonical_key(text, voice_id, model_rev), canonical, ttl_for(text))])
+
+
+async def store_variant(text: str, voice_id: Optional[str], audio: bytes, fmt: str, bitrate: int = DEFAULT_MP3_BITRATE, model_rev: Optional[str] = None) -> None:
+    quality = variant_quality(fmt, bitrate)
+    if quality == "standard":
+        await set_audio(text, voice_id, audio, model_rev)
+    else:
+        await mset([(cache_key(text, voice_id, model_rev, quality), audio, min(_VARIANT_TTL, ttl_for(text)))])
+
+
+async def render_canonical(text: str, voice_id: Optional[str], speaker_embed=None, model_rev: Optional[str] = None) -> Tuple[bytes, bool]:
+    """Synthesize text (reusing cached segments) and cache its canonical audio; returns (canonical, cacheable)."""
+    wavs, fallbacks = await synthesize_with_segments(text, voice_id, speaker_embed, model_rev)
+    if len(wavs) == 1 and fallbacks[0]:
+        # The whole result is one fallback tone: skip encoding, transcode() serves its pre-encoded bytes
+        canonical = await _fallback_canonical(wavs[0])
+        if canonical is not None:
+            return canonical, False
+    canonical = await encode_canonical(wavs)
+    # Fallback tones are served but never cached as speech, even as one segment of many
+    cacheable = not any(fallbacks)
+    if cacheable:
+        await store_canonical(text, voice_id, canonical, model_rev)
+    return canonical, cacheable
+
+
+async def store_streamed(text: str, voice_id: Optional[str], pcm16: bytes, mp3: bytes, cacheable: bool,
+                         model_rev: Optional[str] = None) -> bytes:
+    """
+    Canonical audio for a synthesis that was streamed as the default MP3 variant; unless it fell
+    back, both are cached. Returns the canonical audio.
+    """
+    canonical = None if cacheable else await _fallback_canonical(dia._pcm16_to_wav(pcm16))
+    if canonical is None:
+        canonical = await asyncio.wrap_future(encoder_pool.submit(pcm16, dia._SAMPLE_RATE, CANONICAL_FORMAT))
+    if cacheable:
+        await store_canonical(text, voice_id, canonical, model_rev)
+        await store_variant(text, voice_id, mp3, "mp3", DEFAULT_MP3_BITRATE, model_rev)
+    return canonical
+
+
+async def get_variant(text: str, voice_id: Optional[str], fmt: str, bitrate: int = DEFAULT_MP3_BITRATE, model_rev: Optional[str] = None) -> Optional[bytes]:
+    """The requested variant from the derived cache, else transcoded from the canonical copy, else None."""
+    audio = await get_audio(text, voice_id, model_rev, variant_quality(fmt, bitrate))
+    if audio is not None:
+        _counters["variant_hits"] += 1
+        return audio
+    canonical = await get_canonical(text, voice_id, model_rev)
+    if canonical is None:
+        return None
+    audio = await transcode(canonical, fmt, bitrate)
+    await store_variant(text, voice_id, audio, fmt, bitrate, model_rev)
+    return audio
+
+
+async def stream_variant(text: str, voice_id: Optional[str], model_rev: Optional[str] = None) -> Optional[AsyncIterator[bytes]]:
+    """The default MP3 variant as cached byte blocks, else transcoded from the canonical copy, else None."""
+    blocks = await open_stream(cache_key(text, voice_id, model_rev, variant_quality("mp3")))
+    if blocks is not None:
+        _counters["variant_hits"] += 1
+        return blocks
+    canonical = await get_canonical(text, voice_id, model_rev)
+    if canonical is None:
+        return None
+    audio = await transcode(canonical, "mp3")
+    await store_variant(text, voice_id, audio, "mp3", DEFAULT_MP3_BITRATE, model_rev)
+    return as_blocks(audio)
+
+
+def variant_stats() -> dict:
+    return {"canonical_format": CANONICAL_FORMAT, "canonical": dict(_canonical_counters), **_counters}
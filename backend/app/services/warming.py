@@ -0,0 +1,175 @@
+"""
+Cache warming from request history.
+
+rank_requests() counts canonical (text, voice) pairs in request logs (see
+request_log; plain text files with one request per line work too) and returns
+the most frequent. CacheWarmer pre-synthesizes them through the same path as
+/tts (segment cache, canonical audio, default MP3 variant via set_audio) and
+under the same single-flight lease, so it never duplicates a synthesis that
+live traffic already started. It runs at most `concurrency` syntheses at a time
+and starts at most `rate` per minute; entries already cached cost one lookup
+and no budget. Finished keys are appended to a checkpoint file, so an
+interrupted run resumes where it stopped.
+"""
+import asyncio
+import json
+import os
+import time
+from collections import Counter
+from typing import Callable, Iterable, List, Optional, Set, Tuple
+
+from .cache import peek
+from .encoder import DEFAULT_MP3_BITRATE
+from .singleflight import synthesis_flight
+from .textnorm import canonicalize_text
+from .variants import canonical_key, get_canonical, render_canonical, store_variant, transcode
+
+WarmItem = Tuple[str, Optional[str], int]  # (canonical text, voice_id, request count)
+
+
+def _read_requests(path: str, since: Optional[float]) -> Iterable[Tuple[str, Optional[str]]]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if since is not None and record.get("t", since) < since:
+                    continue
+                yield record.get("text") or "", record.get("voice_id")
+            else:
+                yield line, None
+
+
+def rank_requests(paths: Iterable[str], top: int = 1000, min_count: int = 1,
+                  max_chars: Optional[int] = None, since: Optional[float] = None) -> List[WarmItem]:
+    """The `top` most requested base-voice (text, voice) pairs, most frequent first."""
+    counts: Counter = Counter()
+    for path in paths:
+        for text, voice_id in _read_requests(path, since):
+            if (voice_id or "base") != "base":
+                continue  # custom voices need their owner's embedding
+            text = canonicalize_text(text)
+            if text and (max_chars is None or len(text) <= max_chars):
+                counts[(text, voice_id or None)] += 1
+    return [(text, voice_id, n) for (text, voice_id), n in counts.most_common(top) if n >= min_count]
+
+
+class CacheWarmer:
+    def __init__(self, model_rev: Optional[str], concurrency: int = 1, rate: float = 0.0,
+                 checkpoint: Optional[str] = None, progress: Optional[Callable[[dict], None]] = None,
+                 progress_every: float = 10.0):
+        self.model_rev = model_rev
+        self.concurrency = max(1, concurrency)
+        self.rate = rate                        # syntheses started per minute, 0 = unlimited
+        self.checkpoint = checkpoint
+        self.progress = progress
+        self.progress_every = progress_every
+        self._next_start = 0.0
+        self._pace = asyncio.Lock()
+        self._stats = {"total": 0, "done": 0, "resumed": 0, "cached": 0, "synthesized": 0,
+                       "failed": 0, "chars": 0, "started": 0.0}
+
+    def _load_checkpoint(self) -> Set[str]:
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return set()
+        with open(self.checkpoint, encoding="utf-8") as f:
+            return {line.strip() for line in f if line.strip()}
+
+    def _mark_done(self, key: str) -> None:
+        if self.checkpoint:
+            with open(self.checkpoint, "a", encoding="utf-8") as f:
+                f.write(key + "\n")
+
+    async def _wait_turn(self) -> None:
+        """Token pacing: successive syntheses start at least 60/rate seconds apart."""
+        if self.rate <= 0:
+            return
+        async with self._pace:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + 60.0 / self.rate
+        await asyncio.sleep(start - now)
+
+    async def _warm(self, text: str, voice_id: Optional[str]) -> str:
+        if await get_canonical(text, voice_id, self.model_rev) is not None:
+            return "cached"
+        await self._wait_turn()
+        key = canonical_key(text, voice_id, self.model_rev)
+
+        async def lookup():
+            canonical = await peek(key)
+            return (canonical, True) if canonical is not None else None
+
+        canonical, cacheable = await synthesis_flight.do(
+            key, lambda: render_canonical(text, voice_id, None, self.model_rev), lookup
+        )
+        if not cacheable:
+            return "failed"
+        # The default /tts response, so the first live hit needs no transcode
+        audio = await transcode(canonical, "mp3", DEFAULT_MP3_BITRATE)
+        await store_variant(text, voice_id, audio, "mp3", DEFAULT_MP3_BITRATE, self.model_rev)
+        return "synthesized"
+
+    async def run(self, items: List[WarmItem]) -> dict:
+        done_keys = self._load_checkpoint()
+        queue: asyncio.Queue = asyncio.Queue()
+        for text, voice_id, _ in items:
+            key = canonical_key(text, voice_id, self.model_rev)
+            if key in done_keys:
+                self._stats["resumed"] += 1
+            else:
+                queue.put_nowait((key, text, voice_id))
+        self._stats.update(total=len(items), started=time.monotonic())
+
+        async def worker():
+            while True:
+                try:
+                    key, text, voice_id = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    outcome = await self._warm(text, voice_id)
+                except Exception as e:
+                    print(f"Warming failed for {text[:40]!r}: {type(e).__name__}: {e}")
+                    outcome = "failed"
+                self._stats[outcome] += 1
+                self._stats["done"] += 1
+                if outcome == "synthesized":
+                    self._stats["chars"] += len(text)
+                if outcome != "failed":
+                    self._mark_done(key)
+
+        reporter = asyncio.ensure_future(self._report()) if self.progress else None
+        try:
+            await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        finally:
+            if reporter is not None:
+                reporter.cancel()
+        if self.progress:
+            self.progress(self.stats())
+        return self.stats()
+
+    async def _report(self) -> None:
+        while True:
+            await asyncio.sleep(self.progress_every)
+            self.progress(self.stats())
+
+    def stats(self) -> dict:
+        s = dict(self._stats)
+        elapsed = time.monotonic() - s.pop("started") if self._stats["started"] else 0.0
+        remaining = s["total"] - s["resumed"] - s["done"]
+        per_second = s["done"] / elapsed if elapsed else 0.0
+        return {
+            **s,
+            "remaining": remaining,
+            "elapsed_s": elapsed,
+            "items_per_min": per_second * 60,
+            "synthesized_per_min": s["synthesized"] / elapsed * 60 if elapsed else 0.0,
+            "chars_per_s": s["chars"] / elapsed if elapsed else 0.0,
+            "eta_s": remaining / per_second if per_second else None,
+        }
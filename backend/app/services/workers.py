@@ -0,0 +1,261 @@
+"""
+Out-of-process inference workers.
+
+Each worker process holds its own model replica and serves requests from a shared
+queue, so synthesis never competes with HTTP handling for the API process's GIL.
+Audio comes back through shared memory blocks: only a block name and length cross
+the process boundary, never the pickled audio itself.
+"""
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait as wait_for_exit
+from typing import Generator, Optional
+
+from .assets import audio_assets
+from .topology import ReplicaLayout, apply_layout, load_layouts
+
+_WORKERS = int(os.getenv("DIA_WORKERS", "0"))                            # 0 = synthesize in the API process
+_WORKER_CONCURRENCY = int(os.getenv("DIA_WORKER_CONCURRENCY", os.getenv("DIA_BATCH_MAX_SIZE", "8")))  # requests in flight per worker
+_REQUEST_TIMEOUT = float(os.getenv("DIA_WORKER_TIMEOUT_S", "300"))
+
+_POOL = None  # InferencePool (only ever set in the API process)
+
+
+def _to_shm(data: bytes):
+    """Copy bytes into a new shared memory block; the reader unlinks it."""
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+    shm.buf[:len(data)] = data
+    name = shm.name
+    shm.close()
+    return name, len(data)
+
+
+def _from_shm(name: str, size: int) -> bytes:
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return bytes(shm.buf[:size])
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _worker_main(index, requests, results, model_args, layout: ReplicaLayout, concurrency):
+    """Worker process entry point: pin to the replica's cores, load it, then serve requests on `concurrency` threads."""
+    apply_layout(layout)
+
+    from . import dia
+    try:
+        dia.load_model(*model_args)
+    except Exception as e:
+        # Keep serving: dia falls back to tone audio, same as an in-process load failure
+        print(f"Inference worker {index} could not load model: {e}")
+    results.put((None, "ready", index, layout.as_dict()))
+
+    def serve():
+        while True:
+            msg = requests.get()
+            if msg is None:
+                return
+            req_id, text, speaker_embed, fmt = msg
+            # Lets the API process fail this request at once if the worker dies
+            results.put((req_id, "started", index, os.getpid()))
+            fallback = threading.Event()
+            try:
+                if fmt == "mp3":
+                    results.put((req_id, "chunk", *_to_shm(dia.synthesize(text, speaker_embed, fallback=fallback))))
+                else:
+                    # PCM is streamed window by window as the model produces it
+                    for pcm in dia.synthesize_pcm_stream(text, speaker_embed, fallback=fallback):
+                        results.put((req_id, "chunk", *_to_shm(pcm)))
+                # Whether the audio was a fallback clip (the API process can't tell from the bytes),
+                # and the fallback counters for /metrics, which live in the API process
+                results.put((req_id, "done", fallback.is_set(), dia.audio_assets.take_counts()))
+            except Exception as e:
+                results.put((req_id, "error", f"{type(e).__name__}: {e}", dia.audio_assets.take_counts()))
+
+    threads = [threading.Thread(target=serve, name=f"dia-worker-{index}-{i}", daemon=True) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+class InferencePool:
+    """API-process handle to the worker processes."""
+
+    def __init__(self, size: int, model_args: tuple, concurrency: int = 8):
+        self.size = size
+        self.layouts = load_layouts(size)
+        self._applied = {}  # worker index -> layout as reported by the worker once pinned
+        self.concurrency = max(1, concurrency)
+        self._model_args = model_args
+        self._ctx = mp.get_context("spawn")
+        self._requests = self._ctx.Queue()
+        self._results = self._ctx.Queue()
+        self._procs = [None] * size
+        self._spawned_at = [0.0] * size
+        self._ready = set()
+        self._sinks = {}
+        self._owners = {}  # req_id -> (worker index, pid) while a worker is on it
+        self._ids = itertools.count()
+        self._closed = False
+        for i in range(size):
+            self._spawn(i)
+        threading.Thread(target=self._dispatch, name="dia-pool-dispatch", daemon=True).start()
+        threading.Thread(target=self._monitor, name="dia-pool-monitor", daemon=True).start()
+
+    def _spawn(self, index: int) -> None:
+        proc = self._ctx.Process(
+            target=_worker_main,
+            args=(index, self._requests, self._results, self._model_args, self.layouts[index], self.concurrency),
+            name=f"dia-worker-{index}",
+            daemon=True,
+        )
+        proc.start()
+        self._procs[index] = proc
+        self._spawned_at[index] = time.monotonic()
+
+    def _monitor(self) -> None:
+        """Replace replicas that died (OOM, segfault in native code, ...) as soon as they exit."""
+        while not self._closed:
+            procs = {proc.sentinel: i for i, proc in enumerate(self._procs) if proc is not None}
+            for sentinel in wait_for_exit(list(procs), timeout=1.0):
+                i = procs[sentinel]
+                proc = self._procs[i]
+                if self._closed:
+                    return
+                proc.join(timeout=1.0)
+                print(f"Inference worker {i} exited with code {proc.exitcode}; restarting")
+                self._ready.discard(i)
+                self._fail_requests(lambda owner: owner[1] == proc.pid, f"inference worker {i} exited")
+                # A replica that dies on startup is restarted at most once a second
+                time.sleep(max(0.0, self._spawned_at[i] + 1.0 - time.monotonic()))
+                self._spawn(i)
+
+    def _fail_requests(self, owned, reason: str) -> None:
+        for req_id, owner in list(self._owners.items()):
+            if owned(owner):
+                self._owners.pop(req_id, None)
+                sink = self._sinks.get(req_id)
+                if sink is not None:
+                    sink.put(("error", reason))
+
+    def _dispatch(self) -> None:
+        while True:
+            req_id, kind, a, b = self._results.get()
+            if kind == "started":
+                self._owners[req_id] = (a, b)
+                proc = self._procs[a]
+                if proc is None or proc.pid != b or not proc.is_alive():
+                    # The worker died before we heard from it
+                    self._fail_requests(lambda owner: owner[1] == b, f"inference worker {a} exited")
+                continue
+            if kind in ("done", "error"):
+                self._owners.pop(req_id, None)
+                audio_assets.add_counts(b)
+            if kind == "ready":
+                self._ready.add(a)
+                self._applied[a] = b
+                print(f"Inference worker {a} ready")
+                continue
+            payload = a
+            if kind == "chunk":
+                # Always release the block, even if the caller has gone away
+                payload = _from_shm(a, b)
+            sink = self._sinks.get(req_id)
+            if sink is not None:
+                sink.put((kind, payload))
+
+    def stream(self, text: str, speaker_embed=None, fmt: str = "pcm",
+               fallback: Optional[threading.Event] = None) -> Generator[bytes, None, None]:
+        """
+        Submit one request and yield its audio chunks as the worker produces them.
+        `fallback` is set at the end if the worker produced a fallback clip rather than speech.
+        """
+        req_id = next(self._ids)
+        sink: "queue.Queue" = queue.Queue()
+        self._sinks[req_id] = sink
+        self._requests.put((req_id, text, speaker_embed, fmt))
+        try:
+            while True:
+                try:
+                    kind, payload = sink.get(timeout=_REQUEST_TIMEOUT)
+                except queue.Empty:
+                    raise TimeoutError(f"inference worker did not respond within {_REQUEST_TIMEOUT:.0f}s")
+                if kind == "done":
+                    if payload and fallback is not None:
+                        fallback.set()
+                    return
+                if kind == "error":
+                    raise RuntimeError(f"inference worker failed: {payload}")
+                yield payload
+        finally:
+            # Chunks that arrive after this point are unlinked and dropped by _dispatch
+            self._sinks.pop(req_id, None)
+            self._owners.pop(req_id, None)
+
+    def synthesize(self, text: str, speaker_embed=None, fmt: str = "mp3",
+                   fallback: Optional[threading.Event] = None) -> bytes:
+        return b"".join(self.stream(text, speaker_embed, fmt, fallback))
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.size,
+            "alive": sum(1 for p in self._procs if p is not None and p.is_alive()),
+            "ready": len(self._ready),
+            "in_flight": len(self._sinks),
+            "concurrency_per_worker": self.concurrency,
+            "layout": self.layout(),
+        }
+
+    def queued(self) -> int:
+        """Requests submitted but not yet taken up by a worker slot."""
+        return max(0, len(self._sinks) - len(self._ready) * self.concurrency)
+
+    def layout(self) -> list:
+        """Per-worker core set and thread pools (as applied, once the worker is up)."""
+        return [self._applied.get(i) or layout.as_dict() for i, layout in enumerate(self.layouts)]
+
+    def close(self) -> None:
+        self._closed = True
+        for _ in range(self.size * self.concurrency):
+            self._requests.put(None)
+        for proc in self._procs:
+            if proc is not None:
+                proc.join(timeout=5)
+                if proc.is_alive():
+                    proc.terminate()
+
+
+def start_worker_pool(model_id: str, hf_token: Optional[str] = None, revision: Optional[str] = None) -> Optional[InferencePool]:
+    """Start DIA_WORKERS replicas (no-op when DIA_WORKERS=0)."""
+    global _POOL
+    if _POOL is None and _WORKERS > 0:
+        _POOL = InferencePool(
+            _WORKERS,
+            (model_id, hf_token, revision),
+            concurrency=_WORKER_CONCURRENCY,
+        )
+        layout = "; ".join(f"cores {l['cores']} x{l['intra_op_threads']}" for l in _POOL.layout())
+        print(f"Started {_WORKERS} inference workers ({layout})")
+    return _POOL
+
+
+def workers_enabled() -> bool:
+    return _WORKERS > 0
+
+
+def get_worker_pool() -> Optional[InferencePool]:
+    return _POOL
+
+
+def stop_worker_pool() -> None:
+    global _POOL
+    if _POOL is not None:
+        _POOL.close()
+        _POOL = None
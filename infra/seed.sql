@@ -9,6 +9,12 @@ create table if not exists api_keys (
 
 create index if not exists idx_api_keys_key on api_keys(api_key);
 
+-- Revoked signed API keys (by key id); signed keys themselves are not stored
+create table if not exists revoked_api_keys (
+  key_id text primary key,
+  revoked_at timestamptz default now()
+);
+
 create table if not exists usage_logs (
   id bigserial primary key,
   api_key text not null,
@@ -16,4 +22,7 @@ create table if not exists usage_logs (
   duration_ms int not null,
   cache_hit boolean default false,
   created_at timestamptz default now()
-);
\ No newline at end of file
+);
+
+-- Client-generated id of a usage record: retried and replayed batches are deduplicated on it
+alter table usage_logs add column if not exists event_id uuid unique;
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+CPU acceleration benchmark: real-time factor of fp32 vs int8 vs compiled inference.
+
+Each mode runs in a fresh process (same inputs, same torch thread count) so one
+mode's quantized weights or compiled graphs never leak into another's timings.
+RTF = synthesis seconds / audio seconds; lower is better, < 1.0 is faster than real time.
+
+Usage: python scripts/bench_cpu_accel.py [--modes none int8 compile int8+compile] [--runs 3] [--threads 8]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+
+TEXTS = [
+    "Welcome to ODIA.",
+    "Your order has been confirmed and will arrive on Thursday between nine and noon.",
+    "Thank you for calling. All of our agents are currently busy, please stay on the line "
+    "and your call will be answered in the order it was received.",
+]
+
+
+def run_mode(mode: str, runs: int) -> dict:
+    """Child process body: load with DIA_CPU_ACCEL=mode and time every text."""
+    sys.path.insert(0, BACKEND_DIR)
+    from app.core.config import settings
+    from app.services import dia
+
+    start = time.perf_counter()
+    dia.load_model(settings.DIA_MODEL_ID, settings.HF_TOKEN or None, settings.DIA_MODEL_REV)
+    load_s = time.perf_counter() - start
+
+    rtfs = []
+    for _ in range(runs):
+        for text in TEXTS:
+            t0 = time.perf_counter()
+            wav = dia._synthesize_wav_impl(text, None)
+            elapsed = time.perf_counter() - t0
+            audio_s = max(wav.shape[0] / dia._SAMPLE_RATE, 1e-6)
+            rtfs.append(elapsed / audio_s)
+    return {
+        "mode": mode,
+        "applied": dia.model_info().get("cpu_accel"),
+        "load_s": round(load_s, 2),
+        "rtf_mean": round(statistics.mean(rtfs), 3),
+        "rtf_p95": round(sorted(rtfs)[min(len(rtfs) - 1, int(len(rtfs) * 0.95))], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=["none", "int8", "compile", "int8+compile"])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads (0 = torch default)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        if args.threads:
+            import torch
+            torch.set_num_threads(args.threads)
+        print(json.dumps(run_mode(args.child, args.runs)))
+        return
+
+    print(f"{'mode':<14} {'applied':<18} {'load s':>7} {'RTF mean':>9} {'RTF p95':>8}")
+    for mode in args.modes:
+        env = dict(os.environ, DIA_CPU_ACCEL=mode, DIA_ENABLE_BATCH="0", DIA_WORKERS="0")
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", mode, "--runs", str(args.runs), "--threads", str(args.threads)],
+            env=env, capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            print(f"{mode:<14} failed: {proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else proc.returncode}")
+            continue
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        applied = "+".join(result["applied"] or ["fp32"])
+        print(f"{mode:<14} {applied:<18} {result['load_s']:>7.2f} {result['rtf_mean']:>9.3f} {result['rtf_p95']:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
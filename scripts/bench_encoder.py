@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Encoder benchmark: legacy pydub/ffmpeg export vs the in-process encoder pool.
+Encodes the same synthetic clips through both paths and reports mean/p95 latency.
+
+Usage: python scripts/bench_encoder.py [--seconds 1 5 15] [--runs 20] [--concurrency 4]
+"""
+
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from app.services.encoder import EncoderPool  # noqa: E402
+
+SAMPLE_RATE = 16000
+
+
+def make_clip(seconds: float) -> bytes:
+    """Speech-like test signal: a few harmonics with a slow amplitude envelope."""
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    wav = sum(np.sin(2 * np.pi * f * t) / (i + 1) for i, f in enumerate((180, 360, 720, 1440)))
+    wav *= 0.5 * (1 + np.sin(2 * np.pi * 3 * t)) * 0.3
+    return (wav * 32767).astype(np.int16).tobytes()
+
+
+def pydub_mp3(pcm: bytes) -> bytes:
+    from pydub import AudioSegment
+    buf = io.BytesIO()
+    AudioSegment(pcm, frame_rate=SAMPLE_RATE, sample_width=2, channels=1).export(buf, format="mp3", bitrate="64k")
+    return buf.getvalue()
+
+
+def time_calls(fn, pcm: bytes, runs: int, concurrency: int):
+    latencies = []
+
+    def one(_):
+        start = time.perf_counter()
+        fn(pcm)
+        latencies.append(time.perf_counter() - start)
+
+    wall = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        list(ex.map(one, range(runs)))
+    wall = time.perf_counter() - wall
+    latencies.sort()
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    return statistics.mean(latencies) * 1000, p95 * 1000, runs / wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, nargs="+", default=[1.0, 5.0, 15.0])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=2, help="encoder pool size")
+    args = parser.parse_args()
+
+    pool = EncoderPool(args.threads)
+    paths = {
+        "pydub/ffmpeg mp3": pydub_mp3,
+        "pool mp3": lambda pcm: pool.encode(pcm, SAMPLE_RATE, "mp3"),
+        "pool wav": lambda pcm: pool.encode(pcm, SAMPLE_RATE, "wav"),
+        "pool opus": lambda pcm: pool.encode(pcm, SAMPLE_RATE, "opus"),
+    }
+
+    print(f"runs={args.runs} concurrency={args.concurrency} pool_threads={args.threads}")
+    print(f"{'clip':>6}  {'path':<18} {'mean ms':>9} {'p95 ms':>9} {'enc/s':>8}")
+    for seconds in args.seconds:
+        pcm = make_clip(seconds)
+        # Warm both paths once (imports, codec init)
+        for name, fn in list(paths.items()):
+            try:
+                fn(pcm)
+            except Exception as e:
+                print(f"{seconds:>5.1f}s  {name:<18} skipped: {e}")
+                del paths[name]
+        for name, fn in paths.items():
+            mean_ms, p95_ms, rate = time_calls(fn, pcm, args.runs, args.concurrency)
+            print(f"{seconds:>5.1f}s  {name:<18} {mean_ms:>9.1f} {p95_ms:>9.1f} {rate:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Replica x thread sweep: aggregate synthesis throughput for each CPU layout.
+
+For every (replicas, intra-op threads) combination, start that many replica
+processes, each pinned to its own core set exactly as DIA_TOPOLOGY=auto would
+pin it, wait until all have loaded the model, then let them synthesize for
+--duration seconds at once. Throughput is total audio seconds produced per wall
+second (higher is better) plus requests per second. Combinations that need more
+cores than this process may use are skipped unless --oversubscribe is given.
+
+Usage: python scripts/bench_topology.py [--replicas 1 2 4] [--threads 1 2 4 8] [--duration 30]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+
+TEXTS = [
+    "Welcome to ODIA.",
+    "Your order has been confirmed and will arrive on Thursday between nine and noon.",
+    "Thank you for calling. All of our agents are currently busy, please stay on the line "
+    "and your call will be answered in the order it was received.",
+]
+
+
+def run_replica(cores: str, threads: int, duration: float) -> None:
+    """Child process body: pin, load, report ready, wait for 'go', synthesize until the deadline."""
+    sys.path.insert(0, BACKEND_DIR)
+    from app.core.config import settings
+    from app.services import dia
+    from app.services.topology import ReplicaLayout, apply_layout, parse_cores
+
+    layout = apply_layout(ReplicaLayout(0, parse_cores(cores), threads))
+    dia.load_model(settings.DIA_MODEL_ID, settings.HF_TOKEN or None, settings.DIA_MODEL_REV)
+    print(json.dumps({"ready": True, "pinned": layout.pinned}), flush=True)
+    sys.stdin.readline()
+
+    requests = 0
+    audio_s = 0.0
+    start = time.time()
+    deadline = start + duration
+    while time.time() < deadline:
+        wav = dia._synthesize_wav_impl(TEXTS[requests % len(TEXTS)], None)
+        audio_s += wav.shape[0] / dia._SAMPLE_RATE
+        requests += 1
+    print(json.dumps({"requests": requests, "audio_s": audio_s, "start": start, "end": time.time()}), flush=True)
+
+
+def run_combo(replicas: int, threads: int, duration: float) -> dict:
+    sys.path.insert(0, BACKEND_DIR)
+    from app.services.topology import auto_layouts, format_cores
+
+    env = dict(os.environ, DIA_ENABLE_BATCH="0", DIA_WORKERS="0")
+    procs = []
+    for layout in auto_layouts(replicas, threads):
+        procs.append(subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--child", format_cores(layout.cores),
+             "--threads", str(threads), "--duration", str(duration)],
+            env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+        ))
+    try:
+        # The measurement window opens only once every replica has its model loaded
+        pinned = True
+        for proc in procs:
+            line = _last_json_line(proc)
+            if line is None:
+                raise RuntimeError("a replica exited before it was ready")
+            pinned = pinned and line["pinned"]
+        for proc in procs:
+            proc.stdin.write("go\n")
+            proc.stdin.flush()
+        results = []
+        for proc in procs:
+            line = _last_json_line(proc)
+            if line is None:
+                raise RuntimeError("a replica exited during the run")
+            results.append(line)
+    finally:
+        for proc in procs:
+            if proc.poll() is None:
+                proc.kill()
+
+    wall = max(r["end"] for r in results) - min(r["start"] for r in results)
+    return {
+        "requests": sum(r["requests"] for r in results),
+        "audio_per_s": sum(r["audio_s"] for r in results) / wall,
+        "requests_per_s": sum(r["requests"] for r in results) / wall,
+        "pinned": pinned,
+    }
+
+
+def _last_json_line(proc):
+    """Read stdout until a JSON line arrives (model loading may print other things)."""
+    for line in proc.stdout:
+        line = line.strip()
+        if line.startswith("{"):
+            return json.loads(line)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--replicas", nargs="+", type=int, default=[1, 2, 4])
+    parser.add_argument("--threads", nargs="+", type=int, default=[1, 2, 4, 8])
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of synthesis per combination")
+    parser.add_argument("--oversubscribe", action="store_true", help="also run combinations needing more cores than available")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_replica(args.child, args.threads[0], args.duration)
+        return
+
+    sys.path.insert(0, BACKEND_DIR)
+    from app.services.topology import available_cores
+    cores = len(available_cores())
+
+    print(f"{cores} cores available")
+    print(f"{'replicas':>8} {'threads':>7} {'requests':>9} {'audio s/s':>10} {'req/s':>7} {'pinned':>7}")
+    best = None
+    for replicas in args.replicas:
+        for threads in args.threads:
+            if replicas * threads > cores and not args.oversubscribe:
+                continue
+            try:
+                result = run_combo(replicas, threads, args.duration)
+            except Exception as e:
+                print(f"{replicas:>8} {threads:>7} failed: {e}")
+                continue
+            print(f"{replicas:>8} {threads:>7} {result['requests']:>9} {result['audio_per_s']:>10.3f} "
+                  f"{result['requests_per_s']:>7.2f} {'yes' if result['pinned'] else 'no':>7}")
+            if best is None or result["audio_per_s"] > best[2]:
+                best = (replicas, threads, result["audio_per_s"])
+    if best is not None:
+        print(f"Best: {best[0]} replicas x {best[1]} threads "
+              f"(DIA_WORKERS={best[0]} DIA_WORKER_TORCH_THREADS={best[1]})")
+
+
+if __name__ == "__main__":
+    main()
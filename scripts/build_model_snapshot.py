@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Build a model snapshot for fast replica cold starts.
+
+Resolves the DIA model the same way the service does, then saves the chosen
+backend, processor and safetensors weights to a directory. Point replicas at it
+with DIA_SNAPSHOT_DIR=<out>.
+
+Usage: python scripts/build_model_snapshot.py --out /workspace/snapshots/dia [--model-id ID] [--revision REV]
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from app.core.config import settings  # noqa: E402
+from app.services.snapshot import build_snapshot  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", required=True, help="snapshot directory to write")
+    parser.add_argument("--model-id", default=settings.DIA_MODEL_ID)
+    parser.add_argument("--revision", default=settings.DIA_MODEL_REV)
+    args = parser.parse_args()
+
+    # The snapshot must come from the hub, never from a previous snapshot, and hold the
+    # plain fp32 weights: replicas apply DIA_CPU_ACCEL (int8, compile) themselves after loading
+    os.environ.pop("DIA_SNAPSHOT_DIR", None)
+    os.environ["DIA_CPU_ACCEL"] = "none"
+    manifest = build_snapshot(args.model_id, args.out, settings.HF_TOKEN or None, args.revision)
+    print(json.dumps(manifest, indent=2))
+    print(f"Snapshot written to {args.out}; set DIA_SNAPSHOT_DIR={os.path.abspath(args.out)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Hit rate and cache memory of the fixed and TinyLFU cache policies on a request log.
+
+Replays a request log (REQUEST_LOG_PATH output; plain text lines are spaced
+--interval seconds apart) against a simulated Redis under each policy: fixed
+writes every miss with ttl_for(), tinylfu uses the admission policy from
+app.services.admission with its current CACHE_* settings. Entry sizes are
+estimated from text length (--bytes-per-char, ~600 for 64 kbps MP3). Reports
+hit rate, entries written, and peak and mean resident bytes per policy.
+
+Usage: python scripts/cache_policy_report.py requests.jsonl [--bytes-per-char 600] [--interval 1]
+"""
+
+import argparse
+import heapq
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from app.services.admission import AdmissionPolicy  # noqa: E402
+from app.services.cache import ttl_for  # noqa: E402
+from app.services.textnorm import canonicalize_text  # noqa: E402
+
+
+def load_requests(path: str, interval: float):
+    requests = []
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            t, text, voice_id = n * interval, line, None
+            if line.startswith("{"):
+                try:
+                    record = json.loads(line)
+                    t, text, voice_id = record.get("t", t), record.get("text") or "", record.get("voice_id")
+                except ValueError:
+                    pass
+            text = canonicalize_text(text)
+            if text:
+                requests.append((t, text, voice_id or "base"))
+    requests.sort(key=lambda r: r[0])
+    return requests
+
+
+def simulate(requests, policy: AdmissionPolicy, bytes_per_char: float) -> dict:
+    expires = {}     # key -> expiry time
+    sizes = {}
+    heap = []        # (expiry, key) candidates for removal
+    resident = peak = 0
+    byte_seconds = 0.0
+    hits = writes = 0
+    last_t = requests[0][0]
+
+    for t, text, voice_id in requests:
+        while heap and heap[0][0] <= t:
+            expiry, key = heapq.heappop(heap)
+            if expires.get(key) == expiry:
+                del expires[key]
+                resident -= sizes.pop(key)
+        byte_seconds += resident * (t - last_t)
+        last_t = t
+
+        key = f"{voice_id}|{text}"
+        frequency = policy.record(key)
+        if key in expires:
+            hits += 1
+            extended = policy.on_hit(frequency, expires[key] - t)
+            if extended:
+                expires[key] = t + extended
+                heapq.heappush(heap, (expires[key], key))
+            continue
+        size = int(len(text) * bytes_per_char)
+        ttl = policy.ttl(key, ttl_for(text), size)
+        if ttl > 0:
+            writes += 1
+            expires[key], sizes[key] = t + ttl, size
+            heapq.heappush(heap, (t + ttl, key))
+            resident += size
+            peak = max(peak, resident)
+
+    duration = requests[-1][0] - requests[0][0]
+    return {
+        "hit_rate": hits / len(requests),
+        "writes": writes,
+        "peak_bytes": peak,
+        "mean_bytes": byte_seconds / duration if duration else resident,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path", help="request log (JSON lines with t/text/voice_id, or plain text)")
+    parser.add_argument("--bytes-per-char", type=float, default=600.0, help="estimated cached audio bytes per character")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between plain-text requests")
+    args = parser.parse_args()
+
+    requests = load_requests(args.path, args.interval)
+    if not requests:
+        sys.exit(f"No requests in {args.path}")
+    span = requests[-1][0] - requests[0][0]
+    print(f"{len(requests)} requests, {len({(r[1], r[2]) for r in requests})} distinct, over {span / 3600:.1f} h")
+
+    print(f"{'policy':<10} {'hit rate':>9} {'writes':>8} {'peak MB':>9} {'mean MB':>9}")
+    for mode in ("fixed", "tinylfu"):
+        result = simulate(requests, AdmissionPolicy(mode), args.bytes_per_char)
+        print(f"{mode:<10} {result['hit_rate']:>9.1%} {result['writes']:>8} "
+              f"{result['peak_bytes'] / 1e6:>9.1f} {result['mean_bytes'] / 1e6:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Cache hit-rate gain from text canonicalization on a sample of past request texts.
+
+Reads one request per line, either plain text or JSON with "text" and an optional
+"voice_id", and replays the sample against an unbounded cache (and an LRU of
+--capacity entries if given) twice: keyed on the stripped raw text, as keys were
+before canonicalization, and keyed on canonicalize_text(). Reports both hit
+rates, the gain, the canonical forms that absorbed the most raw variants and the
+canonicalization cost per text.
+
+Usage: python scripts/canon_report.py requests.txt [--capacity 10000] [--top 10]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter, OrderedDict, defaultdict
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+sys.path.insert(0, BACKEND_DIR)
+
+from app.services.textnorm import canonicalize_text  # noqa: E402
+
+
+def load_requests(path: str):
+    requests = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line.strip():
+                continue
+            if line.lstrip().startswith("{"):
+                try:
+                    record = json.loads(line)
+                    requests.append((record.get("text") or "", record.get("voice_id")))
+                    continue
+                except ValueError:
+                    pass
+            requests.append((line, None))
+    return requests
+
+
+def hit_rate(keys, capacity: int = 0) -> float:
+    """Fraction of lookups that hit; capacity 0 means unbounded."""
+    if not keys:
+        return 0.0
+    hits = 0
+    if not capacity:
+        seen = set()
+        for key in keys:
+            hits += key in seen
+            seen.add(key)
+        return hits / len(keys)
+    lru: OrderedDict = OrderedDict()
+    for key in keys:
+        if key in lru:
+            hits += 1
+            lru.move_to_end(key)
+        else:
+            lru[key] = None
+            if len(lru) > capacity:
+                lru.popitem(last=False)
+    return hits / len(keys)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path", help="request texts, one per line (plain or JSON)")
+    parser.add_argument("--capacity", type=int, default=0, help="also simulate an LRU of this many entries")
+    parser.add_argument("--top", type=int, default=10, help="show this many most-merged canonical forms")
+    args = parser.parse_args()
+
+    requests = load_requests(args.path)
+    if not requests:
+        sys.exit(f"No requests in {args.path}")
+
+    raw_keys = [(text.strip(), voice) for text, voice in requests]
+    started = time.perf_counter()
+    canon_keys = [(canonicalize_text(text), voice) for text, voice in requests]
+    elapsed = time.perf_counter() - started
+
+    variants = defaultdict(set)
+    for raw, canon in zip(raw_keys, canon_keys):
+        variants[canon].add(raw)
+
+    print(f"requests:         {len(requests)}")
+    print(f"distinct raw:     {len(set(raw_keys))}")
+    print(f"distinct canon:   {len(variants)}")
+    print(f"canonicalize:     {elapsed / len(requests) * 1e6:.1f} us/text")
+
+    capacities = [0] + ([args.capacity] if args.capacity else [])
+    for capacity in capacities:
+        raw_rate, canon_rate = hit_rate(raw_keys, capacity), hit_rate(canon_keys, capacity)
+        label = f"LRU {capacity}" if capacity else "unbounded"
+        print(f"hit rate ({label}): raw {raw_rate:.1%} -> canonical {canon_rate:.1%} ({canon_rate - raw_rate:+.1%})")
+
+    merged = Counter({canon: len(raws) for canon, raws in variants.items() if len(raws) > 1})
+    if merged and args.top:
+        print(f"\nmost merged ({len(merged)} canonical forms absorbed variants):")
+        for (text, voice), count in merged.most_common(args.top):
+            print(f"  {count:4d} variants -> {text[:70]!r}" + (f" [{voice}]" if voice else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Issue a signed API key (odk1.<key id>.<tier>.<expiry>.<mac>).
+
+Signed keys carry their tier and expiry and are verified by the API with
+API_KEY_SIGNING_SECRET alone, so nothing is written to Supabase; revoke one
+with scripts/revoke_api_key.py.
+
+Usage: python scripts/issue_api_key.py --tier pro [--days 365]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from app.core.security import TIERS, signed_keys  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tier", choices=TIERS, required=True)
+    parser.add_argument("--days", type=float, default=0, help="days until the key expires (0 = never)")
+    args = parser.parse_args()
+
+    if not signed_keys.enabled:
+        sys.exit("API_KEY_SIGNING_SECRET is not set")
+    expires = int(time.time() + args.days * 86400) if args.days else 0
+    print(signed_keys.issue(args.tier, expires))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Revoke an API key: deactivate it in Supabase (signed keys: add its key id to
+revoked_api_keys), then publish the revocation so every API replica drops it
+right away instead of after AUTH_CACHE_TTL or the next revocation sync.
+
+Usage: python scripts/revoke_api_key.py <api-key> [--cache-only]
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from app.core.security import get_supabase_client, is_signed_key, revocation_id, revoke_api_key  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("api_key")
+    parser.add_argument("--cache-only", action="store_true", help="only publish the revocation (key already deactivated)")
+    args = parser.parse_args()
+
+    rid = revocation_id(args.api_key)
+    if not args.cache_only and is_signed_key(args.api_key):
+        get_supabase_client().table("revoked_api_keys").upsert({"key_id": rid}).execute()
+    elif not args.cache_only:
+        result = get_supabase_client().table("api_keys").update({"is_active": False}).eq("api_key", args.api_key).execute()
+        if not result.data:
+            sys.exit("No such API key")
+    listeners = revoke_api_key(args.api_key)
+    print(f"Revoked key {rid[:12]}; {listeners} replica(s) notified")
+
+
+if __name__ == "__main__":
+    main()
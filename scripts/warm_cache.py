@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Warm the audio cache with the most requested texts, e.g. after a deploy or a
+DIA_MODEL_REV bump.
+
+Ranks canonical base-voice texts by frequency in one or more request logs
+(REQUEST_LOG_PATH output, or plain text with one request per line) and
+pre-synthesizes the top ones into Redis for the current model revision. Keep
+--concurrency and --rate low on hosts that also serve live traffic; --threads
+caps this process's torch threads. Re-running with the same --checkpoint skips
+everything already warmed, and entries that are already cached are skipped
+either way.
+
+Usage: python scripts/warm_cache.py requests.jsonl [--top 1000] [--concurrency 1] [--rate 30] [--checkpoint warm.ckpt]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from app.core.config import settings  # noqa: E402
+from app.services import dia  # noqa: E402
+from app.services.admission import admission_policy  # noqa: E402
+from app.services.cache import close_redis  # noqa: E402
+from app.services.warming import CacheWarmer, rank_requests  # noqa: E402
+
+
+def print_progress(stats: dict) -> None:
+    finished = stats["resumed"] + stats["done"]
+    eta = f"{stats['eta_s'] / 60:.1f} min" if stats["eta_s"] is not None else "-"
+    print(
+        f"[{stats['elapsed_s']:7.0f}s] {finished}/{stats['total']} "
+        f"(synthesized {stats['synthesized']}, cached {stats['cached']}, resumed {stats['resumed']}, failed {stats['failed']}) "
+        f"{stats['items_per_min']:.1f} items/min, {stats['synthesized_per_min']:.1f} syntheses/min, "
+        f"{stats['chars_per_s']:.1f} chars/s, eta {eta}",
+        flush=True,
+    )
+
+
+async def warm(args, items) -> dict:
+    warmer = CacheWarmer(
+        settings.DIA_MODEL_REV, concurrency=args.concurrency, rate=args.rate,
+        checkpoint=args.checkpoint, progress=print_progress, progress_every=args.progress,
+    )
+    try:
+        return await warmer.run(items)
+    finally:
+        await close_redis()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("logs", nargs="+", help="request logs (JSON lines or plain text)")
+    parser.add_argument("--top", type=int, default=1000, help="warm this many most frequent texts")
+    parser.add_argument("--min-count", type=int, default=2, help="skip texts requested fewer times")
+    parser.add_argument("--since-hours", type=float, default=None, help="only count requests this recent")
+    parser.add_argument("--concurrency", type=int, default=1, help="syntheses in flight at once")
+    parser.add_argument("--rate", type=float, default=30.0, help="max syntheses started per minute (0 = unlimited)")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads for this process")
+    parser.add_argument("--checkpoint", default=None, help="file of warmed keys, for resuming")
+    parser.add_argument("--progress", type=float, default=10.0, help="seconds between progress lines")
+    parser.add_argument("--dry-run", action="store_true", help="print the ranking and exit")
+    args = parser.parse_args()
+
+    since = time.time() - args.since_hours * 3600 if args.since_hours else None
+    items = rank_requests(args.logs, args.top, args.min_count, settings.MAX_CHARS, since)
+    print(f"{len(items)} texts to warm for model revision {settings.DIA_MODEL_REV}")
+    if args.dry_run:
+        for text, voice_id, count in items:
+            print(f"{count:6d}  {text[:80]!r}" + (f" [{voice_id}]" if voice_id else ""))
+        return
+    if not items:
+        return
+
+    if args.threads:
+        import torch
+        torch.set_num_threads(args.threads)
+    # Warmed texts are known to be popular; don't put them on probation as first sightings
+    admission_policy.mode = "fixed"
+    dia.load_model(settings.DIA_MODEL_ID, settings.HF_TOKEN or None, settings.DIA_MODEL_REV)
+    asyncio.run(warm(args, items))
+
+
+if __name__ == "__main__":
+    main()